@@ -0,0 +1,56 @@
+"""Compare writing the Specimens sheet with different chunk sizes.
+
+A chunk size of 1 flushes every row on its own, as the import used to. The
+database round trips are counted, and `--latency` adds a delay to each one
+to show the effect of a database on another machine.
+
+Uses the database configured in the .env file, every write is rolled back.
+
+    python benchmarks/chunk_flush.py --rows 2000 --latency 5
+"""
+
+import logging
+import time
+import click
+from sqlalchemy import event
+from gpaslocal.db import get_session
+from gpaslocal.importer import specimens
+from gpaslocal.logs import logger
+from generate import sheet_rows
+
+
+@click.command()
+@click.option("--rows", default=2000, help="Number of specimens to write")
+@click.option("--latency", default=0.0, help="Milliseconds added to each statement")
+@click.option(
+    "--chunk-size", "chunk_sizes", default=[1, 100, 1000], multiple=True, type=int
+)
+def main(rows: int, latency: float, chunk_sizes: list[int]):
+    logger.setLevel(logging.WARNING)
+    specimen_rows = list(enumerate(sheet_rows(rows)["Specimens"]))
+    for chunk_size in chunk_sizes:
+        with get_session() as session:
+            statements = 0
+
+            @event.listens_for(session.connection(), "before_cursor_execute")
+            def round_trip(*args):
+                nonlocal statements
+                statements += 1
+                time.sleep(latency / 1000)
+
+            chunks = [
+                specimen_rows[start : start + chunk_size]
+                for start in range(0, rows, chunk_size)
+            ]
+            start = time.perf_counter()
+            specimens(session, chunks, dryrun=True)
+            elapsed = time.perf_counter() - start
+            click.echo(
+                f"chunk size {chunk_size:5d}: {rows} specimens in {elapsed:.2f}s, "
+                f"{statements} statements"
+            )
+            session.rollback()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Generate a RunSampleImport style workbook for the benchmarks.
+
+    python benchmarks/generate.py bench.xlsx --rows 50000
+"""
+
+from datetime import date, timedelta
+import click
+from openpyxl import Workbook
+
+
+def sheet_rows(rows: int) -> dict[str, list[dict]]:
+    run_count = max(1, rows // 100)
+    collection_date = [date(2023, 1, 1) + timedelta(days=i % 365) for i in range(rows)]
+    return {
+        "Runs": [
+            {
+                "code": f"BENCH{i}",
+                "run_date": date(2024, 1, 1) + timedelta(days=i % 365),
+                "site": "Bench",
+                "sequencing_method": "illumina",
+                "machine": "M1",
+                "user": "ab",
+                "number_samples": 100,
+                "flowcell": "fc",
+                "passed_qc": True,
+                "comment": None,
+            }
+            for i in range(run_count)
+        ],
+        "Specimens": [
+            {
+                "owner_site": f"site{i % 3}",
+                "owner_user": f"user{i % 5}",
+                "accession": f"ACC{i}",
+                "collection_date": collection_date[i],
+                "country_sample_taken_code": "GBR",
+                "specimen_type": "sputum",
+                "specimen_qr_code": None,
+                "bar_code": None,
+                "organism": "mtb" if i % 2 else None,
+                "host": "human",
+                "host_diseases": None,
+                "isolation_source": "lung",
+                "lat": 51.0 + (i % 10) / 10,
+                "lon": -1.2,
+            }
+            for i in range(rows)
+        ],
+        "Samples": [
+            {
+                "run_code": f"BENCH{i % run_count}",
+                "accession": f"ACC{i}",
+                "collection_date": collection_date[i],
+                "guid": f"G{i:08d}",
+                "sample_category": "culture",
+                "nucleic_acid_type": "DNA",
+                "dilution_post_initial_concentration": False,
+                "extraction_date": date(2024, 2, 1),
+                "extraction_method": "m",
+                "extraction_protocol": "p",
+                "extraction_user": "u",
+                "illumina_index": None,
+                "input_volume": 1.5,
+                "library_pool_concentration": None,
+                "ont_barcode": None,
+                "dna_amplification": True,
+                "pre_sequence_concentration": 2.5,
+                "prep_kit": "kit",
+                "comment": None,
+                "spike_name_1": f"spike{i % 4}" if i % 3 else None,
+                "spike_quantity_1": str(i % 7) if i % 3 else None,
+            }
+            for i in range(rows)
+        ],
+        "Storage": [
+            {
+                "accession": f"ACC{i}",
+                "collection_date": collection_date[i],
+                "freezer": "F1",
+                "shelf": "S1",
+                "rack": "R1",
+                "tray": "T1",
+                "box": "B1",
+                "box_location": "A1",
+                "storage_qr_code": f"QR{i}",
+                "date_into_storage": date(2024, 3, 1),
+                "notes": None,
+            }
+            for i in range(rows)
+        ],
+    }
+
+
+def write_workbook(path: str, rows: int) -> None:
+    wb = Workbook(write_only=True)
+    for sheet_name, sheet in sheet_rows(rows).items():
+        ws = wb.create_sheet(sheet_name)
+        ws.append(list(sheet[0]))
+        for row in sheet:
+            ws.append(list(row.values()))
+    wb.save(path)
+
+
+@click.command()
+@click.argument("path", type=click.Path())
+@click.option("--rows", default=50000, help="Number of specimens and samples")
+def main(path: str, rows: int):
+    write_workbook(path, rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Compare writing mutations row by row through the ORM with mutation --bulk.
+
+The mutations are written to the first analysis in the database, a chunk of
+BULK_CHUNK_SIZE rows at a time for the bulk upload. The rate is reported
+against the 50000 rows a second aimed for by the bulk upload.
+
+Uses the database configured in the .env file, every write is rolled back.
+
+    python benchmarks/mutations_upsert.py --rows 50000
+"""
+
+import logging
+import time
+import click
+from sqlalchemy import select
+from gpaslocal import models
+from gpaslocal.db import get_session
+from gpaslocal.gpas_upload import (
+    BULK_CHUNK_SIZE,
+    mutation,
+    mutation_staging,
+    upsert_mutations,
+)
+from gpaslocal.logs import logger
+from gpaslocal.upload_models import Mutations
+
+TARGET_RATE = 50000
+
+
+def mutation_rows(rows: int, prediction: str) -> list[tuple[int, Mutations]]:
+    return [
+        (
+            index,
+            Mutations.model_validate(
+                {
+                    "sample_name": "bench",
+                    "Batch": "bench",
+                    "Species": "M. tuberculosis",
+                    "Drug": "INH",
+                    "Gene": "katG",
+                    "Mutation": f"BENCH{index}",
+                    "Position": index,
+                    "Ref": "S",
+                    "Alt": "T",
+                    "Coverage": "30x",
+                    "Prediction": prediction,
+                    "Evidence": "bench",
+                }
+            ),
+        )
+        for index in range(rows)
+    ]
+
+
+def orm(session, mutations: list[tuple[int, Mutations]], analysis_id: int) -> None:
+    for index, mut in mutations:
+        mutation(session, mut, index, True, analysis_id)
+        session.flush()
+
+
+def bulk(session, mutations: list[tuple[int, Mutations]], analysis_id: int) -> None:
+    staging = mutation_staging(session)
+    for start in range(0, len(mutations), BULK_CHUNK_SIZE):
+        upsert_mutations(
+            session,
+            [
+                (index, mut, analysis_id)
+                for index, mut in mutations[start : start + BULK_CHUNK_SIZE]
+            ],
+            True,
+            staging,
+        )
+
+
+@click.command()
+@click.option("--rows", default=10000, help="Number of mutations to write")
+def main(rows: int):
+    logger.setLevel(logging.WARNING)
+    for name, write in (("orm", orm), ("bulk", bulk)):
+        with get_session() as session:
+            analysis_id = session.scalars(select(models.Analysis.id).limit(1)).first()
+            if analysis_id is None:
+                raise click.ClickException("The database has no analysis to write to")
+            for action, prediction in (("insert", "R"), ("update", "S")):
+                mutations = mutation_rows(rows, prediction)
+                start = time.perf_counter()
+                write(session, mutations, analysis_id)
+                elapsed = time.perf_counter() - start
+                click.echo(
+                    f"{name:5s} {action}: {rows} mutations in {elapsed:.2f}s, "
+                    f"{rows / elapsed:.0f} rows/s (target {TARGET_RATE})"
+                )
+            session.rollback()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Compare reading each sheet with pd.read_excel against streaming the workbook.
+
+Each reader runs in its own process so its peak memory can be reported.
+
+    python benchmarks/read_workbook.py --rows 50000
+"""
+
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from contextlib import closing
+import click
+import pandas as pd
+from gpaslocal.workbook import SHEETS, open_workbook, read_sheet
+from generate import write_workbook
+
+
+def read_each_sheet(excel_wb: str) -> int:
+    return sum(len(pd.read_excel(excel_wb, sheet_name=sheet)) for sheet in SHEETS)
+
+
+def stream(excel_wb: str) -> int:
+    with closing(open_workbook(excel_wb)) as wb:
+        return sum(len(chunk) for sheet in SHEETS for chunk in read_sheet(wb, sheet))
+
+
+def measure(read, excel_wb: str, results) -> None:
+    start = time.perf_counter()
+    rows = read(excel_wb)
+    elapsed = time.perf_counter() - start
+    # kilobytes on linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    results.put((rows, elapsed, peak))
+
+
+@click.command()
+@click.option("--rows", default=50000, help="Number of specimens and samples")
+@click.option("--workbook", type=click.Path(), help="Use an existing workbook")
+def main(rows: int, workbook: str | None):
+    with tempfile.TemporaryDirectory() as tmp:
+        if workbook is None:
+            workbook = os.path.join(tmp, "bench.xlsx")
+            write_workbook(workbook, rows)
+
+        results: multiprocessing.Queue = multiprocessing.Queue()
+        for name, read in (
+            ("read_excel per sheet", read_each_sheet),
+            ("stream", stream),
+        ):
+            process = multiprocessing.Process(
+                target=measure, args=(read, workbook, results)
+            )
+            process.start()
+            total, elapsed, peak = results.get()
+            process.join()
+            click.echo(
+                f"{name:20s}: {total} rows in {elapsed:.2f}s, peak memory {peak:.0f}MB"
+            )
+
+
+if __name__ == "__main__":
+    main()
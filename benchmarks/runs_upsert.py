@@ -0,0 +1,67 @@
+"""Compare writing runs row by row through the ORM with the COPY based upsert.
+
+Uses the database configured in the .env file, every write is rolled back.
+
+    python benchmarks/runs_upsert.py --rows 5000
+"""
+
+import logging
+import time
+from datetime import date, timedelta
+import click
+from gpaslocal import models
+from gpaslocal.db import get_session
+from gpaslocal.importer import upsert_runs
+from gpaslocal.logs import logger
+from gpaslocal.lookups import ImportLookups
+from gpaslocal.upload_models import RunImport
+
+
+def run_imports(rows: int, machine: str) -> list[tuple[int, RunImport]]:
+    return [
+        (
+            index,
+            RunImport(
+                code=f"BENCH{index}",
+                run_date=date(2024, 1, 1) + timedelta(days=index % 365),
+                site="Bench",
+                sequencing_method="illumina",
+                machine=machine,
+            ),
+        )
+        for index in range(rows)
+    ]
+
+
+def orm(session, imports: list[tuple[int, RunImport]]) -> None:
+    lookups = ImportLookups()
+    lookups.runs.preload(session, [run_import.code for _, run_import in imports])
+    for _, run_import in imports:
+        if (run_record := lookups.runs.get(session, run_import.code)) is None:
+            run_record = models.Run(code=run_import.code)
+            session.add(run_record)
+            lookups.runs.add(run_import.code, run_record)
+        run_record.update_from_importmodel(run_import)
+    session.flush()
+
+
+def bulk(session, imports: list[tuple[int, RunImport]]) -> None:
+    upsert_runs(session, imports, dryrun=True)
+
+
+@click.command()
+@click.option("--rows", default=1000, help="Number of runs to write")
+def main(rows: int):
+    logger.setLevel(logging.WARNING)
+    for name, write in (("orm", orm), ("bulk", bulk)):
+        with get_session() as session:
+            for action, machine in (("insert", "M1"), ("update", "M2")):
+                start = time.perf_counter()
+                write(session, run_imports(rows, machine))
+                elapsed = time.perf_counter() - start
+                click.echo(f"{name:5s} {action}: {rows} runs in {elapsed:.2f}s")
+            session.rollback()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1,2 @@
 __version__ = "0.0.1"
-__dbrevision__: str = "f4183f1d16d9"
+__dbrevision__: str = "8b1d4e7a2c95"
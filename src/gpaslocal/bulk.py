@@ -0,0 +1,321 @@
+import io
+from contextlib import contextmanager
+from datetime import date
+from typing import Any, Iterable, Iterator, Sequence
+from sqlalchemy import (
+    Column,
+    ColumnElement,
+    Enum,
+    MetaData,
+    Row,
+    Select,
+    String,
+    Table,
+    Text,
+    cast,
+    delete,
+    literal,
+    literal_column,
+    select,
+    text,
+    tuple_,
+    update,
+)
+from sqlalchemy.dialects.postgresql import Insert, insert as pg_insert
+from sqlalchemy.orm import Session
+from sqlalchemy_continuum import versioning_manager, version_class  # type: ignore
+from sqlalchemy_continuum.operation import Operation  # type: ignore
+
+# rows written by each statement
+BATCH_SIZE = 1000
+
+
+def upsert(
+    session: Session,
+    model: type[Any],
+    rows: Sequence[dict[str, Any]],
+    index_elements: Sequence[str],
+) -> list[Row]:
+    """Insert or update rows keyed on a unique constraint.
+
+    The rows are written with one statement per BATCH_SIZE rows, each key may
+    only appear once. Returns the id, key columns and an `inserted` flag for
+    the rows that were inserted or had a value changed, rows that already
+    match the database are left untouched and are not returned. Version rows
+    are written for the returned rows so the history matches what the ORM
+    would have recorded.
+    """
+    result = []
+    for start in range(0, len(rows), BATCH_SIZE):
+        batch = rows[start : start + BATCH_SIZE]
+        insert = pg_insert(model.__table__).values(list(batch))
+        result.extend(
+            upsert_changed(session, model, insert, list(batch[0]), index_elements)
+        )
+    return result
+
+
+def merge(
+    session: Session,
+    model: type[Any],
+    source: Select,
+    index_elements: Sequence[str],
+) -> list[Row]:
+    """Insert or update the rows of a select, usually from a staging table.
+
+    The selected columns are labelled with the names of the model's columns.
+    Behaves as `upsert`, but with a single statement however many rows there
+    are, so foreign keys can be resolved by joining on natural keys.
+    """
+    columns = [c.name for c in source.selected_columns]
+    insert = pg_insert(model.__table__).from_select(columns, source)
+    return upsert_changed(session, model, insert, columns, index_elements)
+
+
+def upsert_changed(
+    session: Session,
+    model: type[Any],
+    insert: Insert,
+    columns: Sequence[str],
+    index_elements: Sequence[str],
+) -> list[Row]:
+    table = model.__table__
+    update_columns = [c for c in columns if c not in index_elements]
+    stmt = insert.on_conflict_do_update(
+        index_elements=list(index_elements),
+        set_={c: insert.excluded[c] for c in update_columns},
+        # skip the update, and so the version row, when nothing has changed
+        where=tuple_(*[table.c[c] for c in update_columns]).is_distinct_from(
+            tuple_(*[insert.excluded[c] for c in update_columns])
+        ),
+    ).returning(
+        table.c.id,
+        *[table.c[c] for c in index_elements],
+        literal_column("(xmax = 0)").label("inserted"),
+    )
+    result = session.execute(stmt).all()
+
+    record_versions(
+        session, model, [r.id for r in result if r.inserted], Operation.INSERT
+    )
+    record_versions(
+        session, model, [r.id for r in result if not r.inserted], Operation.UPDATE
+    )
+    return result
+
+
+def staging_table(session: Session, name: str, columns: Sequence[str]) -> Table:
+    """Create a temporary table of text columns to stage each chunk of an import.
+
+    Create it once, outside any savepoint, and pass it to `staged` for every
+    chunk. It is dropped when the transaction ends.
+    """
+    table = Table(
+        name,
+        MetaData(),
+        *[Column(column, Text) for column in columns],
+        prefixes=["TEMPORARY"],
+        postgresql_on_commit="DROP",
+    )
+    table.create(session.connection())
+    return table
+
+
+@contextmanager
+def staged(
+    session: Session, rows: Sequence[dict[str, Any]], table: Table | None = None
+) -> Iterator[Table]:
+    """Copy rows into a temporary table of text columns with COPY.
+
+    The values are cast to the types they are written to by the statements
+    reading them. Without a `table` from `staging_table` one is created with
+    columns named after the keys of the first row, and dropped when the
+    block ends. A table from `staging_table` is emptied instead. If the block
+    fails the rows are left for the rollback of the transaction or savepoint
+    they were copied in.
+    """
+    connection = session.connection()
+    if created := table is None:
+        table = Table(
+            "import_staging",
+            MetaData(),
+            *[Column(column, Text) for column in rows[0]],
+            prefixes=["TEMPORARY"],
+        )
+        table.create(connection)
+
+    preparer = connection.dialect.identifier_preparer
+    data = io.StringIO(
+        "".join(
+            "\t".join(copy_text(row[column]) for column in table.c.keys()) + "\n"
+            for row in rows
+        )
+    )
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(  # type: ignore
+            f"COPY {preparer.format_table(table)} "
+            f"({', '.join(preparer.quote(column) for column in table.c.keys())}) "
+            "FROM STDIN",
+            data,
+        )
+    finally:
+        cursor.close()
+
+    yield table
+    if created:
+        table.drop(connection)
+    else:
+        session.execute(text(f"TRUNCATE {preparer.format_table(table)}"))
+
+
+def staged_value(value: ColumnElement, column: ColumnElement) -> ColumnElement:
+    """A staging column cast to the type of the column it is written to"""
+    # text is assigned to varchar as it is, so a value that is too long fails
+    if isinstance(column.type, String) and not isinstance(column.type, Enum):
+        return value
+    return cast(value, column.type)
+
+
+def insert_missing(
+    session: Session, model: type[Any], rows: Sequence[dict]
+) -> list[Row]:
+    """Insert the rows that do not break a unique constraint.
+
+    Returns the id and the columns of each row inserted, rows already in the
+    table are left as they are.
+    """
+    if not rows:
+        return []
+    table = model.__table__
+    result = list(
+        session.execute(
+            pg_insert(table)
+            .values(list(rows))
+            .on_conflict_do_nothing()
+            .returning(table.c.id, *[table.c[c] for c in rows[0]])
+        )
+    )
+    record_versions(session, model, [r.id for r in result], Operation.INSERT)
+    return result
+
+
+def copy_text(value: Any) -> str:
+    """A value in the text format of COPY"""
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        text = "t" if value else "f"
+    elif isinstance(value, date):
+        text = value.isoformat()
+    elif isinstance(value, (list, tuple)):
+        text = (
+            "{"
+            + ",".join(
+                '"' + str(item).replace("\\", "\\\\").replace('"', '\\"') + '"'
+                for item in value
+            )
+            + "}"
+        )
+    else:
+        text = str(value)
+    return (
+        text.replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def delete_ids(session: Session, model: type[Any], ids: Iterable[int]) -> None:
+    """Delete records by id, writing their delete version rows first"""
+    table = model.__table__
+    ids = list(ids)
+    for start in range(0, len(ids), BATCH_SIZE):
+        batch = ids[start : start + BATCH_SIZE]
+        record_versions(session, model, batch, Operation.DELETE)
+        session.execute(delete(table).where(table.c.id.in_(batch)))
+
+
+def current_transaction_id(session: Session) -> int:
+    """Id of the versioning transaction for the session, creating it if needed"""
+    uow = versioning_manager.unit_of_work(session)
+    if (transaction := uow.current_transaction) is None:
+        transaction = uow.create_transaction(session)
+    return transaction.id
+
+
+@contextmanager
+def savepoint(session: Session) -> Iterator[None]:
+    """A savepoint that also rolls back the version rows written inside it.
+
+    sqlalchemy-continuum keeps the version object of each record changed in a
+    transaction so later changes update the same version row. After a rollback
+    the ones created inside the savepoint are forgotten, so records written
+    again are given new version rows, and the rest are reloaded.
+    """
+    # the versioning transaction has to outlive the savepoint
+    current_transaction_id(session)
+    uow = versioning_manager.unit_of_work(session)
+    existing = set(uow.version_objs)
+    try:
+        with session.begin_nested():
+            yield
+    except Exception:
+        for key in list(uow.version_objs):
+            if key in existing:
+                uow.version_session.expire(uow.version_objs[key])
+            else:
+                uow.version_session.expunge(uow.version_objs.pop(key))
+        raise
+
+
+def record_versions(
+    session: Session, model: type[Any], ids: Iterable[int], operation_type: int
+) -> None:
+    """Write version rows for records changed outside of the ORM.
+
+    The current state of each record is copied into the version table and the
+    previous version is closed off, as sqlalchemy-continuum does on flush.
+    Call it after inserts and updates, and before deletes.
+    """
+    if not (ids := list(ids)):
+        return
+
+    table = model.__table__
+    version_table = version_class(model).__table__
+    transaction_id = current_transaction_id(session)
+
+    session.execute(
+        update(version_table)
+        .where(
+            version_table.c.id.in_(ids),
+            version_table.c.transaction_id != transaction_id,
+            version_table.c.end_transaction_id.is_(None),
+        )
+        .values(end_transaction_id=transaction_id)
+    )
+
+    # the version columns are keyed by attribute name, so match them by name
+    version_columns = {c.name: c for c in version_table.c}
+    columns = [c for c in table.c]
+    snapshot = pg_insert(version_table).from_select(
+        [version_columns[c.name] for c in columns]
+        + [version_table.c.transaction_id, version_table.c.operation_type],
+        select(
+            *columns,
+            literal(transaction_id),
+            literal(operation_type),
+        ).where(table.c.id.in_(ids)),
+    )
+    # a record already versioned in this transaction keeps a single version row
+    session.execute(
+        snapshot.on_conflict_do_update(
+            index_elements=["id", "transaction_id"],
+            set_={
+                version_columns[c.name]: snapshot.excluded[version_columns[c.name].key]
+                for c in columns
+                if c.name != "id"
+            },
+        )
+    )
@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime, time, timedelta
+from pathlib import Path
+from typing import Any, Callable, Iterator, Mapping
+import pyarrow as pa  # type: ignore
+import pyarrow.parquet as pq  # type: ignore
+from pydantic import BaseModel
+from gpaslocal import __dbrevision__
+from gpaslocal.config import config
+from gpaslocal.validation import Row
+
+# column holding the index of each row, the sheet row number less two
+INDEX_COLUMN = "__index__"
+
+# bump when the way sheets are read or stored changes, so earlier entries
+# are not used
+CACHE_FORMAT = 1
+
+# a column can hold a mix of types, even a text column holds the dates that
+# were entered, so each value is stored as text tagged with its type
+DECODERS: dict[str, Callable[[str], Any]] = {
+    "s": str,
+    "i": int,
+    "f": float,
+    "b": lambda text: text == "1",
+    "d": datetime.fromisoformat,
+    "t": time.fromisoformat,
+    "T": lambda text: timedelta(seconds=float(text)),
+}
+
+
+def cache_dir() -> Path:
+    if config.CACHE_DIR:
+        return Path(config.CACHE_DIR)
+    return Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "gpaslocal"
+
+
+def cache_size() -> int:
+    """The size the cache is trimmed to in bytes, 0 turns the cache off"""
+    return int(float(config.CACHE_SIZE_MB) * 1024 * 1024)
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while block := file.read(1024 * 1024):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def layout_digest(sheets: Mapping[str, type[BaseModel]]) -> str:
+    """Digest of what an entry holds, the columns of each sheet are the fields
+    of its import model"""
+    content = json.dumps(
+        [
+            CACHE_FORMAT,
+            __dbrevision__,
+            {name: sorted(model.model_fields) for name, model in sheets.items()},
+        ]
+    )
+    return hashlib.sha256(content.encode()).hexdigest()[:16]
+
+
+def entry_path(path: str, sheets: Mapping[str, type[BaseModel]]) -> Path:
+    """The cache entry of a file, a change to the sheets it holds reads it again"""
+    return cache_dir() / f"{file_digest(path)}-{layout_digest(sheets)}"
+
+
+def encode(value: Any) -> str | None:
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "b1" if value else "b0"
+    if isinstance(value, int):
+        return f"i{value}"
+    if isinstance(value, float):
+        return f"f{value!r}"
+    if isinstance(value, datetime):
+        return f"d{value.isoformat()}"
+    if isinstance(value, time):
+        return f"t{value.isoformat()}"
+    if isinstance(value, timedelta):
+        return f"T{value.total_seconds()!r}"
+    if isinstance(value, str):
+        return f"s{value}"
+    raise TypeError(f"Cannot cache a value of type {type(value).__name__}")
+
+
+def decode(text: str | None) -> Any:
+    return None if text is None else DECODERS[text[0]](text[1:])
+
+
+class SheetWriter:
+    """Write the chunks of a sheet as row groups of a Parquet file, a chunk at
+    a time as they are read"""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.writer: pq.ParquetWriter | None = None
+        self.columns: list[str] = []
+
+    def write(self, chunk: list[Row]) -> None:
+        if self.writer is None:
+            self.columns = list(chunk[0][1])
+            self.schema = pa.schema(
+                [(INDEX_COLUMN, pa.int64())]
+                + [(column, pa.string()) for column in self.columns]
+            )
+            self.writer = pq.ParquetWriter(self.path, self.schema)
+        data: dict[str, list] = {INDEX_COLUMN: [index for index, _ in chunk]}
+        for column in self.columns:
+            data[column] = [encode(row[column]) for _, row in chunk]
+        self.writer.write_table(pa.table(data, schema=self.schema))
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+def read_sheet(path: Path, chunk_size: int) -> Iterator[list[Row]]:
+    """Read the chunks of a sheet written by SheetWriter"""
+    if not path.exists():
+        # a sheet without any rows
+        return
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+        columns = batch.to_pydict()
+        indexes = columns.pop(INDEX_COLUMN)
+        columns = {
+            column: list(map(decode, values)) for column, values in columns.items()
+        }
+        yield [
+            (index, {column: values[position] for column, values in columns.items()})
+            for position, index in enumerate(indexes)
+        ]
+
+
+def temporary_entry(entry: Path) -> Path:
+    """A directory to write an entry to, before it is moved into place by store"""
+    entry.parent.mkdir(parents=True, exist_ok=True)
+    return Path(tempfile.mkdtemp(dir=entry.parent, prefix=".tmp-"))
+
+
+def store(entry: Path, temporary: Path) -> None:
+    """Move an entry written to `temporary` into place, then trim the cache.
+
+    An entry is only moved into place once it has been written, so an entry
+    that exists is always complete.
+    """
+    try:
+        temporary.rename(entry)
+    except OSError:
+        # another process stored the same file first
+        if not entry.exists():
+            raise
+    finally:
+        shutil.rmtree(temporary, ignore_errors=True)
+    evict(entry.parent, cache_size(), keep=entry)
+
+
+def touch(entry: Path) -> None:
+    """Mark an entry as used, the least recently used entries are evicted first"""
+    os.utime(entry)
+
+
+def evict(directory: Path, size: int, keep: Path | None = None) -> None:
+    """Remove the least recently used entries until the cache fits in `size`"""
+    entries = []
+    for entry in directory.iterdir():
+        if entry.name.startswith("."):
+            continue
+        entry_size = sum(file.stat().st_size for file in entry.iterdir())
+        entries.append((entry.stat().st_mtime, entry_size, entry))
+
+    total = sum(entry_size for _, entry_size, _ in entries)
+    for _, entry_size, entry in sorted(entries):
+        if total <= size:
+            break
+        if entry != keep:
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= entry_size
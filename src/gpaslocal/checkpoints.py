@@ -0,0 +1,74 @@
+from typing import Iterable, Iterator
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+from gpaslocal import models
+from gpaslocal.cache import file_digest
+from gpaslocal.logs import logger
+from gpaslocal.validation import Row
+
+
+class Checkpoint:
+    """Commits an import a chunk at a time, recording how far each sheet got.
+
+    The progress is keyed by the digest of the file, so an import of the
+    same file started again skips the rows already committed, while an
+    edited file is imported from the start. Nothing more is committed once
+    an error has been logged, the rows after the last commit are rolled
+    back with the rest of the import.
+    """
+
+    def __init__(self, session: Session, excel_wb: str):
+        self.session = session
+        self.digest = file_digest(excel_wb)
+        self.committed = False
+
+    def rows_done(self, sheet: str) -> int:
+        """The number of rows of the sheet committed by an earlier import"""
+        checkpoint = models.ImportCheckpoint
+        return (
+            self.session.execute(
+                select(checkpoint.rows).where(
+                    checkpoint.file_digest == self.digest, checkpoint.sheet == sheet
+                )
+            ).scalar()
+            or 0
+        )
+
+    def skip_done(self, sheet: str, chunks: Iterable[list[Row]]) -> Iterator[list[Row]]:
+        """The chunks of a sheet without the rows committed by an earlier import"""
+        # looked up now, as the chunks are read in another thread
+        done = self.rows_done(sheet)
+        if done:
+            logger.info(
+                f"{sheet} Sheet: resuming from row {done+2}, the rows before it were uploaded earlier"
+            )
+        return (
+            rows
+            for chunk in chunks
+            if (rows := [(index, row) for index, row in chunk if index >= done])
+        )
+
+    def commit(self, sheet: str, rows: int) -> None:
+        """Commit the chunks written so far, the first `rows` rows of the sheet"""
+        if logger.error_occurred:  # type: ignore
+            return
+        insert = pg_insert(models.ImportCheckpoint).values(
+            file_digest=self.digest, sheet=sheet, rows=rows
+        )
+        self.session.execute(
+            insert.on_conflict_do_update(
+                index_elements=["file_digest", "sheet"],
+                set_={"rows": insert.excluded.rows},
+            )
+        )
+        self.session.commit()
+        self.committed = True
+
+    def finish(self) -> None:
+        """Remove the checkpoints of a file that has been imported"""
+        self.session.execute(
+            delete(models.ImportCheckpoint).where(
+                models.ImportCheckpoint.file_digest == self.digest
+            )
+        )
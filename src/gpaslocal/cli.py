@@ -1,13 +1,17 @@
+import glob
+import os
+import multiprocessing
 import sys
 import click
 import click_log  # type: ignore
 from gpaslocal.config import config
-from gpaslocal.importer import import_data
+from gpaslocal.importer import import_data, import_many, validate_data
+from gpaslocal.workbook import CHUNK_SIZE
 from gpaslocal.logs import logger
 from gpaslocal.gpas_upload import import_summary, import_mutation
 
 
-def verify_configuration():
+def verify_configuration() -> None:
     if missing := [
         item for item in config.REQUIRED_KEYS if getattr(config, item, None) is None
     ]:
@@ -16,8 +20,7 @@ def verify_configuration():
             "Ensure the following envirionment variables are set: "
             f"{', '.join(missing)}"
         )
-        return False
-    return True
+        sys.exit(1)
 
 
 @click.group()
@@ -39,41 +42,230 @@ def cli(user: str, password: str, host: str, port: str, database: str):
     config.DATABASE_HOST = host
     config.DATABASE_PORT = port
     config.DATABASE_NAME = database
-    if not verify_configuration():
-        sys.exit(1)
 
 
 @cli.command()
 @click.argument("excel_sheet", type=click.Path(exists=True))
 @click.option("--dryrun", is_flag=True)
-def upload(excel_sheet: str, dryrun: bool):
+@click.option(
+    "--bulk", is_flag=True, help="Write the sheets with COPY and set based statements"
+)
+@click.option(
+    "--chunk-size",
+    default=CHUNK_SIZE,
+    type=click.IntRange(min=1),
+    show_default=True,
+    help="Rows read and written to the database at a time",
+)
+@click.option("--force", is_flag=True, help="Import every row, even if it is unchanged")
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Commit each chunk once written, and carry on from the last one committed when run again",
+)
+@click.option(
+    "--workers",
+    default=1,
+    type=click.IntRange(min=1),
+    show_default=True,
+    help="Processes used to validate the rows",
+)
+@click.option(
+    "--report",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write the outcome of every row to a .csv file, or to a copy of the workbook with the errors highlighted",
+)
+@click.option(
+    "--validate-only",
+    is_flag=True,
+    help="Check the sheet without connecting to the database",
+)
+def upload(
+    excel_sheet: str,
+    dryrun: bool,
+    bulk: bool,
+    chunk_size: int,
+    force: bool,
+    resume: bool,
+    validate_only: bool,
+    workers: int,
+    report: str | None,
+):
     """Upload data from an excel sheet"""
+    if dryrun and resume:
+        raise click.UsageError("--resume commits the upload, it cannot be a dry run")
+    if validate_only:
+        if ignored := [
+            option
+            for option, given in (
+                ("--dryrun", dryrun),
+                ("--bulk", bulk),
+                ("--force", force),
+                ("--resume", resume),
+            )
+            if given
+        ]:
+            raise click.UsageError(
+                f"--validate-only does not upload, it cannot be used with {', '.join(ignored)}"
+            )
+        validate_data(
+            excel_sheet, chunk_size=chunk_size, workers=workers, report=report
+        )
+        return
+
+    verify_configuration()
+    if dryrun:
+        logger.info("Dry run mode, no data will be uploaded")
+    import_data(
+        excel_sheet,
+        dryrun=dryrun,
+        bulk=bulk,
+        chunk_size=chunk_size,
+        force=force,
+        workers=workers,
+        resume=resume,
+        report=report,
+    )
+
+
+@cli.command("upload-many")
+@click.argument("patterns", nargs=-1, required=True)
+@click.option("--dryrun", is_flag=True)
+@click.option(
+    "--bulk", is_flag=True, help="Write the sheets with COPY and set based statements"
+)
+@click.option(
+    "--chunk-size",
+    default=CHUNK_SIZE,
+    type=click.IntRange(min=1),
+    show_default=True,
+    help="Rows read and written to the database at a time",
+)
+@click.option("--force", is_flag=True, help="Import every row, even if it is unchanged")
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Commit each chunk once written, and carry on from the last one committed when run again",
+)
+@click.option(
+    "--jobs",
+    default=1,
+    type=click.IntRange(min=1),
+    show_default=True,
+    help="Workbooks uploaded at the same time",
+)
+@click.option(
+    "--workers",
+    default=1,
+    type=click.IntRange(min=1),
+    show_default=True,
+    help="Processes used to validate the rows",
+)
+def upload_many(
+    patterns: tuple[str, ...],
+    dryrun: bool,
+    bulk: bool,
+    chunk_size: int,
+    force: bool,
+    resume: bool,
+    jobs: int,
+    workers: int,
+):
+    """Upload data from the excel sheets matching glob patterns"""
+    if dryrun and resume:
+        raise click.UsageError("--resume commits the upload, it cannot be a dry run")
+    # patterns are expanded here too, as not every shell does it
+    excel_sheets = list(
+        dict.fromkeys(
+            path
+            for pattern in patterns
+            for path in sorted(glob.glob(pattern)) or [pattern]
+        )
+    )
+    if missing := [path for path in excel_sheets if not os.path.isfile(path)]:
+        raise click.BadParameter(
+            f"No such file: {', '.join(missing)}", param_hint="PATTERNS"
+        )
+
+    verify_configuration()
     if dryrun:
         logger.info("Dry run mode, no data will be uploaded")
-    import_data(excel_sheet, dryrun=dryrun)
+    import_many(
+        excel_sheets,
+        jobs=jobs,
+        dryrun=dryrun,
+        bulk=bulk,
+        chunk_size=chunk_size,
+        force=force,
+        workers=workers,
+        resume=resume,
+    )
 
 
 @cli.command()
 @click.argument("summary_csv", type=click.Path(exists=True))
 @click.argument("mapping_csv", type=click.Path(exists=True))
 @click.option("--dryrun", is_flag=True)
-def summary(summary_csv: str, mapping_csv: str, dryrun: bool):
+@click.option("--force", is_flag=True, help="Import every row, even if it is unchanged")
+@click.option(
+    "--workers",
+    default=1,
+    type=click.IntRange(min=1),
+    show_default=True,
+    help="Processes used to validate the rows",
+)
+def summary(
+    summary_csv: str, mapping_csv: str, dryrun: bool, force: bool, workers: int
+):
     """Upload data from a summary csv"""
+    verify_configuration()
     if dryrun:
         logger.info("Dry run mode, no data will be uploaded")
-    import_summary(summary_csv, mapping_csv, dryrun=dryrun)
+    import_summary(
+        summary_csv, mapping_csv, dryrun=dryrun, force=force, workers=workers
+    )
 
 
 @cli.command()
 @click.argument("mutation_csv", type=click.Path(exists=True))
 @click.argument("mapping_csv", type=click.Path(exists=True))
 @click.option("--dryrun", is_flag=True)
-def mutation(mutation_csv: str, mapping_csv: str, dryrun: bool):
+@click.option(
+    "--bulk",
+    is_flag=True,
+    help="Write the mutations with COPY and set based statements",
+)
+@click.option("--force", is_flag=True, help="Import every row, even if it is unchanged")
+@click.option(
+    "--workers",
+    default=1,
+    type=click.IntRange(min=1),
+    show_default=True,
+    help="Processes used to validate the rows",
+)
+def mutation(
+    mutation_csv: str,
+    mapping_csv: str,
+    dryrun: bool,
+    bulk: bool,
+    force: bool,
+    workers: int,
+):
     """Upload data from a mutation csv"""
+    verify_configuration()
     if dryrun:
         logger.info("Dry run mode, no data will be uploaded")
-    import_mutation(mutation_csv, mapping_csv, dryrun=dryrun)
+    import_mutation(
+        mutation_csv,
+        mapping_csv,
+        dryrun=dryrun,
+        force=force,
+        workers=workers,
+        bulk=bulk,
+    )
 
 
 if __name__ == "__main__":
+    # the validation workers are started by the frozen executable
+    multiprocessing.freeze_support()
     cli()
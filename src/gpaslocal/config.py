@@ -19,6 +19,9 @@ class Config:
         self.DATABASE_HOST = os.environ.get("DATABASE_HOST", None)
         self.DATABASE_PORT = os.environ.get("DATABASE_PORT", None)
         self.DATABASE_NAME = os.environ.get("DATABASE_NAME", None)
+        # parsed workbooks, see gpaslocal.cache
+        self.CACHE_DIR = os.environ.get("CACHE_DIR", None)
+        self.CACHE_SIZE_MB = os.environ.get("CACHE_SIZE_MB", "500")
 
     @property
     def DATABASE_URL(self):
@@ -1,7 +1,8 @@
-from sqlalchemy import create_engine, MetaData, text
+from sqlalchemy import Engine, create_engine, MetaData, text
 from sqlalchemy.orm import sessionmaker, DeclarativeBase, Session
 from gpaslocal.config import config
 from contextlib import contextmanager
+from functools import cache
 from gpaslocal import __dbrevision__
 from gpaslocal.logs import logger
 
@@ -30,10 +31,15 @@ class Model(DeclarativeBase):
     )
 
 
+@cache
+def engine_for(url: str) -> Engine:
+    """One engine, and its connection pool, for every session of the process"""
+    return create_engine(url)
+
+
 @contextmanager
 def get_session():
-    engine = create_engine(config.DATABASE_URL)
-    Session = sessionmaker(engine)
+    Session = sessionmaker(engine_for(config.DATABASE_URL))
     session = Session()
     try:
         yield session
@@ -43,4 +49,3 @@ def get_session():
     finally:
         session.commit()
         session.close()
-        engine.dispose()
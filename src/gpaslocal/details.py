@@ -0,0 +1,89 @@
+from typing import Any
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from gpaslocal.bulk import BATCH_SIZE, delete_ids, upsert
+from gpaslocal.constants import ValueType
+
+VALUE_COLUMNS = [
+    "value_str",
+    "value_int",
+    "value_float",
+    "value_bool",
+    "value_date",
+    "value_text",
+]
+
+
+def sync_details(
+    session: Session,
+    model: type[Any],
+    parent_column: str,
+    type_column: str,
+    values: dict[int, dict[str, Any]],
+    types: dict[str, ValueType],
+) -> None:
+    """Bring the detail records of each parent in line with its values.
+
+    `values` holds the value of each type code keyed by the parent id, a value
+    of None removes the detail. The existing details of each batch of parents
+    are loaded with one query and compared in memory, then the deletes and
+    the inserts and updates are each written with one statement.
+    """
+    parent_ids = list(values)
+    for start in range(0, len(parent_ids), BATCH_SIZE):
+        batch = parent_ids[start : start + BATCH_SIZE]
+        sync_batch(
+            session,
+            model,
+            parent_column,
+            type_column,
+            {parent_id: values[parent_id] for parent_id in batch},
+            types,
+        )
+
+
+def sync_batch(
+    session: Session,
+    model: type[Any],
+    parent_column: str,
+    type_column: str,
+    values: dict[int, dict[str, Any]],
+    types: dict[str, ValueType],
+) -> None:
+    table = model.__table__
+    existing = {
+        (row[1], row[2]): row
+        for row in session.execute(
+            select(
+                table.c.id,
+                table.c[parent_column],
+                table.c[type_column],
+                *[table.c[column] for column in VALUE_COLUMNS],
+            ).where(table.c[parent_column].in_(values))
+        )
+    }
+
+    deletes = []
+    upserts = []
+    for parent_id, parent_values in values.items():
+        for code, value_type in types.items():
+            value = parent_values.get(code)
+            record = existing.get((parent_id, code))
+
+            # if the value is None, and the detail exists, delete it
+            if value is None:
+                if record is not None:
+                    deletes.append(record.id)
+                continue
+
+            row = {column: None for column in VALUE_COLUMNS}
+            row["value_" + value_type] = value
+            if record is not None and all(
+                record._mapping[column] == row[column] for column in VALUE_COLUMNS
+            ):
+                continue
+
+            upserts.append({parent_column: parent_id, type_column: code} | row)
+
+    delete_ids(session, model, deletes)
+    upsert(session, model, upserts, [parent_column, type_column])
@@ -1,17 +1,44 @@
+import logging
+from collections import Counter, deque
+from functools import partial
 from gpaslocal.logs import logger
 from gpaslocal.db import get_session
 from gpaslocal.db import db_revision_ok
 import pandas as pd  # type: ignore
-from progressbar import ProgressBar
+from typing import Any, Iterable, Iterator, Sequence
+from progressbar import ProgressBar, UnknownLength
 from gpaslocal import models
 from gpaslocal.upload_models import GpasSummary, Mutations
+from sqlalchemy import Table, select, tuple_
 from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import Session
-from pydantic import ValidationError
+from gpaslocal.validation import Row, frame_rows, validate_chunks
 from gpaslocal.constants import tb_drugs
+from gpaslocal.type_cache import type_cache
+from gpaslocal.details import sync_details
+from gpaslocal.bulk import merge, savepoint, staged, staging_table, upsert
+from gpaslocal.importer import bisect_chunk, import_values, staged_columns
+from gpaslocal.ledger import changed_rows, record_hashes, upload_started
+from gpaslocal.outcomes import ADDED, UNCHANGED, UPDATED
+from gpaslocal.references import listed_rows
+from gpaslocal.workbook import CHUNK_SIZE
 
+ASSAY_SYSTEM = "GPAS TB"
 
-def import_summary(summary_csv: str, mapping_csv: str, dryrun: bool):
+# mutations copied into the staging table at a time by a bulk upload
+BULK_CHUNK_SIZE = 10000
+
+# a summary without a species or a resistance prediction
+EMPTY = "empty"
+
+
+def import_summary(
+    summary_csv: str,
+    mapping_csv: str,
+    dryrun: bool,
+    force: bool = False,
+    workers: int = 1,
+):
     """Upload data from a summary csv"""
     logger.info(f"Verifying and uploading data to database from Summary {summary_csv}")
     with get_session() as session:
@@ -19,40 +46,47 @@ def import_summary(summary_csv: str, mapping_csv: str, dryrun: bool):
             if not db_revision_ok(session):
                 return False
 
-            df_sum = pd.read_csv(summary_csv)
-            df_map = pd.read_csv(mapping_csv)
+            type_cache.refresh(session)
 
-            df_merged = df_sum.merge(
-                df_map, left_on="Sample ID", right_on="remote_sample_name", how="left"
+            chunks = CsvChunks(
+                session, "Summary", summary_csv, mapping_csv, force, dryrun
             )
-            pbar = ProgressBar(max_value=len(df_merged))
-
-            for index, row in pbar(df_merged.iterrows()):
-                try:
-                    gpas_summary = GpasSummary(**row)
-
-                    analysis_record = analysis(session, gpas_summary, index, dryrun)
-                    session.flush()
-
-                    speciation(session, gpas_summary, index, dryrun, analysis_record)
-                    session.flush()
-
-                    drugs(session, gpas_summary, index, dryrun, analysis_record)
-                    session.flush()
-
-                    details(session, gpas_summary, analysis_record)
-                    session.flush()
-
-                except ValidationError as err:
-                    for error in err.errors():
-                        logger.error(
-                            f"Summary Row {index+2} {error['loc']} : {error['msg']}"
-                        )
-                except DBAPIError as err:
-                    logger.error(f"Summary Row {index+2} : {err}")
-
-                except ValueError as err:
-                    logger.error(f"Summary Row {index+2} : {err}")
+            pbar = ProgressBar(max_value=UnknownLength).start()
+            other_types = type_cache.other_types(session)
+
+            # later chunks are validated while each one is written
+            for summaries in validate_chunks(chunks, GpasSummary, "Summary", workers):
+                resistances = {}
+                others = {}
+                for index, gpas_summary in summaries:
+                    if (analysis_id := chunks.analysis(gpas_summary)) is None:
+                        # the sample was reported by find_samples
+                        continue
+                    try:
+                        chunks.count("Speciation")[
+                            speciation(
+                                session, gpas_summary, index, dryrun, analysis_id
+                            )
+                        ] += 1
+                        session.flush()
+
+                        resistances[analysis_id] = (index, gpas_summary)
+                        others[analysis_id] = {
+                            code: gpas_summary[code] for code in other_types
+                        }
+
+                    except DBAPIError as err:
+                        logger.error(f"Summary Row {index+2} : {err}")
+
+                    except ValueError as err:
+                        logger.error(f"Summary Row {index+2} : {err}")
+                chunks.count("Drug Resistance").update(
+                    drugs(session, resistances, dryrun)
+                )
+                details(session, others)
+                pbar.update(chunks.written())
+            pbar.finish()
+            chunks.log_summary()
 
         except Exception as e:
             logger.error(f"Failed to upload data: {e}")
@@ -72,38 +106,261 @@ def import_summary(summary_csv: str, mapping_csv: str, dryrun: bool):
     return True
 
 
-def find_sample(session: Session, guid: str) -> models.Sample:
-    if sample := (
-        session.query(models.Sample).filter(models.Sample.guid == guid).first()
+def sample_mapping(mapping_csv: str) -> dict[str, dict[Any, Any]]:
+    """The mapping of each column of the mapping csv, from the remote sample name"""
+    df_map = pd.read_csv(mapping_csv)
+    df_map = df_map.drop_duplicates("remote_sample_name", keep="last")
+    return {
+        column: dict(zip(df_map["remote_sample_name"], df_map[column]))
+        for column in df_map.columns
+    }
+
+
+def csv_chunks(
+    csv_path: str, mapping: dict[str, dict[Any, Any]], chunk_size: int = CHUNK_SIZE
+) -> Iterator[list[Row]]:
+    """Read a summary or mutation csv a chunk at a time, joined to the mapping.
+
+    Each row gains the mapping columns of its Sample ID, which are empty
+    when the sample is not in the mapping. Only one chunk is held at a time.
+    """
+    for df in pd.read_csv(csv_path, chunksize=chunk_size):
+        for column, values in mapping.items():
+            df[column] = df["Sample ID"].map(values)
+        yield frame_rows(df)
+
+
+class CsvChunks:
+    """The chunks of a summary or mutation csv that are to be imported.
+
+    The samples of the whole file are found before the first chunk is read,
+    so every missing sample is reported up front, and no chunk is read when
+    any are missing. As each chunk is read, the rows unchanged since the
+    last upload are dropped, and the analyses of the rest are found, adding
+    the missing ones, before the chunk is validated. Call `written` once the
+    rows of each chunk have been written, in the order they were read. Each
+    row is only logged at DEBUG, `log_summary` logs how many records of each
+    kind were written once the upload has finished.
+    """
+
+    def __init__(
+        self,
+        session: Session,
+        name: str,
+        csv_path: str,
+        mapping_csv: str,
+        force: bool,
+        dryrun: bool,
+        chunk_size: int = CHUNK_SIZE,
     ):
-        return sample
-    else:
-        raise ValueError(f"Sample {guid} does not exist")
+        self.session = session
+        self.name = name
+        self.csv_path = csv_path
+        self.mapping = sample_mapping(mapping_csv)
+        self.force = force
+        self.dryrun = dryrun
+        self.chunk_size = chunk_size
+        self.samples: dict[str, int] = {}
+        self.analyses: dict[tuple[int, str], int] = {}
+        # the length and the hashes of each chunk read but not yet written
+        self.pending: deque[tuple[int, dict[str, str | None]]] = deque()
+        self.rows_written = 0
+        self.unchanged = 0
+        # how many records of each kind were added, updated or unchanged
+        self.counts: dict[str, Counter[str]] = {"Analysis": Counter()}
+
+    def __iter__(self) -> Iterator[list[Row]]:
+        started = upload_started(self.session)
+        self.samples, missing = find_samples(
+            self.session, self.name, self.csv_path, self.mapping, self.chunk_size
+        )
+        if missing:
+            # as with the references of a workbook, nothing is written
+            return
+        for chunk in csv_chunks(self.csv_path, self.mapping, self.chunk_size):
+            rows, hashes = changed_rows(
+                self.session,
+                self.name,
+                chunk,
+                self.force,
+                started,
+                [chunk_hashes for _, chunk_hashes in self.pending],
+            )
+            self.unchanged += len(chunk) - len(rows)
+            self.pending.append((len(chunk), hashes))
+
+            # only the analyses not looked up for an earlier chunk
+            self.analyses.update(
+                find_analyses(
+                    self.session,
+                    self.name,
+                    [
+                        row
+                        for row in rows
+                        if self.analysis_key(row[1]) not in self.analyses
+                    ],
+                    self.samples,
+                    self.dryrun,
+                    self.count("Analysis"),
+                )
+            )
+            yield rows
 
+    def analysis_key(self, row: dict[str, Any]) -> tuple[int | None, Any]:
+        return self.samples.get(row.get("sample_name", "")), row.get("Batch")
 
-def analysis(
-    session: Session, row_model: GpasSummary | Mutations, index: int, dryrun: bool
-) -> models.Analysis:
-    sample = find_sample(session, row_model.sample_name)
-    if analysis := (
-        session.query(models.Analysis)
-        .filter(
-            models.Analysis.sample == sample,
-            models.Analysis.batch_name == row_model.batch,
-        )
-        .first()
-    ):
-        analysis.assay_system == "GPAS TB"
-    else:
-        analysis = models.Analysis(
-            sample=sample, batch_name=row_model.batch, assay_system="GPAS TB"
+    def analysis(self, row_model: GpasSummary | Mutations) -> int | None:
+        return analysis(self.samples, self.analyses, row_model)
+
+    def written(self) -> int:
+        """Record the hashes of the oldest chunk, returns the rows written so far"""
+        chunk_length, hashes = self.pending.popleft()
+        record_hashes(self.session, self.name, hashes)
+        self.rows_written += chunk_length
+        return self.rows_written
+
+    def count(self, record: str) -> Counter[str]:
+        return self.counts.setdefault(record, Counter())
+
+    def log_summary(self) -> None:
+        if self.unchanged:
+            logger.info(
+                f"{self.name}: {self.unchanged} rows unchanged since the last upload, skipping"
+            )
+        for record, counts in self.counts.items():
+            actions = (ADDED, UPDATED, UNCHANGED) + ((EMPTY,) if counts[EMPTY] else ())
+            logger.info(f"{record}: " + ", ".join(f"{counts[a]} {a}" for a in actions))
+
+
+def sample_ids(session: Session, guids: Iterable[str]) -> dict[str, int]:
+    """The id of each sample with one of the guids, found with one query"""
+    return dict(
+        session.execute(
+            select(models.Sample.guid, models.Sample.id).where(
+                models.Sample.guid.in_(list(guids))
+            )
         )
-        session.add(analysis)
-        logger.info(
-            f"Row {index+2}: Batch {row_model.batch}, Sample {row_model.sample_name} does not exist{'' if dryrun else ', adding'}"
+        .tuples()
+        .all()
+    )
+
+
+def sample_names(
+    csv_path: str, mapping: dict[str, dict[Any, Any]], chunk_size: int = CHUNK_SIZE
+) -> Iterator[pd.Series]:
+    """The sample name of each row of a csv, a chunk at a time, reading only
+    the Sample ID column"""
+    for df in pd.read_csv(csv_path, usecols=["Sample ID"], chunksize=chunk_size):
+        yield df["Sample ID"].map(mapping.get("sample_name", {}))
+
+
+def find_samples(
+    session: Session,
+    name: str,
+    csv_path: str,
+    mapping: dict[str, dict[Any, Any]],
+    chunk_size: int = CHUNK_SIZE,
+) -> tuple[dict[str, int], set[str]]:
+    """Map the sample of every row of a csv to its id before any row is written.
+
+    The samples are found with one query, and each sample that does not
+    exist is logged once with the rows using it, which are only looked for
+    when a sample is missing. Returns the id of each sample found and the
+    samples that do not exist. Sample names that are missing or not text
+    are left to validation.
+    """
+    guids: set[str] = set()
+    for names in sample_names(csv_path, mapping, chunk_size):
+        guids.update(guid for guid in names.unique() if isinstance(guid, str))
+    if not guids:
+        return {}, set()
+
+    samples = sample_ids(session, guids)
+    if missing := guids - samples.keys():
+        guid_rows: dict[str, list[int]] = {}
+        for names in sample_names(csv_path, mapping, chunk_size):
+            found = names[names.isin(missing)]
+            for index, guid in zip(found.index.tolist(), found.tolist()):
+                guid_rows.setdefault(guid, []).append(index + 2)
+        for guid, numbers in guid_rows.items():
+            logger.error(
+                f"{name} {listed_rows(numbers)} : Sample {guid} does not exist"
+            )
+    return samples, missing
+
+
+def find_analyses(
+    session: Session,
+    name: str,
+    rows: list[Row],
+    samples: dict[str, int],
+    dryrun: bool,
+    counts: Counter[str] | None = None,
+) -> dict[tuple[int, str], int]:
+    """Add or update the analysis of each sample and batch used by the rows.
+
+    The analyses are written with one upsert, which also sets the assay
+    system of the existing ones, before the rows are written. Returns the id
+    of every analysis keyed by its sample id and batch, and adds how many
+    were added, updated or unchanged to `counts`. Batches that will not
+    validate are left to validation.
+    """
+    batch_length = models.Analysis.__table__.c.batch_name.type.length  # type: ignore
+    guids: dict[tuple[int, str], str] = {}
+    for _, row in rows:
+        if (
+            (guid := row.get("sample_name")) in samples
+            and isinstance(batch := row.get("Batch"), str)
+            and len(batch) <= batch_length
+        ):
+            guids[(samples[guid], batch)] = guid
+    if not guids:
+        return {}
+
+    written = upsert(
+        session,
+        models.Analysis,
+        [
+            {"sample_id": sample_id, "batch_name": batch, "assay_system": ASSAY_SYSTEM}
+            for sample_id, batch in guids
+        ],
+        ["sample_id", "batch_name"],
+    )
+    analyses = {(r.sample_id, r.batch_name): r.id for r in written}
+    if counts is not None:
+        for r in written:
+            counts[ADDED if r.inserted else UPDATED] += 1
+        if unchanged := len(guids) - len(written):
+            counts[UNCHANGED] += unchanged
+    for r in written:
+        if r.inserted:
+            logger.debug(
+                f"{name}: Batch {r.batch_name}, Sample {guids[(r.sample_id, r.batch_name)]} does not exist{'' if dryrun else ', adding'}"
+            )
+
+    # analyses that are already up to date are not returned by the upsert
+    if existing := [key for key in guids if key not in analyses]:
+        analysis = models.Analysis
+        analyses.update(
+            ((r.sample_id, r.batch_name), r.id)
+            for r in session.execute(
+                select(analysis.id, analysis.sample_id, analysis.batch_name).where(
+                    tuple_(analysis.sample_id, analysis.batch_name).in_(existing)
+                )
+            )
         )
+    return analyses
+
 
-    return analysis
+def analysis(
+    samples: dict[str, int],
+    analyses: dict[tuple[int, str], int],
+    row_model: GpasSummary | Mutations,
+) -> int | None:
+    """The id of the analysis of a row, None if its sample does not exist"""
+    if (sample_id := samples.get(row_model.sample_name)) is None:
+        return None
+    return analyses.get((sample_id, row_model.batch))
 
 
 def speciation(
@@ -111,118 +368,147 @@ def speciation(
     gpas_summary: GpasSummary,
     index: int,
     dryrun: bool,
-    analysis_record: models.Analysis,
-) -> models.Speciation | None:
+    analysis_id: int,
+) -> str:
+    """Add or update the speciation of a summary, returns what was done"""
     if gpas_summary.species is None:
-        logger.info(
+        logger.debug(
             f"Summary row {index+2}: Speciation for Batch {gpas_summary.batch}, Sample {gpas_summary.sample_name} not found"
         )
-        return None
+        return EMPTY
 
     speciation = (
-        (
-            session.query(models.Speciation)
-            .filter(
-                models.Speciation.analysis == analysis_record,
-                models.Speciation.species_number == 1,
-            )
-            .first()
+        session.query(models.Speciation)
+        .filter(
+            models.Speciation.analysis_id == analysis_id,
+            models.Speciation.species_number == 1,
         )
-        if analysis_record.id
-        else None
+        .first()
     )
 
     if not speciation:
-        speciation = models.Speciation(analysis=analysis_record, species_number=1)
+        speciation = models.Speciation(analysis_id=analysis_id, species_number=1)
         session.add(speciation)
-        logger.info(
-            f"Summary row {index+2}: Speciation for Batch {gpas_summary.batch}, Sample {gpas_summary.sample_name} does not exist{'' if dryrun else ', adding'}"
-        )
+        action, change = ADDED, f"does not exist{'' if dryrun else ', adding'}"
     else:
-        logger.info(
-            f"Summary row {index+2}: Speciation for Batch {gpas_summary.batch}, Sample {gpas_summary.sample_name} already exists{'' if dryrun else ', updating'}"
-        )
+        action, change = UPDATED, f"already exists{'' if dryrun else ', updating'}"
 
     speciation.species = gpas_summary.species
     speciation.sub_species = gpas_summary.sub_species
     speciation.analysis_date = gpas_summary.run_date
+    if action == UPDATED and not session.is_modified(speciation):
+        action, change = UNCHANGED, "already exists, unchanged"
 
-    return speciation
+    logger.debug(
+        f"Summary row {index+2}: Speciation for Batch {gpas_summary.batch}, Sample {gpas_summary.sample_name} {change}"
+    )
+    return action
 
 
 def drugs(
     session: Session,
-    gpas_summary: GpasSummary,
-    index: int,
+    summaries: dict[int, tuple[int, GpasSummary]],
     dryrun: bool,
-    analysis_record: models.Analysis,
-):
-    if gpas_summary.resistance_prediction is None:
-        logger.info(
+) -> Counter[str]:
+    """Add or update the drug resistances of a chunk of summaries with one upsert.
+
+    `summaries` holds the row index and summary of each analysis. A
+    prediction has the result code of each drug at the position given in
+    tb_drugs, the codes of every summary are split out a drug at a time.
+    Returns how many summaries had their resistances added, updated,
+    unchanged or empty.
+    """
+    counts: Counter[str] = Counter()
+    predictions = pd.Series(
+        {
+            analysis_id: gpas_summary.resistance_prediction
+            for analysis_id, (_, gpas_summary) in summaries.items()
+        },
+        dtype=object,
+    )
+    for analysis_id in predictions.index[predictions.isna()]:
+        index, gpas_summary = summaries[analysis_id]
+        counts[EMPTY] += 1
+        logger.debug(
             f"Summary row {index+2}: Drug Resistance for Batch {gpas_summary.batch}, Sample {gpas_summary.sample_name} Empty"
         )
-        return
-
-    for key, value in tb_drugs.items():
-        if drug_resistance := (
-            session.query(models.DrugResistance)
-            .filter(
-                models.DrugResistance.analysis == analysis_record,
-                models.DrugResistance.antibiotic == value,
-            )
-            .first()
-        ):
-            logger.info(
-                f"Summary row {index+2}: Drug Resistance for Batch {gpas_summary.batch}, Sample {gpas_summary.sample_name}, Antibiotic {value} already exists{'' if dryrun else ', updating'}"
-            )
-        else:
-            drug_resistance = models.DrugResistance(
-                analysis=analysis_record,
-                antibiotic=value,
-            )
-            session.add(drug_resistance)
-        drug_resistance.drug_resistance_result_type_code = (
-            gpas_summary.resistance_prediction[key]
+    if (predictions := predictions.dropna()).empty:
+        return counts
+
+    results = (
+        pd.DataFrame(
+            {
+                antibiotic: predictions.str[position]
+                for position, antibiotic in tb_drugs.items()
+            }
+        )
+        .rename_axis("analysis_id")
+        .reset_index()
+        .melt(
+            id_vars="analysis_id",
+            var_name="antibiotic",
+            value_name="drug_resistance_result_type_code",
         )
-
-    logger.info(
-        f"Summary row {index+2}: Drug Resistance for Batch {gpas_summary.batch}, Sample {gpas_summary.sample_name} added"
     )
-
-
-def details(
-    session: Session,
-    gpas_summary: GpasSummary,
-    analysis_record: models.Analysis,
-):
-    other_types = session.query(models.OtherType).all()
-    for other_type in other_types:
-        value = gpas_summary[other_type.code]
-
-        other_record = (
-            session.query(models.Other)
-            .filter(
-                models.Other.analysis == analysis_record,
-                models.Other.other_type_code == other_type.code,
+    try:
+        with savepoint(session):
+            written = upsert(
+                session,
+                models.DrugResistance,
+                results.to_dict("records"),  # type: ignore
+                ["analysis_id", "antibiotic"],
             )
-            .first()
-        )
-
-        if value is None:
-            if other_record:
-                session.delete(other_record)
+    except DBAPIError as err:
+        logger.error(f"Summary : {err}")
+        return counts
+
+    added: dict[int, bool] = {}
+    for r in written:
+        added[r.analysis_id] = added.get(r.analysis_id, False) or r.inserted
+    # the upsert only returns the resistances it added or changed
+    if unchanged := len(predictions) - len(added):
+        counts[UNCHANGED] += unchanged
+    debug = logger.isEnabledFor(logging.DEBUG)
+    for analysis_id, inserted in added.items():
+        counts[ADDED if inserted else UPDATED] += 1
+        if not debug:
             continue
-
-        if not other_record:
-            other_record = models.Other(
-                analysis=analysis_record, other_type_code=other_type.code
+        index, gpas_summary = summaries[analysis_id]
+        change = (
+            f"does not exist{'' if dryrun else ', adding'}"
+            if inserted
+            else f"already exists{'' if dryrun else ', updating'}"
+        )
+        logger.debug(
+            f"Summary row {index+2}: Drug Resistance for Batch {gpas_summary.batch}, Sample {gpas_summary.sample_name} {change}"
+        )
+    return counts
+
+
+def details(session: Session, others: dict[int, dict]) -> None:
+    """Add, update and remove the other records of each analysis"""
+    try:
+        with savepoint(session):
+            sync_details(
+                session,
+                models.Other,
+                "analysis_id",
+                "other_type_code",
+                others,
+                type_cache.other_types(session),
             )
-            session.add(other_record)
+    except DBAPIError as err:
+        logger.error(f"Summary : {err}")
 
-        other_record["value_" + other_type.value_type] = value
 
-
-def import_mutation(mutation_csv: str, mapping_csv: str, dryrun: bool) -> bool:
+def import_mutation(
+    mutation_csv: str,
+    mapping_csv: str,
+    dryrun: bool,
+    force: bool = False,
+    workers: int = 1,
+    bulk: bool = False,
+) -> bool:
     """Upload data from a mutation csv"""
     logger.info(
         f"Verifying and uploading data to database from Mutation {mutation_csv}"
@@ -232,34 +518,50 @@ def import_mutation(mutation_csv: str, mapping_csv: str, dryrun: bool) -> bool:
             if not db_revision_ok(session):
                 return False
 
-            df_mut = pd.read_csv(mutation_csv)
-            df_map = pd.read_csv(mapping_csv)
-
-            df_merged = df_mut.merge(
-                df_map, left_on="Sample ID", right_on="remote_sample_name", how="left"
+            chunks = CsvChunks(
+                session,
+                "Mutation",
+                mutation_csv,
+                mapping_csv,
+                force,
+                dryrun,
+                BULK_CHUNK_SIZE if bulk else CHUNK_SIZE,
             )
-            pbar = ProgressBar(max_value=len(df_merged))
-
-            for index, row in pbar(df_merged.iterrows()):
-                try:
-                    mut = Mutations(**row)
-
-                    analysis_record = analysis(session, mut, index, dryrun)
-                    session.flush()
-
-                    mutation(session, mut, index, dryrun, analysis_record)
-                    session.flush()
-
-                except ValidationError as err:
-                    for error in err.errors():
-                        logger.error(
-                            f"Mutation Row {index+2} {error['loc']} : {error['msg']}"
-                        )
-                except DBAPIError as err:
-                    logger.error(f"Mutation Row {index+2} : {err}")
-
-                except ValueError as err:
-                    logger.error(f"Mutation Row {index+2} : {err}")
+            staging = mutation_staging(session) if bulk else None
+            pbar = ProgressBar(max_value=UnknownLength).start()
+            counts = chunks.count("Mutation")
+
+            # later chunks are validated while each one is written
+            for mutations in validate_chunks(chunks, Mutations, "Mutation", workers):
+                if bulk:
+                    counts += upsert_mutations(
+                        session,
+                        [
+                            (index, mut, analysis_id)
+                            for index, mut in mutations
+                            if (analysis_id := chunks.analysis(mut)) is not None
+                        ],
+                        dryrun,
+                        staging,
+                    )
+                    pbar.update(chunks.written())
+                    continue
+                for index, mut in mutations:
+                    if (analysis_id := chunks.analysis(mut)) is None:
+                        # the sample was reported by find_samples
+                        continue
+                    try:
+                        counts[mutation(session, mut, index, dryrun, analysis_id)] += 1
+                        session.flush()
+
+                    except DBAPIError as err:
+                        logger.error(f"Mutation Row {index+2} : {err}")
+
+                    except ValueError as err:
+                        logger.error(f"Mutation Row {index+2} : {err}")
+                pbar.update(chunks.written())
+            pbar.finish()
+            chunks.log_summary()
 
         except Exception as e:
             logger.error(f"Failed to upload data: {e}")
@@ -284,12 +586,13 @@ def mutation(
     mutation: Mutations,
     index: int,
     dryrun: bool,
-    analysis_record: models.Analysis,
-) -> models.Mutations | None:
+    analysis_id: int,
+) -> str:
+    """Add or update a mutation, returns what was done"""
     if mut := (
         session.query(models.Mutations)
         .filter(
-            models.Mutations.analysis == analysis_record,
+            models.Mutations.analysis_id == analysis_id,
             models.Mutations.species == mutation.species,
             models.Mutations.drug == mutation.drug,
             models.Mutations.gene == mutation.gene,
@@ -297,21 +600,17 @@ def mutation(
         )
         .first()
     ):
-        logger.info(
-            f"Mutation row {index+2}: Mutation for Batch {mutation.batch}, Sample {mutation.sample_name}, Species {mutation.species}, Drug {mutation.drug}, Gene {mutation.gene}, Mutation {mutation.mutation} already exists{'' if dryrun else ', updating'}"
-        )
+        action, change = UPDATED, f"already exists{'' if dryrun else ', updating'}"
     else:
         mut = models.Mutations(
-            analysis=analysis_record,
+            analysis_id=analysis_id,
             species=mutation.species,
             drug=mutation.drug,
             gene=mutation.gene,
             mutation=mutation.mutation,
         )
         session.add(mut)
-        logger.info(
-            f"Mutation row {index+2}: Mutation for Batch {mutation.batch}, Sample {mutation.sample_name}, Species {mutation.species}, Drug {mutation.drug}, Gene {mutation.gene}, Mutation {mutation.mutation} does not exist{'' if dryrun else ', adding'}"
-        )
+        action, change = ADDED, f"does not exist{'' if dryrun else ', adding'}"
 
     mut.position = mutation.position
     mut.ref = mutation.ref
@@ -320,5 +619,106 @@ def mutation(
     mut.prediction = mutation.prediction
     mut.evidence = mutation.evidence
     mut.evidence_json = mutation.evidence_json  # type: ignore
+    if action == UPDATED and not session.is_modified(mut):
+        action, change = UNCHANGED, "already exists, unchanged"
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            f"Mutation row {index+2}: Mutation for Batch {mutation.batch}, Sample {mutation.sample_name}, Species {mutation.species}, Drug {mutation.drug}, Gene {mutation.gene}, Mutation {mutation.mutation} {change}"
+        )
+    return action
+
+
+def mutation_staging(session: Session) -> Table:
+    """The staging table of a bulk upload, created once for all its chunks"""
+    return staging_table(
+        session,
+        "mutation_staging",
+        ["analysis_id"]
+        + [
+            field
+            for field in Mutations.model_fields
+            if hasattr(models.Mutations, field)
+        ],
+    )
+
+
+def upsert_mutations(
+    session: Session,
+    mutations: list[tuple[int, Mutations, int]],
+    dryrun: bool,
+    staging: Table | None = None,
+) -> Counter[str]:
+    """Write a chunk of mutations with COPY and one set based upsert.
+
+    `mutations` holds the row index, mutation and analysis id of each row,
+    they are copied into `staging` when given, from `mutation_staging`. If
+    the database rejects the chunk it is split in half until the failing
+    rows are found, which are logged, and the other rows are written.
+    Returns how many rows were added, updated or unchanged, each row is only
+    logged at DEBUG.
+    """
+    counts: Counter[str] = Counter()
+    debug = logger.isEnabledFor(logging.DEBUG)
+    for rows, results in bisect_chunk(
+        session,
+        mutations,
+        partial(merge_mutations, session, staging=staging),
+        "Mutation",
+        error=lambda index, err: logger.error(f"Mutation Row {index+2} : {err}"),
+    ):
+        inserted = {mutation_key(r, r.analysis_id) for r in results if r.inserted}
+        changed = {mutation_key(r, r.analysis_id) for r in results}
+        for index, mut, analysis_id in rows:
+            key = mutation_key(mut, analysis_id)
+            # the first row of a new mutation adds it, as it does row by row
+            if key in inserted:
+                inserted.remove(key)
+                action, change = ADDED, f"does not exist{'' if dryrun else ', adding'}"
+            elif key in changed:
+                action, change = (
+                    UPDATED,
+                    f"already exists{'' if dryrun else ', updating'}",
+                )
+            else:
+                action, change = UNCHANGED, "already exists, unchanged"
+            counts[action] += 1
+            if debug:
+                logger.debug(
+                    f"Mutation row {index+2}: Mutation for Batch {mut.batch}, Sample {mut.sample_name}, Species {mut.species}, Drug {mut.drug}, Gene {mut.gene}, Mutation {mut.mutation} {change}"
+                )
+    return counts
+
+
+def merge_mutations(
+    session: Session,
+    mutations: Sequence[tuple[int, Mutations, int]],
+    staging: Table | None = None,
+) -> list[tuple[Sequence[tuple[int, Mutations, int]], list]]:
+    """Stage the mutations and merge them in one statement, returns the rows
+    with the mutations the merge added or changed"""
+    table = models.Mutations.__table__
+    with staged(
+        session,
+        [
+            {"analysis_id": analysis_id, **import_values(models.Mutations, mut)}
+            # the last row of each mutation, as it is row by row
+            for mut, analysis_id in {
+                mutation_key(mut, analysis_id): (mut, analysis_id)
+                for _, mut, analysis_id in mutations
+            }.values()
+        ],
+        staging,
+    ) as staged_rows:
+        results = merge(
+            session,
+            models.Mutations,
+            select(*staged_columns(staged_rows, table)),
+            ["analysis_id", "species", "drug", "gene", "mutation"],
+        )
+    return [(mutations, results)]
+
 
-    return mut
+def mutation_key(mut: Any, analysis_id: int) -> tuple:
+    """The unique key of a mutation, from an import or a written row"""
+    return (analysis_id, mut.species, mut.drug, mut.gene, mut.mutation)
@@ -1,440 +1,1325 @@
-import pandas as pd
 import gpaslocal.models as models
 from gpaslocal.db import get_session, db_revision_ok
 from gpaslocal.upload_models import (
+    ImportModel,
     RunImport,
     SpecimensImport,
     SamplesImport,
     StoragesImport,
 )
-from pydantic import ValidationError
-from gpaslocal.logs import logger
+from gpaslocal.lookups import ImportLookups
+from gpaslocal.outcomes import SKIPPED, Outcomes
+from gpaslocal.report import write_report
+from gpaslocal.type_cache import type_cache
+from gpaslocal.checkpoints import Checkpoint
+from gpaslocal.details import sync_details
+from gpaslocal.ledger import changed_rows, record_hashes, upload_started
+from gpaslocal.pipeline import prefetch
+from gpaslocal.references import check_references
+from gpaslocal.bulk import (
+    delete_ids,
+    insert_missing,
+    merge,
+    savepoint,
+    staged,
+    staged_value,
+    upsert,
+)
+from gpaslocal.constants import ValueType, coerce_to_str
+from gpaslocal.validation import ImportModelT, Row, validate_chunks
+from gpaslocal.workbook import CHUNK_SIZE, SPIKE_COLUMN, cached_workbook, read_sheet
+from gpaslocal.logs import file_logging, logger
 from sqlalchemy.orm import Session
-from sqlalchemy import not_
+from sqlalchemy import ColumnElement, FromClause, Table, and_, select
 from sqlalchemy.exc import DBAPIError
-from progressbar import ProgressBar
+from progressbar import ProgressBar, UnknownLength
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from datetime import date
-import re
-
-
-def import_data(excel_wb: str, dryrun: bool = False) -> bool:
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, Sequence, TypeVar
+import time
+
+# a row written by bisect_chunk, a tuple starting with the row index
+RowT = TypeVar("RowT", bound=tuple)
+
+
+def import_data(
+    excel_wb: str,
+    dryrun: bool = False,
+    bulk: bool = False,
+    chunk_size: int = CHUNK_SIZE,
+    force: bool = False,
+    workers: int = 1,
+    resume: bool = False,
+    report: str | None = None,
+) -> bool:
+    """Upload the sheets of a workbook in a single transaction.
+
+    With `resume` each chunk is committed once it has been written, and an
+    upload of the same file started again carries on from the last chunk
+    committed. The outcome of every row is written to `report`, if given.
+    """
     logger.info(
         f"Verifying and uploading data to database from Excel Workbook {excel_wb}"
     )
+    outcomes = Outcomes()
     with get_session() as session:
+        checkpoint = None
         try:
             if not db_revision_ok(session):
                 return False
 
-            runs(session, excel_wb=excel_wb, dryrun=dryrun)
-            session.flush()
-
-            specimens(session, excel_wb=excel_wb, dryrun=dryrun)
-            session.flush()
-
-            samples(session, excel_wb=excel_wb, dryrun=dryrun)
-            session.flush()
-
-            storage(session, excel_wb=excel_wb, dryrun=dryrun)
-            session.flush()
+            type_cache.refresh(session)
+
+            with closing(cached_workbook(excel_wb)) as wb:
+                # report every missing run and specimen before writing anything
+                if not check_references(session, wb, chunk_size, outcomes):
+                    return False
+
+                # shared between the sheets so records added by one sheet
+                # can be found by the following ones without a query
+                lookups = ImportLookups()
+                if resume and not dryrun:
+                    checkpoint = Checkpoint(session, excel_wb)
+
+                # each sheet is read ahead in a thread, validated ahead by
+                # the validation workers and written here, one chunk at a time
+                def sheet(name: str) -> Iterator[list[Row]]:
+                    chunks = read_sheet(wb, name, chunk_size)
+                    if checkpoint:
+                        chunks = checkpoint.skip_done(name, chunks)
+                    return prefetch(chunks)
+
+                for write_sheet, name in (
+                    (runs, "Runs"),
+                    (specimens, "Specimens"),
+                    (samples, "Samples"),
+                    (storage, "Storage"),
+                ):
+                    write_sheet(
+                        session,
+                        sheet(name),
+                        dryrun,
+                        lookups,
+                        bulk,
+                        force,
+                        workers,
+                        checkpoint,
+                        outcomes,
+                    )
 
         except Exception as e:
             logger.error(f"Failed to upload data: {e}")
 
         finally:
+            outcomes.log_summary()
+            if report:
+                write_report(outcomes, excel_wb, report)
+
             if logger.error_occurred:  # type: ignore
                 session.rollback()
                 logger.error("Upload failed, please see log messages for details")
+                if checkpoint and checkpoint.committed:
+                    logger.error(
+                        "The rows before the error were uploaded, run the upload again with --resume to carry on from there"
+                    )
                 return False
 
             if dryrun:
                 logger.info("Dry run mode, no data was uploaded")
                 session.rollback()
             else:
+                if checkpoint:
+                    checkpoint.finish()
                 logger.info("Data uploaded successfully")
                 session.commit()
 
     return True
 
 
-def runs(session: Session, excel_wb: str, dryrun: bool) -> None:
-    df = pd.read_excel(excel_wb, sheet_name="Runs")
-    pbar = ProgressBar(max_value=len(df))
+def import_many(
+    excel_wbs: list[str],
+    jobs: int = 1,
+    **options: Any,
+) -> bool:
+    """Import several workbooks in one process, `jobs` of them at a time.
 
-    for index, row in pbar(df.iterrows()):
-        try:
-            run_import = RunImport(**row)
+    The workbooks share the database engine, the type cache and the
+    validation workers, but each one is imported in its own transaction,
+    so a workbook that fails leaves the others uploaded. The options are
+    passed to import_data.
+    """
 
-            run_record = (
-                session.query(models.Run)
-                .filter(models.Run.code == run_import.code)
-                .first()
-            )
-            if run_record:
-                run_record.update_from_importmodel(run_import)
-                logger.info(
-                    f"Runs Sheet Row {index+2}: Run {run_import.code} already exists{'' if dryrun else ', updating'}"
-                )
-            else:
-                # add the run record
-                run_record = models.Run(code=run_import.code)
-                session.add(run_record)
-                logger.info(
-                    f"Runs Sheet Row {index+2}: Run {run_import.code} does not exist{'' if dryrun else ', adding'}"
-                )
-            run_record.update_from_importmodel(run_import)
+    def import_file(excel_wb: str) -> tuple[bool, float]:
+        start = time.perf_counter()
+        with file_logging(Path(excel_wb).name):
+            ok = import_data(excel_wb, **options)
+        return ok, time.perf_counter() - start
 
-        except ValidationError as err:
-            for error in err.errors():
-                logger.error(
-                    f"Runs Sheet Row {index+2} {error['loc']} : {error['msg']}"
-                )
-        except DBAPIError as err:
-            logger.error(f"Runs Sheet Row {index+2} : {err}")
+    with ThreadPoolExecutor(jobs, thread_name_prefix="upload") as executor:
+        results = list(executor.map(import_file, excel_wbs))
 
+    logger.info(f"Summary of {len(excel_wbs)} workbooks:")
+    failed = []
+    for excel_wb, (ok, seconds) in zip(excel_wbs, results):
+        logger.info(
+            f"  {excel_wb}: {'succeeded' if ok else 'failed'} in {seconds:.1f}s"
+        )
+        if not ok:
+            failed.append(excel_wb)
 
-def specimens(session: Session, excel_wb: str, dryrun: bool) -> None:
-    df = pd.read_excel(excel_wb, sheet_name="Specimens")
-    pbar = ProgressBar(max_value=len(df))
+    if failed:
+        logger.error(
+            f"{len(failed)} of {len(excel_wbs)} workbooks failed: {', '.join(failed)}"
+        )
+        return False
 
-    for index, row in pbar(df.iterrows()):
-        try:
-            specimen_import = SpecimensImport(**row)
+    logger.info(f"All {len(excel_wbs)} workbooks succeeded")
+    return True
 
-            # get the specimen owner
-            owner_record = owner(session, index, row, dryrun)
 
-            specimen_record = (
-                session.query(models.Specimen)
-                .filter(
-                    models.Specimen.accession == specimen_import.accession,
-                    models.Specimen.collection_date == specimen_import.collection_date,
-                )
-                .first()
+def validate_data(
+    excel_wb: str,
+    chunk_size: int = CHUNK_SIZE,
+    workers: int = 1,
+    report: str | None = None,
+) -> bool:
+    """Validate a workbook without connecting to the database.
+
+    Every row is validated and the runs and specimens referred to by the
+    Samples and Storage sheets are checked against the ones in the workbook.
+    Only an upload can check references to records already in the database,
+    so those are logged as warnings. The errors of each row are written to
+    `report`, if given.
+    """
+    logger.info(f"Validating Excel Workbook {excel_wb}, no database connection")
+    run_codes: set[str] = set()
+    specimen_keys: set[tuple[str, date]] = set()
+    layout: list[int] | None = None
+    outcomes = Outcomes()
+
+    with closing(cached_workbook(excel_wb)) as wb:
+
+        def sheet(
+            name: str, import_model: type[ImportModelT]
+        ) -> Iterator[tuple[int, ImportModelT]]:
+            for validated in validate_chunks(
+                prefetch(read_sheet(wb, name, chunk_size)),
+                import_model,
+                f"{name} Sheet",
+                workers,
+                partial(outcomes.failed, name),
+            ):
+                yield from validated
+
+        for _, run_import in sheet("Runs", RunImport):
+            run_codes.add(run_import.code)
+
+        for _, specimen_import in sheet("Specimens", SpecimensImport):
+            specimen_keys.add(
+                (specimen_import.accession, specimen_import.collection_date)
             )
 
-            if specimen_record:
-                logger.info(
-                    f"Specimens Sheet Row {index+2}: Specimen {specimen_import.accession}, {specimen_import.collection_date} already exists{'' if dryrun else ', updating'}"
+        for index, sample_import in sheet("Samples", SamplesImport):
+            if sample_import.run_code not in run_codes:
+                logger.warning(
+                    f"Samples Sheet Row {index+2}: Run {sample_import.run_code} is not in the Runs sheet, it must already be in the database"
                 )
-            else:
-                specimen_record = models.Specimen(
-                    accession=specimen_import.accession,
-                    collection_date=specimen_import.collection_date,
+            if (
+                sample_import.accession,
+                sample_import.collection_date,
+            ) not in specimen_keys:
+                logger.warning(
+                    f"Samples Sheet Row {index+2}: Specimen {sample_import.accession}, {sample_import.collection_date} is not in the Specimens sheet, it must already be in the database"
                 )
-                session.add(specimen_record)
-                logger.info(
-                    f"Specimens Sheet Row {index+2}: Specimen {specimen_import.accession}, {specimen_import.collection_date} does not exist{'' if dryrun else ', adding'}"
+            if layout is None:
+                layout = spike_layout(sample_import.model_extra or {})
+            spike_values(sample_import, layout, index, outcomes)
+
+        for index, storage_import in sheet("Storage", StoragesImport):
+            if (
+                storage_import.accession,
+                storage_import.collection_date,
+            ) not in specimen_keys:
+                logger.warning(
+                    f"Storage Sheet Row {index+2}: Specimen {storage_import.accession}, {storage_import.collection_date} is not in the Specimens sheet, it must already be in the database"
                 )
-            specimen_record.update_from_importmodel(specimen_import)
-            specimen_record.owner = owner_record
-            session.flush()
 
-            specimen_detail(session, specimen_record, specimen_import)
+    if report:
+        write_report(outcomes, excel_wb, report)
 
-        except ValidationError as err:
-            for error in err.errors():
-                logger.error(
-                    f"Specimens Sheet Row {index+2} {error['loc']} : {error['msg']}"
-                )
-        except DBAPIError as err:
-            logger.error(f"Specimens Sheet Row {index+2} : {err}")
+    if logger.error_occurred:  # type: ignore
+        logger.error("Validation failed, please see log messages for details")
+        return False
 
+    logger.info("Validation passed, no data was uploaded")
+    return True
 
-def owner(
-    session: Session, index: int, specimen_import: SpecimensImport, dryrun: bool
-) -> models.Owner:
-    owner_record = (
-        session.query(models.Owner)
-        .filter(
-            models.Owner.site == specimen_import.owner_site,
-            models.Owner.user == specimen_import.owner_user,
-        )
-        .first()
-    )
-    if not owner_record:
-        owner_record = models.Owner(
-            site=specimen_import.owner_site, user=specimen_import.owner_user
-        )
-        session.add(owner_record)
+
+def validated_chunks(
+    session: Session,
+    chunks: Iterable[list[Row]],
+    import_model: type[ImportModelT],
+    sheet_name: str,
+    lookups: ImportLookups,
+    force: bool = False,
+    workers: int = 1,
+    checkpoint: Checkpoint | None = None,
+    outcomes: Outcomes | None = None,
+) -> Iterator[list[tuple[int, ImportModelT]]]:
+    """Validate a sheet a chunk at a time.
+
+    Rows unchanged since they were last imported are skipped unless `force`
+    is set. Once a chunk has been written the records are released and the
+    hashes of its rows recorded, so only the chunks being validated and
+    written are held in memory. With a checkpoint each chunk is committed
+    once it has been written. With more than one worker the chunks are
+    validated in worker processes while the session stays in this one.
+    """
+    outcomes = outcomes or Outcomes()
+    pbar = ProgressBar(max_value=UnknownLength)
+    row_count = 0
+    unchanged = 0
+    # the hashes of the chunks read but not yet written, with the number of
+    # rows of the sheet up to the end of each chunk
+    pending: deque[tuple[int, dict[str, str | None], int]] = deque()
+    started = upload_started(session)
+
+    def changed_chunks() -> Iterator[list[Row]]:
+        nonlocal unchanged
+        for chunk in chunks:
+            rows, hashes = changed_rows(
+                session,
+                sheet_name,
+                chunk,
+                force,
+                started,
+                [chunk_hashes for _, chunk_hashes, _ in pending],
+            )
+            if len(rows) < len(chunk):
+                changed = {index for index, _ in rows}
+                for index, _ in chunk:
+                    if index not in changed:
+                        outcomes.record(sheet_name, index, SKIPPED)
+                unchanged += len(chunk) - len(rows)
+            pending.append((len(chunk), hashes, chunk[-1][0] + 1))
+            yield rows
+
+    for validated in validate_chunks(
+        changed_chunks(),
+        import_model,
+        f"{sheet_name} Sheet",
+        workers,
+        partial(outcomes.failed, sheet_name),
+    ):
+        yield validated
+        lookups.release()
+        chunk_length, hashes, sheet_rows = pending.popleft()
+        record_hashes(session, sheet_name, hashes)
+        if checkpoint:
+            checkpoint.commit(sheet_name, sheet_rows)
+        row_count += chunk_length
+        pbar.update(row_count)
+    pbar.finish()
+
+    if unchanged:
         logger.info(
-            f"Specimens Sheet Row {index+2}: Owner {specimen_import.owner_site}, {specimen_import.owner_user} does not exist{'' if dryrun else ', adding'}"
+            f"{sheet_name} Sheet: {unchanged} rows unchanged since the last upload, skipping"
+        )
+
+
+def write_chunk(
+    session: Session,
+    rows: Sequence[tuple[int, ImportModelT]],
+    write_row: Callable[[int, ImportModelT], Any],
+    sheet_name: str,
+    lookups: ImportLookups,
+    outcomes: Outcomes | None = None,
+) -> list[tuple[int, ImportModelT, Any]]:
+    """Write the rows of a chunk and flush them once inside a savepoint.
+
+    Returns the index, import and result of each row `write_row` returned a
+    result for. If the database rejects the chunk it is rolled back and split
+    in half until the failing rows are found, so the errors are still logged
+    against their row. Rows of a rejected chunk are written again while it is
+    split, so their messages can be logged more than once.
+    """
+
+    def write_rows(
+        rows: Sequence[tuple[int, ImportModelT]],
+    ) -> list[tuple[int, ImportModelT, Any]]:
+        written = []
+        for index, row in rows:
+            if (result := write_row(index, row)) is not None:
+                written.append((index, row, result))
+        session.flush()
+        return written
+
+    return bisect_chunk(session, rows, write_rows, sheet_name, lookups, outcomes)
+
+
+def bisect_chunk(
+    session: Session,
+    rows: Sequence[RowT],
+    write_rows: Callable[[Sequence[RowT]], list],
+    sheet_name: str,
+    lookups: ImportLookups | None = None,
+    outcomes: Outcomes | None = None,
+    error: Callable[[int, str], Any] | None = None,
+) -> list:
+    """Write the rows of a chunk inside a savepoint, splitting it on failure.
+
+    Each row is a tuple starting with its index, as passed to `write_rows`.
+    The error of each failing row is given to `error` with the row index,
+    or recorded in `outcomes` when there is no `error`.
+    """
+    if not rows:
+        return []
+    try:
+        with savepoint(session):
+            return write_rows(rows)
+    except DBAPIError as err:
+        # records added by the rolled back rows are no longer in the session
+        if lookups:
+            lookups.prune()
+        if len(rows) == 1:
+            if error is None:
+                error = partial((outcomes or Outcomes()).error, sheet_name)
+            error(rows[0][0], str(err))
+            return []
+        middle = len(rows) // 2
+        return bisect_chunk(
+            session, rows[:middle], write_rows, sheet_name, lookups, outcomes, error
+        ) + bisect_chunk(
+            session, rows[middle:], write_rows, sheet_name, lookups, outcomes, error
         )
-    return owner_record
 
 
-def specimen_detail(
-    session: Session, specimen_record: models.Specimen, specimen_import: SpecimensImport
+def runs(
+    session: Session,
+    chunks: Iterable[list[Row]],
+    dryrun: bool,
+    lookups: ImportLookups | None = None,
+    bulk: bool = False,
+    force: bool = False,
+    workers: int = 1,
+    checkpoint: Checkpoint | None = None,
+    outcomes: Outcomes | None = None,
 ) -> None:
-    # loop through the specimen detail types and add the specimen details
-    specimen_detail_types = session.query(models.SpecimenDetailType).all()
-    for specimen_detail_type in specimen_detail_types:
-        # get the value from the sample_import
-        value = specimen_import[specimen_detail_type.code]
-
-        # check if the specimen has been added to the database yet
-        # if so check if the specimen detail exists
-        specimen_detail_record = (
-            (
-                session.query(models.SpecimenDetail)
-                .filter(
-                    models.SpecimenDetail.specimen == specimen_record,
-                    models.SpecimenDetail.specimen_detail_type_code
-                    == specimen_detail_type.code,
-                )
-                .first()
+    lookups = lookups or ImportLookups()
+    outcomes = outcomes or Outcomes()
+    for run_imports in validated_chunks(
+        session,
+        chunks,
+        RunImport,
+        "Runs",
+        lookups,
+        force,
+        workers,
+        checkpoint,
+        outcomes,
+    ):
+        if bulk:
+            bisect_chunk(
+                session,
+                run_imports,
+                partial(upsert_runs, session, dryrun=dryrun, outcomes=outcomes),
+                "Runs",
+                lookups,
+                outcomes,
             )
-            if specimen_record.id
-            else None
+            continue
+
+        lookups.runs.preload(
+            session, [run_import.code for _, run_import in run_imports]
+        )
+        write_chunk(
+            session,
+            run_imports,
+            partial(
+                run_row, session, dryrun=dryrun, lookups=lookups, outcomes=outcomes
+            ),
+            "Runs",
+            lookups,
+            outcomes,
         )
 
-        # if the value is None, and the sample detail exists, delete it
-        # if the value is None skip
-        if value is None:
-            if specimen_detail_record:
-                session.delete(specimen_detail_record)
-            continue
 
-        if not specimen_detail_record:
-            specimen_detail_record = models.SpecimenDetail(
-                specimen=specimen_record,
-                specimen_detail_type_code=specimen_detail_type.code,
+def run_row(
+    session: Session,
+    index: int,
+    run_import: RunImport,
+    dryrun: bool,
+    lookups: ImportLookups,
+    outcomes: Outcomes,
+) -> models.Run:
+    name = f"Run {run_import.code}"
+    if run_record := lookups.runs.get(session, run_import.code):
+        changed = run_record.update_from_importmodel(run_import)
+        outcomes.existing("Runs", index, name, changed, dryrun)
+    else:
+        # add the run record
+        run_record = models.Run(code=run_import.code)
+        session.add(run_record)
+        lookups.runs.add(run_import.code, run_record)
+        run_record.update_from_importmodel(run_import)
+        outcomes.added("Runs", index, name, dryrun)
+    return run_record
+
+
+def upsert_runs(
+    session: Session,
+    run_imports: Sequence[tuple[int, RunImport]],
+    dryrun: bool,
+    outcomes: Outcomes | None = None,
+) -> list[tuple[int, RunImport, int]]:
+    """Write a chunk of runs with COPY and one set based upsert"""
+    outcomes = outcomes or Outcomes()
+    run = models.Run.__table__
+    with staged(
+        session,
+        [
+            import_values(models.Run, run_import)
+            for _, run_import in last_rows(run_imports, lambda r: r.code)
+        ],
+    ) as staging:
+        results = merge(
+            session,
+            models.Run,
+            select(*staged_columns(staging, run)),
+            ["code"],
+        )
+        ids = {
+            row.code: row.id
+            for row in session.execute(
+                select(run.c.code, run.c.id).join(staging, run.c.code == staging.c.code)
             )
-            session.add(specimen_detail_record)
+        }
+
+    inserted = {result.code for result in results if result.inserted}
+    changed = {result.code for result in results}
+    written = []
+    for index, run_import in run_imports:
+        name = f"Run {run_import.code}"
+        # the first row of a new run adds it, as it does row by row
+        if run_import.code in inserted:
+            inserted.remove(run_import.code)
+            outcomes.added("Runs", index, name, dryrun)
+        else:
+            outcomes.existing("Runs", index, name, run_import.code in changed, dryrun)
+        written.append((index, run_import, ids[run_import.code]))
+    return written
+
+
+def last_rows(
+    imports: Iterable[tuple[int, ImportModelT]], key: Callable[[ImportModelT], Any]
+) -> list[tuple[int, ImportModelT]]:
+    """The last row of each key, the one that is left when rows are repeated"""
+    return list({key(row): (index, row) for index, row in imports}.values())
+
+
+def import_values(model: type[Any], import_model: ImportModel) -> dict[str, Any]:
+    """The fields of an import that update_from_importmodel copies to a record"""
+    return {
+        field: import_model[field]
+        for field in import_model.model_fields
+        if hasattr(model, field)
+    }
 
-        specimen_detail_record["value_" + specimen_detail_type.value_type] = value
 
+def staged_columns(staging: Table, table: FromClause) -> list[ColumnElement]:
+    """The staging columns that are columns of the table, cast to their type"""
+    return [
+        staged_value(staging.c[column], table.c[column]).label(column)
+        for column in staging.c.keys()
+        if column in table.c
+    ]
 
-def samples(session: Session, excel_wb: str, dryrun: bool) -> None:
-    df = pd.read_excel(excel_wb, sheet_name="Samples")
-    pbar = ProgressBar(max_value=len(df))
 
-    for index, row in pbar(df.iterrows()):
-        try:
-            sample_import = SamplesImport(**row)
+def specimen_match(staging: Table) -> ColumnElement:
+    specimen = models.Specimen.__table__
+    return and_(
+        specimen.c.accession == staging.c.accession,
+        specimen.c.collection_date
+        == staged_value(staging.c.collection_date, specimen.c.collection_date),
+    )
 
-            # Check if the run and specimen exist
-            run_record = find_run(session, sample_import.run_code)
-            specimen_record = find_specimen(
-                session, sample_import.accession, sample_import.collection_date
-            )
 
-            sample_record = (
-                session.query(models.Sample)
-                .filter(models.Sample.guid == sample_import.guid)
-                .first()
+def specimens(
+    session: Session,
+    chunks: Iterable[list[Row]],
+    dryrun: bool,
+    lookups: ImportLookups | None = None,
+    bulk: bool = False,
+    force: bool = False,
+    workers: int = 1,
+    checkpoint: Checkpoint | None = None,
+    outcomes: Outcomes | None = None,
+) -> None:
+    lookups = lookups or ImportLookups()
+    outcomes = outcomes or Outcomes()
+    for specimen_imports in validated_chunks(
+        session,
+        chunks,
+        SpecimensImport,
+        "Specimens",
+        lookups,
+        force,
+        workers,
+        checkpoint,
+        outcomes,
+    ):
+        detail_types = type_cache.specimen_detail_types(session)
+        # the row index, id and detail values of each specimen written
+        details: dict[int, tuple[int, int, dict[str, Any]]] = {}
+
+        # the record ids are known once the chunk has been written
+        for index, specimen_import, specimen_id in (
+            bisect_chunk(
+                session,
+                specimen_imports,
+                partial(upsert_specimens, session, dryrun=dryrun, outcomes=outcomes),
+                "Specimens",
+                lookups,
+                outcomes,
+            )
+            if bulk
+            else specimen_records(session, specimen_imports, dryrun, lookups, outcomes)
+        ):
+            details[specimen_id] = (
+                index,
+                specimen_id,
+                {code: specimen_import[code] for code in detail_types},
             )
 
-            if sample_record:
-                sample_record.update_from_importmodel(sample_import)
-                sample_record.run = run_record
-                sample_record.specimen = specimen_record
-                logger.info(
-                    f"Samples Sheet Row {index+2}: Sample {sample_import.guid} already exists{'' if dryrun else ', updating'}"
-                )
-            else:
-                sample_record = models.Sample()
-                sample_record.update_from_importmodel(sample_import)
-                sample_record.run = run_record
-                sample_record.specimen = specimen_record
-                logger.info(
-                    f"Samples Sheet Row {index+2}: Sample {sample_import.guid} does not exist{'' if dryrun else ', adding'}"
-                )
-                session.add(sample_record)
+        # add, update and remove the specimen details of the whole chunk,
+        # split on failure so the errors are logged against their row
+        bisect_chunk(
+            session,
+            list(details.values()),
+            partial(specimen_details, session, detail_types=detail_types),
+            "Specimens",
+            lookups,
+            outcomes,
+        )
+
+
+def specimen_details(
+    session: Session,
+    rows: Sequence[tuple[int, int, dict[str, Any]]],
+    detail_types: dict[str, ValueType],
+) -> list:
+    """Sync the details of the row index, specimen id and values of each row"""
+    sync_details(
+        session,
+        models.SpecimenDetail,
+        "specimen_id",
+        "specimen_detail_type_code",
+        {specimen_id: values for _, specimen_id, values in rows},
+        detail_types,
+    )
+    return []
 
-            # make sure we have the sample record id
-            session.flush()
 
-            # add the sample detail records
-            sample_detail(session, sample_record, sample_import)
+def specimen_records(
+    session: Session,
+    specimen_imports: Sequence[tuple[int, SpecimensImport]],
+    dryrun: bool,
+    lookups: ImportLookups,
+    outcomes: Outcomes,
+) -> list[tuple[int, SpecimensImport, int]]:
+    lookups.owners.preload(
+        session, [(s.owner_site, s.owner_user) for _, s in specimen_imports]
+    )
+    lookups.specimens.preload(
+        session, [(s.accession, s.collection_date) for _, s in specimen_imports]
+    )
+    return [
+        (index, specimen_import, specimen_record.id)
+        for index, specimen_import, specimen_record in write_chunk(
+            session,
+            specimen_imports,
+            partial(
+                specimen_row,
+                session,
+                dryrun=dryrun,
+                lookups=lookups,
+                outcomes=outcomes,
+            ),
+            "Specimens",
+            lookups,
+            outcomes,
+        )
+    ]
 
-            # add the spike records
-            spikes(session, sample_record, sample_import, index)
 
-        except ValidationError as err:
-            for error in err.errors():
-                logger.error(
-                    f"Samples Sheet Row {index+2} {error['loc']} : {error['msg']}"
+def upsert_specimens(
+    session: Session,
+    specimen_imports: Sequence[tuple[int, SpecimensImport]],
+    dryrun: bool,
+    outcomes: Outcomes | None = None,
+) -> list[tuple[int, SpecimensImport, int]]:
+    """Write a chunk of specimens and their new owners with set based SQL"""
+    outcomes = outcomes or Outcomes()
+    new_owners = {
+        (owner.site, owner.user)
+        for owner in insert_missing(
+            session,
+            models.Owner,
+            [
+                {"site": site, "user": user}
+                for site, user in dict.fromkeys(
+                    (s.owner_site, s.owner_user) for _, s in specimen_imports
                 )
-        except ValueError as err:
-            logger.error(f"Samples Sheet Row {index+2} : {err}")
+            ],
+        )
+    }
 
+    specimen = models.Specimen.__table__
+    owner = models.Owner.__table__
+    with staged(
+        session,
+        [
+            {"owner_site": s.owner_site, "owner_user": s.owner_user}
+            | import_values(models.Specimen, s)
+            for _, s in last_rows(
+                specimen_imports, lambda s: (s.accession, s.collection_date)
+            )
+        ],
+    ) as staging:
+        results = merge(
+            session,
+            models.Specimen,
+            select(owner.c.id.label("owner_id"), *staged_columns(staging, specimen))
+            .select_from(staging)
+            .join(
+                owner,
+                and_(
+                    owner.c.site == staging.c.owner_site,
+                    owner.c.user == staging.c.owner_user,
+                ),
+            ),
+            ["accession", "collection_date"],
+        )
+        ids = {
+            (row.accession, row.collection_date): row.id
+            for row in session.execute(
+                select(specimen.c.id, specimen.c.accession, specimen.c.collection_date)
+                .select_from(staging)
+                .join(specimen, specimen_match(staging))
+            )
+        }
 
-def find_run(session: Session, run_code: str) -> models.Run:
-    if run := session.query(models.Run).filter(models.Run.code == run_code).first():
-        return run
-    else:
-        raise ValueError(f"Run {run_code} does not exist")
+    inserted = {
+        (result.accession, result.collection_date)
+        for result in results
+        if result.inserted
+    }
+    changed = {(result.accession, result.collection_date) for result in results}
+    written = []
+    for index, specimen_import in specimen_imports:
+        owner_key = (specimen_import.owner_site, specimen_import.owner_user)
+        if owner_key in new_owners:
+            new_owners.remove(owner_key)
+            logger.debug(
+                f"Specimens Sheet Row {index+2}: Owner {specimen_import.owner_site}, {specimen_import.owner_user} does not exist{'' if dryrun else ', adding'}"
+            )
+        specimen_key = (specimen_import.accession, specimen_import.collection_date)
+        name = (
+            f"Specimen {specimen_import.accession}, {specimen_import.collection_date}"
+        )
+        if specimen_key in inserted:
+            inserted.remove(specimen_key)
+            outcomes.added("Specimens", index, name, dryrun)
+        else:
+            outcomes.existing("Specimens", index, name, specimen_key in changed, dryrun)
+        written.append((index, specimen_import, ids[specimen_key]))
+    return written
 
 
-def find_specimen(
-    session: Session, accession: str, collection_date: date
+def specimen_row(
+    session: Session,
+    index: int,
+    specimen_import: SpecimensImport,
+    dryrun: bool,
+    lookups: ImportLookups,
+    outcomes: Outcomes,
 ) -> models.Specimen:
-    if specimen := (
-        session.query(models.Specimen)
-        .filter(
-            models.Specimen.accession == accession,
-            models.Specimen.collection_date == collection_date,
-        )
-        .first()
-    ):
-        return specimen
+    # get the specimen owner
+    owner_record = owner(session, index, specimen_import, dryrun, lookups)
+
+    specimen_key = (specimen_import.accession, specimen_import.collection_date)
+    name = f"Specimen {specimen_import.accession}, {specimen_import.collection_date}"
+    if specimen_record := lookups.specimens.get(session, specimen_key):
+        changed = specimen_record.update_from_importmodel(specimen_import)
+        # a new owner has no id until it is flushed
+        if owner_record.id is None or specimen_record.owner_id != owner_record.id:
+            specimen_record.owner = owner_record
+            changed = True
+        outcomes.existing("Specimens", index, name, changed, dryrun)
     else:
-        raise ValueError(f"Specimen {accession}, {collection_date} does not exist")
+        specimen_record = models.Specimen(
+            accession=specimen_import.accession,
+            collection_date=specimen_import.collection_date,
+        )
+        session.add(specimen_record)
+        lookups.specimens.add(specimen_key, specimen_record)
+        specimen_record.update_from_importmodel(specimen_import)
+        specimen_record.owner = owner_record
+        outcomes.added("Specimens", index, name, dryrun)
+    return specimen_record
 
 
-def sample_detail(
-    session: Session, sample_record: models.Sample, sample_import: SamplesImport
+def owner(
+    session: Session,
+    index: int,
+    specimen_import: SpecimensImport,
+    dryrun: bool,
+    lookups: ImportLookups | None = None,
+) -> models.Owner:
+    lookups = lookups or ImportLookups()
+    owner_key = (specimen_import.owner_site, specimen_import.owner_user)
+    lookups.owners.preload(session, [owner_key])
+
+    if not (owner_record := lookups.owners.get(session, owner_key)):
+        owner_record = models.Owner(
+            site=specimen_import.owner_site, user=specimen_import.owner_user
+        )
+        session.add(owner_record)
+        lookups.owners.add(owner_key, owner_record)
+        logger.debug(
+            f"Specimens Sheet Row {index+2}: Owner {specimen_import.owner_site}, {specimen_import.owner_user} does not exist{'' if dryrun else ', adding'}"
+        )
+    return owner_record
+
+
+def samples(
+    session: Session,
+    chunks: Iterable[list[Row]],
+    dryrun: bool,
+    lookups: ImportLookups | None = None,
+    bulk: bool = False,
+    force: bool = False,
+    workers: int = 1,
+    checkpoint: Checkpoint | None = None,
+    outcomes: Outcomes | None = None,
 ) -> None:
-    # loop through the sample detail types and add the sample details
-    sample_detail_types = session.query(models.SampleDetailType).all()
-    for sample_detail_type in sample_detail_types:
-        # get the value from the sample_import
-        value = sample_import[sample_detail_type.code]
-
-        # check if the sample detail exists
-        sample_detail_record = (
-            (
-                session.query(models.SampleDetail)
-                .filter(
-                    models.SampleDetail.sample == sample_record,
-                    models.SampleDetail.sample_detail_type_code
-                    == sample_detail_type.code,
-                )
-                .first()
+    lookups = lookups or ImportLookups()
+    outcomes = outcomes or Outcomes()
+    layout: list[int] | None = None
+    for sample_imports in validated_chunks(
+        session,
+        chunks,
+        SamplesImport,
+        "Samples",
+        lookups,
+        force,
+        workers,
+        checkpoint,
+        outcomes,
+    ):
+        detail_types = type_cache.sample_detail_types(session)
+        # the row index, id, detail values and spikes of each sample written
+        details: dict[int, tuple[int, int, dict[str, Any], dict[str, str]]] = {}
+        # the spike columns are worked out once from the sheet header
+        if layout is None and sample_imports:
+            layout = spike_layout(sample_imports[0][1].model_extra or {})
+
+        # the record ids are known once the chunk has been written
+        for index, sample_import, sample_id in (
+            bisect_chunk(
+                session,
+                sample_imports,
+                partial(upsert_samples, session, dryrun=dryrun, outcomes=outcomes),
+                "Samples",
+                lookups,
+                outcomes,
+            )
+            if bulk
+            else sample_records(session, sample_imports, dryrun, lookups, outcomes)
+        ):
+            details[sample_id] = (
+                index,
+                sample_id,
+                {code: sample_import[code] for code in detail_types},
+                spike_values(sample_import, layout or [], index, outcomes),
             )
-            if sample_record.id
-            else None
+
+        # add, update and remove the sample details and spikes of the whole
+        # chunk, split on failure so the errors are logged against their row
+        bisect_chunk(
+            session,
+            list(details.values()),
+            partial(sample_details, session, detail_types=detail_types),
+            "Samples",
+            lookups,
+            outcomes,
         )
 
-        # if the value is None, and the sample detail exists, delete it
-        # if the value is None skip
-        if value is None:
-            if sample_detail_record:
-                session.delete(sample_detail_record)
+
+def sample_details(
+    session: Session,
+    rows: Sequence[tuple[int, int, dict[str, Any], dict[str, str]]],
+    detail_types: dict[str, ValueType],
+) -> list:
+    """Sync the details and spikes of the row index, sample id, detail values
+    and spikes of each row"""
+    sync_details(
+        session,
+        models.SampleDetail,
+        "sample_id",
+        "sample_detail_type_code",
+        {sample_id: values for _, sample_id, values, _ in rows},
+        detail_types,
+    )
+    sync_spikes(session, {sample_id: spikes for _, sample_id, _, spikes in rows})
+    return []
+
+
+def sample_records(
+    session: Session,
+    sample_imports: Sequence[tuple[int, SamplesImport]],
+    dryrun: bool,
+    lookups: ImportLookups,
+    outcomes: Outcomes,
+) -> list[tuple[int, SamplesImport, int]]:
+    lookups.runs.preload(session, [s.run_code for _, s in sample_imports])
+    lookups.specimens.preload(
+        session, [(s.accession, s.collection_date) for _, s in sample_imports]
+    )
+    lookups.samples.preload(session, [s.guid for _, s in sample_imports])
+    return [
+        (index, sample_import, sample_record.id)
+        for index, sample_import, sample_record in write_chunk(
+            session,
+            sample_imports,
+            partial(
+                sample_row,
+                session,
+                dryrun=dryrun,
+                lookups=lookups,
+                outcomes=outcomes,
+            ),
+            "Samples",
+            lookups,
+            outcomes,
+        )
+    ]
+
+
+def upsert_samples(
+    session: Session,
+    sample_imports: Sequence[tuple[int, SamplesImport]],
+    dryrun: bool,
+    outcomes: Outcomes | None = None,
+) -> list[tuple[int, SamplesImport, int]]:
+    """Write a chunk of samples with COPY and one set based upsert.
+
+    The run and specimen of each sample are found by joining the staged
+    rows to them on their codes, samples whose run or specimen does not
+    exist are not written and are reported.
+    """
+    outcomes = outcomes or Outcomes()
+    sample = models.Sample.__table__
+    run = models.Run.__table__
+    specimen = models.Specimen.__table__
+    with staged(
+        session,
+        [
+            {
+                "run_code": s.run_code,
+                "accession": s.accession,
+                "collection_date": s.collection_date,
+                "guid": s.guid,
+                "sample_category": s.sample_category,
+                # unique and sorted, as the model stores them
+                "nucleic_acid_type": sorted(set(s.nucleic_acid_type or [])),
+            }
+            for _, s in last_rows(sample_imports, lambda s: s.guid)
+        ],
+    ) as staging:
+        run_match = run.c.code == staging.c.run_code
+        results = merge(
+            session,
+            models.Sample,
+            select(
+                run.c.id.label("run_id"),
+                specimen.c.id.label("specimen_id"),
+                *staged_columns(staging, sample),
+            )
+            .select_from(staging)
+            .join(run, run_match)
+            .join(specimen, specimen_match(staging)),
+            ["guid"],
+        )
+        matches = {
+            row.guid: row
+            for row in session.execute(
+                select(
+                    staging.c.guid,
+                    run.c.id.label("run_id"),
+                    specimen.c.id.label("specimen_id"),
+                    sample.c.id,
+                )
+                .select_from(staging)
+                .outerjoin(run, run_match)
+                .outerjoin(specimen, specimen_match(staging))
+                .outerjoin(sample, sample.c.guid == staging.c.guid)
+            )
+        }
+
+    inserted = {result.guid for result in results if result.inserted}
+    changed = {result.guid for result in results}
+    written = []
+    for index, sample_import in sample_imports:
+        match = matches[sample_import.guid]
+        if match.run_id is None:
+            outcomes.error(
+                "Samples",
+                index,
+                f"Run {sample_import.run_code} does not exist",
+                "run_code",
+            )
+            continue
+        if match.specimen_id is None:
+            outcomes.error(
+                "Samples",
+                index,
+                f"Specimen {sample_import.accession}, {sample_import.collection_date} does not exist",
+                "accession",
+            )
             continue
 
-        if not sample_detail_record:
-            sample_detail_record = models.SampleDetail(
-                sample=sample_record, sample_detail_type_code=sample_detail_type.code
+        name = f"Sample {sample_import.guid}"
+        if sample_import.guid in inserted:
+            inserted.remove(sample_import.guid)
+            outcomes.added("Samples", index, name, dryrun)
+        else:
+            outcomes.existing(
+                "Samples", index, name, sample_import.guid in changed, dryrun
             )
-            session.add(sample_detail_record)
+        written.append((index, sample_import, match.id))
+    return written
 
-        sample_detail_record["value_" + sample_detail_type.value_type] = value
+
+def sample_row(
+    session: Session,
+    index: int,
+    sample_import: SamplesImport,
+    dryrun: bool,
+    lookups: ImportLookups,
+    outcomes: Outcomes,
+) -> models.Sample | None:
+    # Check if the run and specimen exist
+    try:
+        run_id = find_run_id(lookups, sample_import.run_code)
+    except ValueError as err:
+        outcomes.error("Samples", index, str(err), "run_code")
+        return None
+    try:
+        specimen_id = find_specimen_id(
+            lookups, sample_import.accession, sample_import.collection_date
+        )
+    except ValueError as err:
+        outcomes.error("Samples", index, str(err), "accession")
+        return None
+
+    name = f"Sample {sample_import.guid}"
+    if sample_record := lookups.samples.get(session, sample_import.guid):
+        changed = sample_record.update_from_importmodel(sample_import)
+        if (sample_record.run_id, sample_record.specimen_id) != (run_id, specimen_id):
+            sample_record.run_id = run_id
+            sample_record.specimen_id = specimen_id
+            changed = True
+        outcomes.existing("Samples", index, name, changed, dryrun)
+    else:
+        sample_record = models.Sample()
+        sample_record.update_from_importmodel(sample_import)
+        sample_record.run_id = run_id
+        sample_record.specimen_id = specimen_id
+        outcomes.added("Samples", index, name, dryrun)
+        session.add(sample_record)
+        lookups.samples.add(sample_import.guid, sample_record)
+    return sample_record
+
+
+def find_run(
+    session: Session, run_code: str, lookups: ImportLookups | None = None
+) -> models.Run:
+    lookups = lookups or ImportLookups()
+    lookups.runs.preload(session, [run_code])
+    return session.get_one(models.Run, find_run_id(lookups, run_code))
+
+
+def find_run_id(lookups: ImportLookups, run_code: str) -> int:
+    if (run_id := lookups.runs.get_id(run_code)) is not None:
+        return run_id
+    else:
+        raise ValueError(f"Run {run_code} does not exist")
 
 
-def spikes(
+def find_specimen(
     session: Session,
-    sample_record: models.Sample,
+    accession: str,
+    collection_date: date,
+    lookups: ImportLookups | None = None,
+) -> models.Specimen:
+    lookups = lookups or ImportLookups()
+    lookups.specimens.preload(session, [(accession, collection_date)])
+    return session.get_one(
+        models.Specimen, find_specimen_id(lookups, accession, collection_date)
+    )
+
+
+def find_specimen_id(
+    lookups: ImportLookups, accession: str, collection_date: date
+) -> int:
+    if (
+        specimen_id := lookups.specimens.get_id((accession, collection_date))
+    ) is not None:
+        return specimen_id
+    else:
+        raise ValueError(f"Specimen {accession}, {collection_date} does not exist")
+
+
+def spike_layout(columns: Iterable[str]) -> list[int]:
+    """Suffixes of the spike name and quantity columns in the sheet header"""
+    return sorted(
+        {int(match.group(2)) for c in columns if (match := SPIKE_COLUMN.match(c))}
+    )
+
+
+def spike_values(
     sample_import: SamplesImport,
+    layout: list[int],
     index: int,
-) -> None:
-    spike_names: dict = {
-        k: v for k, v in sample_import.dict().items() if k.startswith("spike_name_")
-    }
-    spike_quantities: dict = {
-        k: v for k, v in sample_import.dict().items() if k.startswith("spike_quantity_")
-    }
-    spike_fields = spike_names | spike_quantities
-
-    # Extract the suffixes, convert them to integers
-    suffixes = []
-    for k in spike_fields:
-        match = re.search(r"\d+$", k)
-        if match is not None:
-            suffixes.append(int(match.group()))
-    # make sure the suffixes are unique
-    suffixes = list(set(suffixes))
-
-    for i in suffixes:
-        spike_name: str = sample_import[f"spike_name_{i}"]
-        spike_quantity: str = sample_import[f"spike_quantity_{i}"]
+    outcomes: Outcomes | None = None,
+) -> dict[str, str]:
+    """Spike quantities of a sample keyed by the spike name"""
+    outcomes = outcomes or Outcomes()
+    extra = sample_import.model_extra or {}
+    spikes = {}
+    for i in layout:
+        spike_name = extra.get(f"spike_name_{i}")
+        spike_quantity = extra.get(f"spike_quantity_{i}")
         # check if either the name and quantity is missing then skip
-        if pd.isnull(spike_name) and pd.isnull(spike_quantity):
+        if spike_name is None and spike_quantity is None:
             continue
-        # raise an error if just the name is missing
-        if pd.isnull(spike_name):
-            logger.error(
-                f"Samples Sheet Row {index+2} : spike_name_{i} is missing name"
+        # raise an error if just the name or quantity is missing
+        if spike_name is None:
+            outcomes.error(
+                "Samples", index, f"spike_name_{i} is missing name", f"spike_name_{i}"
             )
             continue
-
-        spike_record = (
-            (
-                session.query(models.Spike)
-                .filter(
-                    models.Spike.sample == sample_record,
-                    models.Spike.name == spike_name,
-                )
-                .first()
+        if spike_quantity is None:
+            outcomes.error(
+                "Samples",
+                index,
+                f"spike_quantity_{i} is missing quantity",
+                f"spike_quantity_{i}",
             )
-            if sample_record.id
-            else None
+            continue
+
+        spikes[coerce_to_str(spike_name)] = coerce_to_str(spike_quantity)
+    return spikes
+
+
+def sync_spikes(session: Session, spikes: dict[int, dict[str, str]]) -> None:
+    """Make the spikes of each sample match the spikes in the sheet.
+
+    Loads the existing spikes of all the samples with one query, then adds,
+    updates and removes spikes keyed on the sample and spike name.
+    """
+    deletes = []
+    for spike in session.execute(
+        select(models.Spike.id, models.Spike.sample_id, models.Spike.name).where(
+            models.Spike.sample_id.in_(spikes)
         )
+    ):
+        # remove any spikes that are not in the spike table for this sample
+        if spike.name not in spikes[spike.sample_id]:
+            deletes.append(spike.id)
+
+    delete_ids(session, models.Spike, deletes)
+    upsert(
+        session,
+        models.Spike,
+        [
+            {"sample_id": sample_id, "name": name, "quantity": quantity}
+            for sample_id, sample_spikes in spikes.items()
+            for name, quantity in sample_spikes.items()
+        ],
+        ["sample_id", "name"],
+    )
+
 
-        if not spike_record:
-            spike_record = models.Spike(
-                sample=sample_record,
-                name=spike_name,
+def storage(
+    session: Session,
+    chunks: Iterable[list[Row]],
+    dryrun: bool,
+    lookups: ImportLookups | None = None,
+    bulk: bool = False,
+    force: bool = False,
+    workers: int = 1,
+    checkpoint: Checkpoint | None = None,
+    outcomes: Outcomes | None = None,
+) -> None:
+    lookups = lookups or ImportLookups()
+    outcomes = outcomes or Outcomes()
+    for storage_imports in validated_chunks(
+        session,
+        chunks,
+        StoragesImport,
+        "Storage",
+        lookups,
+        force,
+        workers,
+        checkpoint,
+        outcomes,
+    ):
+        if bulk:
+            bisect_chunk(
+                session,
+                storage_imports,
+                partial(upsert_storage, session, dryrun=dryrun, outcomes=outcomes),
+                "Storage",
+                lookups,
+                outcomes,
             )
-            session.add(spike_record)
+            continue
 
-        spike_record.quantity = spike_quantity
+        lookups.specimens.preload(
+            session, [(s.accession, s.collection_date) for _, s in storage_imports]
+        )
+        lookups.storages.preload(
+            session, [s.storage_qr_code for _, s in storage_imports]
+        )
 
-    # remove any spikes that are not in the spike table for this sample
-    # only if the sample has been added to the database
-    if sample_record.id:
-        clean_spike_names = [x for x in spike_names.values() if not pd.isnull(x)]
-        session.query(models.Spike).filter(
-            not_(models.Spike.name.in_(clean_spike_names)),
-            models.Spike.sample == sample_record,
-        ).delete()
+        write_chunk(
+            session,
+            storage_imports,
+            partial(
+                storage_row,
+                session,
+                dryrun=dryrun,
+                lookups=lookups,
+                outcomes=outcomes,
+            ),
+            "Storage",
+            lookups,
+            outcomes,
+        )
 
 
-def storage(session: Session, excel_wb: str, dryrun: bool) -> None:
-    df = pd.read_excel(excel_wb, sheet_name="Storage")
-    pbar = ProgressBar(max_value=len(df))
+def storage_row(
+    session: Session,
+    index: int,
+    storage_import: StoragesImport,
+    dryrun: bool,
+    lookups: ImportLookups,
+    outcomes: Outcomes,
+) -> models.Storage | None:
+    try:
+        specimen_id = find_specimen_id(
+            lookups, storage_import.accession, storage_import.collection_date
+        )
+    except ValueError as err:
+        outcomes.error("Storage", index, str(err), "accession")
+        return None
 
-    for index, row in pbar(df.iterrows()):
-        try:
-            storage_import = StoragesImport(**row)
+    name = f"Storage {storage_import.storage_qr_code}"
+    if not (
+        storage_record := lookups.storages.get(session, storage_import.storage_qr_code)
+    ):
+        storage_record = models.Storage(storage_qr_code=storage_import.storage_qr_code)
+        session.add(storage_record)
+        lookups.storages.add(storage_import.storage_qr_code, storage_record)
+        storage_record.update_from_importmodel(storage_import)
+        storage_record.specimen_id = specimen_id
+        outcomes.added("Storage", index, name, dryrun)
+    else:
+        changed = storage_record.update_from_importmodel(storage_import)
+        if storage_record.specimen_id != specimen_id:
+            storage_record.specimen_id = specimen_id
+            changed = True
+        outcomes.existing("Storage", index, name, changed, dryrun)
+    return storage_record
 
-            specimen_record = find_specimen(
-                session, storage_import.accession, storage_import.collection_date
-            )
 
-            storage_record = (
-                (
-                    session.query(models.Storage)
-                    .filter(
-                        models.Storage.storage_qr_code == storage_import.storage_qr_code
-                    )
-                    .first()
-                )
-                if specimen_record.id
-                else None
+def upsert_storage(
+    session: Session,
+    storage_imports: Sequence[tuple[int, StoragesImport]],
+    dryrun: bool,
+    outcomes: Outcomes | None = None,
+) -> list[tuple[int, StoragesImport, int]]:
+    """Write a chunk of storage with COPY and one set based upsert"""
+    outcomes = outcomes or Outcomes()
+    storage_table = models.Storage.__table__
+    specimen = models.Specimen.__table__
+    with staged(
+        session,
+        [
+            {"accession": s.accession, "collection_date": s.collection_date}
+            | import_values(models.Storage, s)
+            for _, s in last_rows(storage_imports, lambda s: s.storage_qr_code)
+        ],
+    ) as staging:
+        results = merge(
+            session,
+            models.Storage,
+            select(
+                specimen.c.id.label("specimen_id"),
+                *staged_columns(staging, storage_table),
             )
-
-            if not storage_record:
-                storage_record = models.Storage(
-                    storage_qr_code=storage_import.storage_qr_code
-                )
-                session.add(storage_record)
-                logger.info(
-                    f"Storage Sheet Row {index+2}: Storage {storage_import.storage_qr_code} does not exist{'' if dryrun else ', adding'}"
+            .select_from(staging)
+            .join(specimen, specimen_match(staging)),
+            ["storage_qr_code"],
+        )
+        matches = {
+            row.storage_qr_code: row
+            for row in session.execute(
+                select(
+                    staging.c.storage_qr_code,
+                    specimen.c.id.label("specimen_id"),
+                    storage_table.c.id,
                 )
-            else:
-                logger.info(
-                    f"Storage Sheet Row {index+2}: Storage {storage_import.storage_qr_code} already exists{'' if dryrun else ', updating'}"
+                .select_from(staging)
+                .outerjoin(specimen, specimen_match(staging))
+                .outerjoin(
+                    storage_table,
+                    storage_table.c.storage_qr_code == staging.c.storage_qr_code,
                 )
+            )
+        }
+
+    inserted = {result.storage_qr_code for result in results if result.inserted}
+    changed = {result.storage_qr_code for result in results}
+    written = []
+    for index, storage_import in storage_imports:
+        match = matches[storage_import.storage_qr_code]
+        if match.specimen_id is None:
+            outcomes.error(
+                "Storage",
+                index,
+                f"Specimen {storage_import.accession}, {storage_import.collection_date} does not exist",
+                "accession",
+            )
+            continue
 
-            storage_record.update_from_importmodel(storage_import)
-            storage_record.specimen = specimen_record
-
-        except ValidationError as err:
-            for error in err.errors():
-                logger.error(
-                    f"Storage Sheet Row {index+2} {error['loc']} : {error['msg']}"
-                )
-        except ValueError as err:
-            logger.error(f"Storage Sheet Row {index+2} : {err}")
+        name = f"Storage {storage_import.storage_qr_code}"
+        if storage_import.storage_qr_code in inserted:
+            inserted.remove(storage_import.storage_qr_code)
+            outcomes.added("Storage", index, name, dryrun)
+        else:
+            outcomes.existing(
+                "Storage",
+                index,
+                name,
+                storage_import.storage_qr_code in changed,
+                dryrun,
+            )
+        written.append((index, storage_import, match.id))
+    return written
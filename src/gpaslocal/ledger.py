@@ -0,0 +1,155 @@
+import hashlib
+import json
+from datetime import datetime
+from typing import Any, Iterable
+from sqlalchemy import cast, delete, func, select
+from sqlalchemy.dialects.postgresql import TIMESTAMP, insert as pg_insert
+from sqlalchemy.orm import Session
+from gpaslocal import __dbrevision__
+from gpaslocal import models
+from gpaslocal.bulk import BATCH_SIZE
+from gpaslocal.validation import Row
+
+# bump when a change to the importers changes how rows are written, so rows
+# recorded by an earlier release are imported again
+LEDGER_FORMAT = 1
+
+# columns of the rows as read that identify the record each row writes
+LEDGER_KEYS: dict[str, tuple[str, ...]] = {
+    "Runs": ("code",),
+    "Specimens": ("accession", "collection_date"),
+    "Samples": ("guid",),
+    "Storage": ("storage_qr_code",),
+    "Summary": ("Batch", "sample_name"),
+    "Mutation": ("Batch", "sample_name", "Species", "Drug", "Gene", "Mutation"),
+}
+
+
+def normalise(value: Any) -> Any:
+    # pandas reads whole numbers as floats when a column has blanks
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def row_key(sheet: str, row: dict[str, Any]) -> str:
+    return json.dumps([normalise(row.get(c)) for c in LEDGER_KEYS[sheet]], default=str)
+
+
+def rows_hash(rows: list[dict[str, Any]]) -> str:
+    """Hash of the values of rows, a new LEDGER_FORMAT or database revision
+    changes it"""
+    content = json.dumps(
+        [LEDGER_FORMAT, __dbrevision__]
+        + [sorted((k, normalise(v)) for k, v in row.items()) for row in rows],
+        default=str,
+    )
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def upload_started(session: Session) -> datetime:
+    """The database time an upload starts, to the precision of the ledger"""
+    return session.execute(
+        select(cast(func.now(), TIMESTAMP(precision=3)))
+    ).scalar_one()
+
+
+def changed_rows(
+    session: Session,
+    sheet: str,
+    rows: list[Row],
+    force: bool = False,
+    started: datetime | None = None,
+    pending: Iterable[dict[str, str | None]] = (),
+) -> tuple[list[Row], dict[str, str | None]]:
+    """The rows that have changed since they were last imported.
+
+    Rows are grouped by their key and a key is skipped only when all of its
+    rows hash the same as the ledger. Returns the rows to import and the hash
+    of each of their keys, to be recorded once they have been written. With
+    `force` every row is returned.
+
+    `started`, from upload_started, is given when the rows are a chunk of a
+    file, with the hashes of its chunks read but not yet recorded in
+    `pending`. A key recorded since the upload started, or pending, has rows
+    in an earlier chunk, so no single chunk hashes all of them: its rows are
+    always imported and its hash is None, which removes it from the ledger.
+    """
+    grouped: dict[str, list[Row]] = {}
+    for index, row in rows:
+        grouped.setdefault(row_key(sheet, row), []).append((index, row))
+    hashes: dict[str, str | None] = {
+        key: rows_hash([row for _, row in key_rows])
+        for key, key_rows in grouped.items()
+    }
+
+    if started is None and force:
+        ledger = {}
+    else:
+        ledger = ledger_entries(session, sheet, list(hashes))
+    if started is not None:
+        pending = list(pending)
+        for key in hashes:
+            if (key in ledger and ledger[key].updated_at >= started) or any(
+                key in chunk_hashes for chunk_hashes in pending
+            ):
+                hashes[key] = None
+    if not force:
+        hashes = {
+            key: h
+            for key, h in hashes.items()
+            if h is None or key not in ledger or ledger[key].row_hash != h
+        }
+
+    changed = sorted(
+        (row for key in hashes for row in grouped[key]), key=lambda row: row[0]
+    )
+    return changed, hashes
+
+
+def ledger_entries(session: Session, sheet: str, keys: list[str]) -> dict[str, Any]:
+    """The hash and the time each key was recorded, keyed by the key"""
+    ledger = models.ImportLedger
+    entries: dict[str, Any] = {}
+    for start in range(0, len(keys), BATCH_SIZE):
+        entries.update(
+            (entry.key, entry)
+            for entry in session.execute(
+                select(ledger.key, ledger.row_hash, ledger.updated_at).where(
+                    ledger.sheet == sheet,
+                    ledger.key.in_(keys[start : start + BATCH_SIZE]),
+                )
+            )
+        )
+    return entries
+
+
+def record_hashes(session: Session, sheet: str, hashes: dict[str, str | None]) -> None:
+    """Store the hash of each key, replacing any earlier one, and remove the
+    keys without a hash"""
+    rows = [
+        {"sheet": sheet, "key": k, "row_hash": h}
+        for k, h in hashes.items()
+        if h is not None
+    ]
+    # one statement compiled once and executed for many rows, rather than
+    # one statement compiled with the values of every row
+    insert = pg_insert(models.ImportLedger.__table__)  # type: ignore
+    upsert = insert.on_conflict_do_update(
+        index_elements=["sheet", "key"],
+        # set here as well as by the trigger, changed_rows compares it with
+        # the time the upload started
+        set_={"row_hash": insert.excluded.row_hash, "updated_at": func.now()},
+    )
+    for start in range(0, len(rows), BATCH_SIZE):
+        session.execute(upsert, rows[start : start + BATCH_SIZE])
+
+    removed = [k for k, h in hashes.items() if h is None]
+    ledger = models.ImportLedger
+    for start in range(0, len(removed), BATCH_SIZE):
+        session.execute(
+            delete(ledger).where(
+                ledger.sheet == sheet,
+                ledger.key.in_(removed[start : start + BATCH_SIZE]),
+            )
+        )
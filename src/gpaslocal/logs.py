@@ -1,13 +1,41 @@
 import sys
+import threading
 import click_log  # type: ignore
 import logging
 import progressbar
+from contextlib import AbstractContextManager, contextmanager
+from typing import Callable, Iterator
 
 
 class ErrorCheckHandler(logging.StreamHandler):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.error_occurred = False
+        # errors are tracked per thread, so workbooks imported at the same
+        # time by upload-many only see their own errors
+        self.local = threading.local()
+
+    @property
+    def errors(self) -> threading.Event:
+        """The flag set by an error of this thread, which a worker can share"""
+        if (errors := getattr(self.local, "errors", None)) is None:
+            errors = self.local.errors = threading.Event()
+        return errors
+
+    @errors.setter
+    def errors(self, value: threading.Event) -> None:
+        self.local.errors = value
+
+    @property
+    def error_occurred(self) -> bool:
+        return self.errors.is_set()
+
+    @error_occurred.setter
+    def error_occurred(self, value: bool) -> None:
+        if value:
+            self.errors.set()
+        else:
+            # a new flag, so workers sharing the old one do not clear it
+            self.errors = threading.Event()
 
     def emit(self, record):
         if record.levelno == logging.ERROR:
@@ -27,6 +55,52 @@ class CustomLogger(logging.Logger):
         )
 
 
+class FileFilter(logging.Filter):
+    """Prefix the messages of a thread importing a file with the file name"""
+
+    def __init__(self):
+        super().__init__()
+        self.local = threading.local()
+
+    def filter(self, record):
+        if name := getattr(self.local, "name", None):
+            record.msg = f"{name}: {record.msg}"
+        return True
+
+
+@contextmanager
+def file_logging(name: str) -> Iterator[None]:
+    """Log the messages of this thread for the file `name` with its own errors"""
+    file_filter.local.name = name
+    error_check_handler.error_occurred = False
+    try:
+        yield
+    finally:
+        file_filter.local.name = None
+
+
+def worker_logging() -> Callable[[], AbstractContextManager[None]]:
+    """Log the messages of a worker thread as if this thread logged them.
+
+    Call in this thread, and enter the returned context in the worker, whose
+    messages are then prefixed with the file name of this thread, and whose
+    errors mark the file of this thread as failed.
+    """
+    name = getattr(file_filter.local, "name", None)
+    errors = error_check_handler.errors
+
+    @contextmanager
+    def logging_as_caller() -> Iterator[None]:
+        file_filter.local.name = name
+        error_check_handler.errors = errors
+        try:
+            yield
+        finally:
+            file_filter.local.name = None
+
+    return logging_as_caller
+
+
 # we need to wrap the stderr with the progressbar
 # so that logging is displayed correctly
 progressbar.streams.wrap_stderr()
@@ -38,5 +112,8 @@ click_log.basic_config(logger)
 error_check_handler = ErrorCheckHandler(stream=sys.stderr)
 
 logger.addHandler(error_check_handler)
+
+file_filter = FileFilter()
+logger.addFilter(file_filter)
 logger.setLevel(logging.INFO)
 logger.propagate = True
@@ -0,0 +1,91 @@
+from typing import Any, Iterable
+from sqlalchemy import inspect, tuple_
+from sqlalchemy.orm import Session, InstrumentedAttribute
+import gpaslocal.models as models
+
+
+class KeyIndex:
+    """Natural key to primary key index for one table.
+
+    Records added by the import are kept until `release` is called, after which
+    only their primary keys are held so the session does not have to track
+    every record the import has touched.
+    """
+
+    def __init__(self, model: type[Any], *columns: InstrumentedAttribute) -> None:
+        self.model = model
+        self.columns = columns
+        self.ids: dict[Any, int] = {}
+        self.records: dict[Any, Any] = {}
+        self.searched: set = set()
+
+    def preload(self, session: Session, keys: Iterable[Any]) -> None:
+        """Look up the keys not already searched for with one query"""
+        if not (missing := {key for key in keys if key not in self.searched}):
+            return
+
+        if len(self.columns) == 1:
+            criteria = self.columns[0].in_(missing)
+        else:
+            criteria = tuple_(*self.columns).in_(missing)
+
+        for row in session.query(self.model.id, *self.columns).filter(criteria):
+            self.ids[row[1:] if len(self.columns) > 1 else row[1]] = row[0]
+
+        self.searched |= missing
+
+    def get(self, session: Session, key: Any) -> Any:
+        if (record := self.records.get(key)) is None and key in self.ids:
+            record = session.get(self.model, self.ids[key])
+        return record
+
+    def get_id(self, key: Any) -> int | None:
+        if (record := self.records.get(key)) is not None:
+            return record.id
+        return self.ids.get(key)
+
+    def add(self, key: Any, record: Any) -> None:
+        self.records[key] = record
+        self.searched.add(key)
+
+    def release(self) -> None:
+        """Keep only the primary keys of added records, the session must be flushed"""
+        self.ids.update((key, record.id) for key, record in self.records.items())
+        self.records.clear()
+
+    def prune(self) -> None:
+        """Forget added records that were discarded by a rollback"""
+        self.records = {
+            key: record
+            for key, record in self.records.items()
+            if not inspect(record).transient
+        }
+
+
+class ImportLookups:
+    """In memory indexes of the records an import reads and writes.
+
+    Each sheet resolves the natural keys it references with a single query,
+    records added during the import are put into the indexes so that later
+    sheets can resolve them without going back to the database.
+    """
+
+    def __init__(self) -> None:
+        self.runs = KeyIndex(models.Run, models.Run.code)
+        self.owners = KeyIndex(models.Owner, models.Owner.site, models.Owner.user)
+        self.specimens = KeyIndex(
+            models.Specimen, models.Specimen.accession, models.Specimen.collection_date
+        )
+        self.samples = KeyIndex(models.Sample, models.Sample.guid)
+        self.storages = KeyIndex(models.Storage, models.Storage.storage_qr_code)
+
+    def indexes(self) -> tuple[KeyIndex, ...]:
+        return (self.runs, self.owners, self.specimens, self.samples, self.storages)
+
+    def release(self) -> None:
+        for index in self.indexes():
+            index.release()
+
+    def prune(self) -> None:
+        for index in self.indexes():
+            index.prune()
@@ -1,6 +1,14 @@
-from typing import get_args, Optional, List, Dict
+from typing import get_args, Any, Optional, List, Dict
 from datetime import datetime, date
-from sqlalchemy import String, ForeignKey, Text, UniqueConstraint, Enum, JSON
+from sqlalchemy import (
+    String,
+    ForeignKey,
+    Text,
+    UniqueConstraint,
+    Enum,
+    JSON,
+    inspect,
+)
 from sqlalchemy.orm import (
     relationship,
     Mapped,
@@ -39,10 +47,27 @@ class GpasLocalModel(Model):
     def __setitem__(self, key, value):
         setattr(self, key, value)
 
-    def update_from_importmodel(self, importmodel: ImportModel) -> None:
+    def update_from_importmodel(self, importmodel: ImportModel) -> bool:
+        """Copy the fields of an import that differ, returns whether any did.
+
+        Assigning only the changed values leaves an unchanged record clean, so
+        it is not flushed and no version row is written for it.
+        """
+        # every field of a new record is set, so missing values are not
+        # replaced with the column defaults
+        new = changed = not inspect(self).persistent
         for field in importmodel.model_fields:
-            if hasattr(self, field):
-                self[field] = importmodel[field]
+            if not hasattr(self, field):
+                continue
+            value = importmodel[field]
+            if new or self[field] != self.stored_value(field, value):
+                self[field] = value
+                changed = True
+        return changed
+
+    def stored_value(self, field: str, value: Any) -> Any:
+        """A value as the record stores it once assigned, to compare it with"""
+        return value
 
 
 class Owner(GpasLocalModel):
@@ -195,9 +220,13 @@ class Sample(GpasLocalModel):
 
     @nucleic_acid_type.setter  # type: ignore
     def nucleic_acid_type(self, value):
-        self._nucleic_acid_type = (
-            value if isinstance(value, list) else [] if value is None else list(value)
-        )
+        self._nucleic_acid_type = self.stored_value("nucleic_acid_type", value)
+
+    def stored_value(self, field: str, value: Any) -> Any:
+        if field == "nucleic_acid_type":
+            # sorted, so the same types compare equal whatever their order
+            return sorted(value or [])
+        return value
 
     run: Mapped["Run"] = relationship("Run", back_populates="samples")
     specimen: Mapped["Specimen"] = relationship("Specimen", back_populates="samples")
@@ -214,7 +243,7 @@ class Sample(GpasLocalModel):
         if not isinstance(nucleic_acid_type, list):
             raise ValueError("Nucleic acid type must be a list")
         # make sure only unique nucleic acid types are added
-        return list(set(nucleic_acid_type))
+        return sorted(set(nucleic_acid_type))
 
 
 class SampleDetail(GpasLocalModel):
@@ -435,4 +464,26 @@ class Mutations(GpasLocalModel):
     UniqueConstraint(analysis_id, species, drug, gene, mutation)
 
 
+class ImportLedger(GpasLocalModel):
+    __tablename__ = "import_ledger"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    sheet: Mapped[str] = mapped_column(String(20), nullable=False)
+    key: Mapped[Text] = mapped_column(Text, nullable=False)
+    row_hash: Mapped[str] = mapped_column(String(64), nullable=False)
+
+    UniqueConstraint(sheet, key)
+
+
+class ImportCheckpoint(GpasLocalModel):
+    __tablename__ = "import_checkpoints"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    file_digest: Mapped[str] = mapped_column(String(64), nullable=False)
+    sheet: Mapped[str] = mapped_column(String(20), nullable=False)
+    rows: Mapped[int] = mapped_column(nullable=False)
+
+    UniqueConstraint(file_digest, sheet)
+
+
 configure_mappers()
@@ -0,0 +1,102 @@
+import logging
+from collections import Counter
+from typing import Iterator
+from gpaslocal.logs import logger
+
+ADDED = "added"
+UPDATED = "updated"
+UNCHANGED = "unchanged"
+# unchanged since the last upload, so not validated or written
+SKIPPED = "skipped"
+FAILED = "failed"
+
+ACTIONS = (ADDED, UPDATED, UNCHANGED, SKIPPED, FAILED)
+
+
+class Outcome:
+    """The record a row was written to, what was done and any errors"""
+
+    def __init__(self) -> None:
+        self.key: str | None = None
+        self.action: str | None = None
+        # the column of each error, None for the row as a whole
+        self.errors: list[tuple[str | None, str]] = []
+
+
+class Outcomes:
+    """What the import did with each row, by sheet.
+
+    A row written again, as the rows of a rejected chunk are, keeps the
+    outcome of its last write, and a row with an error stays failed. Rows
+    are only logged at DEBUG, the counts of each sheet are logged once the
+    import has finished.
+    """
+
+    def __init__(self) -> None:
+        self.rows: dict[str, dict[int, Outcome]] = {}
+
+    def outcome(self, sheet: str, index: int) -> Outcome:
+        return self.rows.setdefault(sheet, {}).setdefault(index, Outcome())
+
+    def record(
+        self, sheet: str, index: int, action: str, key: str | None = None
+    ) -> None:
+        outcome = self.outcome(sheet, index)
+        outcome.action = action
+        outcome.key = key or outcome.key
+
+    def added(self, sheet: str, index: int, name: str, dryrun: bool) -> None:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                f"{sheet} Sheet Row {index+2}: {name} does not exist{'' if dryrun else ', adding'}"
+            )
+        self.record(sheet, index, ADDED, name)
+
+    def existing(
+        self, sheet: str, index: int, name: str, changed: bool, dryrun: bool
+    ) -> None:
+        if logger.isEnabledFor(logging.DEBUG):
+            change = ", unchanged" if not changed else "" if dryrun else ", updating"
+            logger.debug(f"{sheet} Sheet Row {index+2}: {name} already exists{change}")
+        self.record(sheet, index, UPDATED if changed else UNCHANGED, name)
+
+    def failed(
+        self, sheet: str, index: int, message: str, column: str | None = None
+    ) -> None:
+        """Record an error of a row that has already been logged"""
+        self.outcome(sheet, index).errors.append((column, message))
+
+    def error(
+        self, sheet: str, index: int, message: str, column: str | None = None
+    ) -> None:
+        logger.error(f"{sheet} Sheet Row {index+2} : {message}")
+        self.failed(sheet, index, message, column)
+
+    def action(self, outcome: Outcome) -> str | None:
+        return FAILED if outcome.errors else outcome.action
+
+    def counts(self, sheet: str) -> Counter[str | None]:
+        return Counter(
+            self.action(outcome) for outcome in self.rows.get(sheet, {}).values()
+        )
+
+    def table(self) -> Iterator[tuple[str, int, str | None, str | None, str]]:
+        """The sheet, row number, key, action and errors of every row"""
+        for sheet, outcomes in self.rows.items():
+            for index in sorted(outcomes):
+                outcome = outcomes[index]
+                yield (
+                    sheet,
+                    index + 2,
+                    outcome.key,
+                    self.action(outcome),
+                    "; ".join(message for _, message in outcome.errors),
+                )
+
+    def log_summary(self) -> None:
+        for sheet in self.rows:
+            counts = self.counts(sheet)
+            logger.info(
+                f"{sheet} Sheet: "
+                + ", ".join(f"{counts[action]} {action}" for action in ACTIONS)
+            )
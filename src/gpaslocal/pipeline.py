@@ -0,0 +1,55 @@
+from queue import Full, Queue
+from threading import Event, Thread
+from typing import Any, Iterable, Iterator, TypeVar
+from gpaslocal.logs import worker_logging
+
+T = TypeVar("T")
+
+# how long a blocked stage waits before checking if the pipeline has stopped
+POLL_SECONDS = 0.1
+
+
+def prefetch(items: Iterable[T], size: int = 2) -> Iterator[T]:
+    """Produce the items in a background thread, at most `size` ahead.
+
+    The thread waits while the queue is full, so a slow consumer holds the
+    producer back. An exception raised producing the items is raised again
+    here, and the thread stops when the consumer stops early. Messages
+    logged producing the items are logged for the file of the consumer.
+    """
+    queue: Queue[tuple[bool, Any]] = Queue(maxsize=size)
+    stop = Event()
+    logging_as_consumer = worker_logging()
+
+    def put(done: bool, item: Any) -> bool:
+        while not stop.is_set():
+            try:
+                queue.put((done, item), timeout=POLL_SECONDS)
+                return True
+            except Full:
+                continue
+        return False
+
+    def produce() -> None:
+        with logging_as_consumer():
+            try:
+                for item in items:
+                    if not put(False, item):
+                        return
+                put(True, None)
+            except BaseException as err:
+                put(True, err)
+
+    thread = Thread(target=produce, name="prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            done, item = queue.get()
+            if done:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
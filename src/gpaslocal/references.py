@@ -0,0 +1,187 @@
+from datetime import date, datetime
+from typing import Any
+from openpyxl.workbook import Workbook  # type: ignore
+from sqlalchemy import (
+    Column,
+    Date,
+    Integer,
+    MetaData,
+    Table,
+    Text,
+    and_,
+    exists,
+    insert,
+    or_,
+    select,
+)
+from sqlalchemy.orm import Session
+from gpaslocal import models
+from gpaslocal.bulk import BATCH_SIZE
+from gpaslocal.constants import coerce_to_str
+from gpaslocal.logs import logger
+from gpaslocal.outcomes import Outcomes
+from gpaslocal.workbook import CHUNK_SIZE, read_sheet
+
+# row numbers listed in each missing reference error
+MAX_ROWS = 10
+
+
+def reference_table() -> Table:
+    return Table(
+        "import_references",
+        MetaData(),
+        Column("sheet", Text),
+        Column("row", Integer),
+        Column("run_code", Text),
+        Column("accession", Text),
+        Column("collection_date", Date),
+        prefixes=["TEMPORARY"],
+    )
+
+
+def key_text(value: Any) -> str | None:
+    return None if value is None else coerce_to_str(value)
+
+
+def key_date(value: Any) -> date | None:
+    """The date a cell is validated to, None if it is not a date"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, str):
+        try:
+            return date.fromisoformat(value.strip())
+        except ValueError:
+            return None
+    return None
+
+
+def workbook_references(
+    wb: Workbook, chunk_size: int = CHUNK_SIZE
+) -> list[dict[str, Any]]:
+    """Runs and specimens used by the Samples and Storage sheets.
+
+    References to runs and specimens in the workbook are left out, as are
+    keys that will not validate, which are reported by the import itself.
+    """
+    run_codes = {
+        key_text(row.get("code"))
+        for chunk in read_sheet(wb, "Runs", chunk_size)
+        for _, row in chunk
+    }
+    specimen_keys = {
+        (key_text(row.get("accession")), key_date(row.get("collection_date")))
+        for chunk in read_sheet(wb, "Specimens", chunk_size)
+        for _, row in chunk
+    }
+
+    references = []
+    for sheet in ("Samples", "Storage"):
+        for chunk in read_sheet(wb, sheet, chunk_size):
+            for index, row in chunk:
+                run_code = key_text(row.get("run_code"))
+                if run_code in run_codes:
+                    run_code = None
+                specimen_key = (
+                    key_text(row.get("accession")),
+                    key_date(row.get("collection_date")),
+                )
+                if None in specimen_key or specimen_key in specimen_keys:
+                    specimen_key = (None, None)
+                if run_code is None and specimen_key == (None, None):
+                    continue
+
+                references.append(
+                    {
+                        "sheet": sheet,
+                        "row": index + 2,
+                        "run_code": run_code,
+                        "accession": specimen_key[0],
+                        "collection_date": specimen_key[1],
+                    }
+                )
+    return references
+
+
+def missing_references(
+    session: Session, references: list[dict[str, Any]]
+) -> dict[tuple, list[int]]:
+    """Find the references that are not in the database with one anti-join.
+
+    The references are loaded into a temporary table, which is dropped again
+    once they have been checked. Returns the rows using each missing run or
+    specimen, keyed by the sheet, the kind of record and its key.
+    """
+    table = reference_table()
+    connection = session.connection()
+    table.create(connection)
+    for start in range(0, len(references), BATCH_SIZE):
+        connection.execute(insert(table), references[start : start + BATCH_SIZE])
+
+    run_missing = and_(
+        table.c.run_code.is_not(None),
+        ~exists().where(models.Run.code == table.c.run_code),
+    )
+    specimen_missing = and_(
+        table.c.accession.is_not(None),
+        ~exists().where(
+            models.Specimen.accession == table.c.accession,
+            models.Specimen.collection_date == table.c.collection_date,
+        ),
+    )
+    missing: dict[tuple, list[int]] = {}
+    for row in connection.execute(
+        select(
+            table,
+            run_missing.label("run_missing"),
+            specimen_missing.label("specimen_missing"),
+        )
+        .where(or_(run_missing, specimen_missing))
+        .order_by(table.c.sheet, table.c.row)
+    ):
+        if row.run_missing:
+            missing.setdefault((row.sheet, "Run", row.run_code), []).append(row.row)
+        if row.specimen_missing:
+            missing.setdefault(
+                (row.sheet, "Specimen", f"{row.accession}, {row.collection_date}"),
+                [],
+            ).append(row.row)
+    table.drop(connection)
+    return missing
+
+
+def listed_rows(rows: list[int]) -> str:
+    """The row numbers of an error, only the first MAX_ROWS are listed"""
+    listed = ", ".join(str(row) for row in rows[:MAX_ROWS])
+    if len(rows) > MAX_ROWS:
+        listed += f" and {len(rows) - MAX_ROWS} more"
+    return f"Row{'s' if len(rows) > 1 else ''} {listed}"
+
+
+def check_references(
+    session: Session,
+    wb: Workbook,
+    chunk_size: int = CHUNK_SIZE,
+    outcomes: Outcomes | None = None,
+) -> bool:
+    """Report every run and specimen the workbook uses that does not exist.
+
+    Each missing record is logged once with the rows that use it, and
+    recorded against every one of those rows in `outcomes`, if given.
+    """
+    if not (references := workbook_references(wb, chunk_size)):
+        return True
+
+    missing = missing_references(session, references)
+    for (sheet, kind, key), rows in missing.items():
+        logger.error(f"{sheet} Sheet {listed_rows(rows)} : {kind} {key} does not exist")
+        if outcomes:
+            for row in rows:
+                outcomes.failed(
+                    sheet,
+                    row - 2,
+                    f"{kind} {key} does not exist",
+                    "run_code" if kind == "Run" else "accession",
+                )
+    return not missing
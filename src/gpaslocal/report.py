@@ -0,0 +1,60 @@
+import csv
+from pathlib import Path
+from openpyxl import load_workbook  # type: ignore
+from openpyxl.comments import Comment  # type: ignore
+from openpyxl.styles import PatternFill  # type: ignore
+from openpyxl.utils.exceptions import InvalidFileException  # type: ignore
+from gpaslocal.logs import logger
+from gpaslocal.outcomes import Outcomes
+
+REPORT_COLUMNS = ("sheet", "row", "key", "action", "error")
+
+ERROR_FILL = PatternFill(fill_type="solid", start_color="FFC7CE", end_color="FFC7CE")
+
+
+def write_report(outcomes: Outcomes, excel_wb: str, path: str) -> None:
+    """Write the outcome of every row to a CSV file, or else to a copy of the
+    workbook with the errors highlighted.
+
+    A report that cannot be written is a warning, so it does not fail the
+    import it reports on.
+    """
+    try:
+        if Path(path).suffix.lower() == ".csv":
+            write_csv(outcomes, path)
+        else:
+            annotate_workbook(outcomes, excel_wb, path)
+    except (OSError, InvalidFileException) as err:
+        logger.warning(f"Could not write the report {path}: {err}")
+        return
+    logger.info(f"Report written to {path}")
+
+
+def write_csv(outcomes: Outcomes, path: str) -> None:
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(REPORT_COLUMNS)
+        writer.writerows(outcomes.table())
+
+
+def annotate_workbook(outcomes: Outcomes, excel_wb: str, path: str) -> None:
+    """Copy the workbook with each cell in error filled and commented.
+
+    An error that is not about one column is marked on the row's first cell.
+    """
+    wb = load_workbook(excel_wb, keep_vba=Path(path).suffix.lower() == ".xlsm")
+    for sheet, rows in outcomes.rows.items():
+        if sheet not in wb.sheetnames:
+            continue
+        ws = wb[sheet]
+        columns = {
+            str(cell.value): cell.column for cell in ws[1] if cell.value is not None
+        }
+        for index, outcome in rows.items():
+            for column, message in outcome.errors:
+                cell = ws.cell(row=index + 2, column=columns.get(column or "", 1))
+                cell.fill = ERROR_FILL
+                if cell.comment:
+                    message = f"{cell.comment.text}\n{message}"
+                cell.comment = Comment(message, "gpaslocal")
+    wb.save(path)
@@ -104,6 +104,13 @@ def db_session(postgresql) -> Generator[Session, None, None]:
     session.close()  # Clean up after the test
 
 
+@pytest.fixture(autouse=True)
+def workbook_cache(tmp_path, monkeypatch):
+    """Keep the parsed workbooks cached by tests out of the user's cache"""
+    monkeypatch.setattr("gpaslocal.config.config.CACHE_DIR", str(tmp_path / "cache"))
+
+
 @pytest.fixture(autouse=True)
 def set_caplog_level(caplog):
-    caplog.set_level(logging.INFO, logger="gpas-local")
+    # the outcome of each row is logged at DEBUG
+    caplog.set_level(logging.DEBUG, logger="gpas-local")
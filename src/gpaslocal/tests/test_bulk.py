@@ -0,0 +1,107 @@
+from datetime import date
+from sqlalchemy import inspect, select
+from sqlalchemy_continuum import version_class  # type: ignore
+from gpaslocal import models
+from gpaslocal.bulk import merge, staged, staged_value, upsert
+
+RunVersion = version_class(models.Run)
+
+test1 = {
+    "code": "test1",
+    "run_date": date.fromisoformat("2024-01-01"),
+    "site": "Oxford",
+    "sequencing_method": "Illumina",
+    "machine": "test_m1",
+    "user": "blah",
+    "number_samples": 2,
+    "flowcell": "fc2",
+    "passed_qc": True,
+    "comment": "test_comment",
+}
+
+
+def test_upsert_inserts_and_updates(db_session):
+    rows = [
+        test1 | {"machine": "test_m2"},
+        test1 | {"code": "test2"},
+    ]
+
+    result = upsert(db_session, models.Run, rows, ["code"])
+
+    assert {(r.code, r.inserted) for r in result} == {
+        ("test1", False),
+        ("test2", True),
+    }
+    test1_id = next(r.id for r in result if r.code == "test1")
+    assert db_session.get(models.Run, test1_id).machine == "test_m2"
+
+    versions = (
+        db_session.query(RunVersion)
+        .filter(RunVersion.code.in_(["test1", "test2"]))
+        .order_by(RunVersion.code, RunVersion.transaction_id)
+        .all()
+    )
+    assert [(v.code, v.machine, v.operation_type) for v in versions] == [
+        ("test1", "test_m1", 0),
+        ("test1", "test_m2", 1),
+        ("test2", "test_m1", 0),
+    ]
+    # the previous version is closed by the new transaction
+    assert versions[0].end_transaction_id == versions[1].transaction_id
+    assert versions[1].transaction_id == versions[2].transaction_id
+    assert versions[1].end_transaction_id is None
+
+
+def test_upsert_skips_unchanged(db_session):
+    versions = db_session.query(RunVersion).count()
+
+    result = upsert(db_session, models.Run, [test1], ["code"])
+
+    assert result == []
+    assert db_session.query(RunVersion).count() == versions
+
+
+def test_staged_copies_values(db_session):
+    rows = [
+        {
+            "text": "tab\there\\back\nline",
+            "day": date(2024, 1, 2),
+            "flag": True,
+            "items": ['say "hi"', "rna"],
+            "missing": None,
+        }
+    ]
+
+    with staged(db_session, rows) as staging:
+        copied = db_session.execute(select(staging)).one()
+
+    assert tuple(copied) == (
+        "tab\there\\back\nline",
+        "2024-01-02",
+        "t",
+        '{"say \\"hi\\"","rna"}',
+        None,
+    )
+    # the staging table is dropped once it has been used
+    assert not inspect(db_session.connection()).has_table("import_staging")
+
+
+def test_merge_staged_rows(db_session):
+    run = models.Run.__table__
+    rows = [test1 | {"machine": "test_m2"}, test1 | {"code": "test2"}]
+
+    with staged(db_session, rows) as staging:
+        result = merge(
+            db_session,
+            models.Run,
+            select(*[staged_value(staging.c[c], run.c[c]).label(c) for c in test1]),
+            ["code"],
+        )
+
+    assert {(r.code, r.inserted) for r in result} == {
+        ("test1", False),
+        ("test2", True),
+    }
+    test2 = db_session.get(models.Run, next(r.id for r in result if r.inserted))
+    assert (test2.run_date, test2.passed_qc) == (date(2024, 1, 1), True)
+    assert db_session.query(RunVersion).filter_by(code="test2").count() == 1
@@ -0,0 +1,27 @@
+import os
+from datetime import datetime, time, timedelta
+from gpaslocal.cache import decode, encode, evict
+
+
+def test_encode_decode():
+    values = [None, "1", 1, 1.5, True, datetime(2024, 1, 2, 3, 4), time(1, 2), "s"]
+    values.append(timedelta(hours=1))
+
+    assert [decode(encode(value)) for value in values] == values
+    # the type of each value is kept
+    assert [type(decode(encode(value))) for value in values] == [
+        type(value) for value in values
+    ]
+
+
+def test_evict(tmp_path):
+    for age, name in enumerate(["newest", "middle", "oldest"]):
+        entry = tmp_path / name
+        entry.mkdir()
+        (entry / "Runs.parquet").write_bytes(b"x" * 100)
+        os.utime(entry, (1000 - age, 1000 - age))
+
+    evict(tmp_path, 250, keep=tmp_path / "oldest")
+
+    # the least recently used entry is removed, unless it was just written
+    assert sorted(entry.name for entry in tmp_path.iterdir()) == ["newest", "oldest"]
@@ -0,0 +1,43 @@
+from gpaslocal import models
+from gpaslocal.checkpoints import Checkpoint
+from gpaslocal.logs import error_check_handler, logger
+
+chunks = [
+    [(0, {"code": "R1"}), (1, {"code": "R2"})],
+    [(2, {"code": "R3"}), (3, {"code": "R4"})],
+]
+
+
+def test_checkpoint_resume(db_session, tmp_path, monkeypatch):
+    monkeypatch.setattr(error_check_handler, "error_occurred", False)
+    xl = tmp_path / "import.xlsx"
+    xl.write_bytes(b"workbook")
+
+    checkpoint = Checkpoint(db_session, str(xl))
+    assert list(checkpoint.skip_done("Runs", chunks)) == chunks
+    checkpoint.commit("Runs", 3)
+    assert checkpoint.committed
+
+    # the same file carries on after the committed rows
+    checkpoint = Checkpoint(db_session, str(xl))
+    assert list(checkpoint.skip_done("Runs", chunks)) == [[(3, {"code": "R4"})]]
+    assert list(checkpoint.skip_done("Storage", chunks)) == chunks
+
+    # an edited file starts again
+    xl.write_bytes(b"edited workbook")
+    assert list(Checkpoint(db_session, str(xl)).skip_done("Runs", chunks)) == chunks
+
+
+def test_checkpoint_stops_after_error(db_session, tmp_path, monkeypatch):
+    monkeypatch.setattr(error_check_handler, "error_occurred", False)
+    xl = tmp_path / "import.xlsx"
+    xl.write_bytes(b"workbook")
+
+    checkpoint = Checkpoint(db_session, str(xl))
+    checkpoint.commit("Runs", 2)
+    logger.error("Runs Sheet Row 4 : bad run")
+    checkpoint.commit("Runs", 4)
+    assert checkpoint.rows_done("Runs") == 2
+
+    checkpoint.finish()
+    assert db_session.query(models.ImportCheckpoint).count() == 0
@@ -0,0 +1,72 @@
+from sqlalchemy import event
+from sqlalchemy_continuum import version_class  # type: ignore
+from gpaslocal import models
+from gpaslocal.details import sync_details
+
+types = {"host": "str", "lat": "float", "lon": "float"}
+
+
+def record_statements(session):
+    statements = []
+
+    @event.listens_for(session.get_bind(), "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    return statements
+
+
+def sync(session, values):
+    sync_details(
+        session,
+        models.SpecimenDetail,
+        "specimen_id",
+        "specimen_detail_type_code",
+        values,
+        types,
+    )
+
+
+def details(session):
+    return {
+        (d.specimen_detail_type_code): (d.value_str, d.value_float)
+        for d in session.query(models.SpecimenDetail).filter_by(specimen_id=1)
+    }
+
+
+def test_sync_details(db_session):
+    sync(db_session, {1: {"host": "human", "lat": 51.5, "lon": None}})
+    assert details(db_session) == {"host": ("human", None), "lat": (None, 51.5)}
+    # a new transaction, so new version rows rather than the same ones updated
+    db_session.commit()
+
+    sync(db_session, {1: {"host": "cow", "lat": None, "lon": -1.2}})
+    assert details(db_session) == {"host": ("cow", None), "lon": (None, -1.2)}
+
+    SpecimenDetailVersion = version_class(models.SpecimenDetail)
+    versions = (
+        db_session.query(SpecimenDetailVersion)
+        .order_by(SpecimenDetailVersion.id, SpecimenDetailVersion.operation_type)
+        .all()
+    )
+    assert [(v.specimen_detail_type_code, v.operation_type) for v in versions] == [
+        ("host", 0),
+        ("host", 1),
+        ("lat", 0),
+        ("lat", 2),
+        ("lon", 0),
+    ]
+
+
+def test_sync_details_statements(db_session):
+    sync(db_session, {1: {"host": "human", "lat": 51.5, "lon": None}})
+    statements = record_statements(db_session)
+
+    # unchanged values are not written
+    sync(db_session, {1: {"host": "human", "lat": 51.5, "lon": None}})
+    assert len(statements) == 1
+
+    # one query to load, the upsert and its version rows
+    statements.clear()
+    sync(db_session, {1: {"host": "cow", "lat": 51.5, "lon": -1.2}})
+    assert len(statements) == 1 + 1 + 4
@@ -0,0 +1,248 @@
+from collections import Counter
+from gpaslocal import models
+from gpaslocal.gpas_upload import (
+    csv_chunks,
+    drugs,
+    find_analyses,
+    find_samples,
+    mutation_staging,
+    sample_mapping,
+    upsert_mutations,
+)
+from gpaslocal.upload_models import GpasSummary, Mutations
+
+
+def add_sample(db_session, guid):
+    sample = models.Sample(
+        guid=guid,
+        run=db_session.query(models.Run).first(),
+        specimen=db_session.query(models.Specimen).first(),
+    )
+    db_session.add(sample)
+    db_session.flush()
+    return sample
+
+
+def test_find_samples(db_session, tmp_path, caplog):
+    add_sample(db_session, "guid1")
+    mutation_csv = tmp_path / "mutation.csv"
+    mutation_csv.write_text(
+        "Sample ID,Batch\nR1,B1\nR2,B1\nR1,B1\nR9,B1\nR2,B1\nR3,B1\n"
+    )
+    mapping_csv = tmp_path / "mapping.csv"
+    mapping_csv.write_text(
+        "remote_sample_name,sample_name\nR1,guid1\nR2,guid2\nR3,guid3\n"
+    )
+
+    samples, missing = find_samples(
+        db_session,
+        "Mutation",
+        str(mutation_csv),
+        sample_mapping(str(mapping_csv)),
+        chunk_size=2,
+    )
+
+    assert samples == {"guid1": db_session.query(models.Sample).one().id}
+    assert missing == {"guid2", "guid3"}
+    # each missing sample is reported once, with its rows from every chunk
+    assert "Mutation Rows 3, 6 : Sample guid2 does not exist" in caplog.text
+    assert "Mutation Row 7 : Sample guid3 does not exist" in caplog.text
+    assert caplog.text.count("does not exist") == 2
+
+
+def test_find_analyses(db_session, caplog):
+    sample = add_sample(db_session, "guid1")
+    existing = models.Analysis(sample=sample, batch_name="B1", assay_system="Other")
+    db_session.add(existing)
+    db_session.flush()
+    rows = [
+        (0, {"sample_name": "guid1", "Batch": "B1"}),
+        (1, {"sample_name": "guid1", "Batch": "B2"}),
+        (2, {"sample_name": "guid1", "Batch": "B2"}),
+        (3, {"sample_name": "guid2", "Batch": "B1"}),
+        (4, {"sample_name": "guid1", "Batch": "B" * 21}),
+    ]
+
+    counts: Counter[str] = Counter()
+    analyses = find_analyses(
+        db_session, "Summary", rows, {"guid1": sample.id}, dryrun=False, counts=counts
+    )
+
+    added = db_session.query(models.Analysis).filter_by(batch_name="B2").one()
+    assert analyses == {(sample.id, "B1"): existing.id, (sample.id, "B2"): added.id}
+    db_session.refresh(existing)
+    assert existing.assay_system == added.assay_system == "GPAS TB"
+    assert counts == {"added": 1, "updated": 1}
+    assert "Summary: Batch B2, Sample guid1 does not exist, adding" in caplog.text
+    assert "Batch B1" not in caplog.text
+
+
+def summary(prediction):
+    return GpasSummary.model_validate(
+        {
+            "sample_name": "guid1",
+            "Batch": "B1",
+            "Main Species": None,
+            "Resistance Prediction": prediction,
+        }
+    )
+
+
+def test_drugs(db_session, caplog):
+    for code in "SRUF_":
+        db_session.add(models.DrugResistanceResultType(code=code))
+    analysis = models.Analysis(
+        sample=add_sample(db_session, "guid1"), batch_name="B1", assay_system="GPAS TB"
+    )
+    db_session.add(analysis)
+    db_session.flush()
+
+    counts = [
+        drugs(db_session, {analysis.id: (0, summary(prediction))}, dryrun=False)
+        for prediction in ("RSUF S_ SR", "RSUF S_ SS", "RSUF S_ SS")
+    ]
+
+    results = {
+        r.antibiotic: r.drug_resistance_result_type_code
+        for r in db_session.query(models.DrugResistance)
+    }
+    assert results == {
+        "Isoniazid (INH)": "R",
+        "Rifampicin (RIF)": "S",
+        "Pyrazinamide (PZA)": "U",
+        "Ethambutol (EMB)": "F",
+        "Moxifloxacin (MXF)": "S",
+        "Levofloxacin (LEV)": "_",
+        "Linezolid (LZD)": "S",
+        "Bedaquiline (BDQ)": "S",
+    }
+    assert "Sample guid1 does not exist, adding" in caplog.text
+    assert "Sample guid1 already exists, updating" in caplog.text
+    assert counts == [{"added": 1}, {"updated": 1}, {"unchanged": 1}]
+
+
+def test_drugs_complete(db_session, caplog):
+    assert drugs(db_session, {1: (0, summary("Complete"))}, dryrun=False) == {
+        "empty": 1
+    }
+
+    assert "Sample guid1 Empty" in caplog.text
+    assert db_session.query(models.DrugResistance).count() == 0
+
+
+def mutation(name, prediction="R"):
+    return Mutations.model_validate(
+        {
+            "sample_name": "guid1",
+            "Batch": "B1",
+            "Species": "M. tb",
+            "Drug": "INH",
+            "Gene": "katG",
+            "Mutation": name,
+            "Position": 315,
+            "Ref": "S",
+            "Alt": "T",
+            "Coverage": "30x",
+            "Prediction": prediction,
+            "Evidence": "ev",
+        }
+    )
+
+
+def test_upsert_mutations(db_session):
+    analysis = models.Analysis(
+        sample=add_sample(db_session, "guid1"), batch_name="B1", assay_system="GPAS TB"
+    )
+    db_session.add(analysis)
+    db_session.flush()
+
+    counts = upsert_mutations(
+        db_session,
+        [(0, mutation("S315T"), analysis.id), (1, mutation("S315N"), analysis.id)],
+        dryrun=False,
+    )
+    assert counts == {"added": 2}
+
+    counts = upsert_mutations(
+        db_session,
+        [
+            (0, mutation("S315T"), analysis.id),
+            (1, mutation("S315N", "S"), analysis.id),
+            # a repeated mutation is written with its last row
+            (2, mutation("S315N", "U"), analysis.id),
+        ],
+        dryrun=False,
+    )
+    assert counts == {"unchanged": 1, "updated": 2}
+    predictions = {
+        m.mutation: m.prediction
+        for m in db_session.query(models.Mutations).filter_by(analysis=analysis)
+    }
+    assert predictions == {"S315T": "R", "S315N": "U"}
+
+
+def test_upsert_mutations_failed(db_session, caplog):
+    analysis = models.Analysis(
+        sample=add_sample(db_session, "guid1"), batch_name="B1", assay_system="GPAS TB"
+    )
+    db_session.add(analysis)
+    db_session.flush()
+    staging = mutation_staging(db_session)
+
+    counts = upsert_mutations(
+        db_session,
+        [
+            (0, mutation("S315T"), analysis.id + 1),
+            (1, mutation("S315N"), analysis.id),
+            (2, mutation("S315G"), analysis.id),
+        ],
+        False,
+        staging,
+    )
+
+    # only the failing row is logged, the other rows are still written
+    assert counts == {"added": 2}
+    assert "Mutation Row 2 : " in caplog.text
+    assert "ForeignKeyViolation" in caplog.text
+    assert "Row 3" not in caplog.text and "Row 4" not in caplog.text
+    assert {m.mutation for m in db_session.query(models.Mutations)} == {
+        "S315N",
+        "S315G",
+    }
+    # only the failed rows are rolled back, the staging table is kept
+    for prediction in ("R", "S"):
+        upsert_mutations(
+            db_session,
+            [(0, mutation("S315T", prediction), analysis.id)],
+            False,
+            staging,
+        )
+    s315t = db_session.query(models.Mutations).filter_by(mutation="S315T").one()
+    assert s315t.prediction == "S"
+
+
+def test_csv_chunks(tmp_path):
+    mutation_csv = tmp_path / "mutation.csv"
+    mutation_csv.write_text(
+        "Sample ID,Batch,Gene,Position\nR1,B1,katG,1\nR2,B1,rpoB,2\nR9,B1,katG,3\n"
+    )
+    mapping_csv = tmp_path / "mapping.csv"
+    mapping_csv.write_text(
+        "remote_sample_name,sample_name\nR1,guid0\nR1,guid1\nR2,guid2\n"
+    )
+
+    chunks = list(csv_chunks(str(mutation_csv), sample_mapping(str(mapping_csv)), 2))
+
+    assert [[index for index, _ in chunk] for chunk in chunks] == [[0, 1], [2]]
+    rows = [row for chunk in chunks for _, row in chunk]
+    # the last mapping of a sample is used
+    assert rows[0] == {
+        "Sample ID": "R1",
+        "Batch": "B1",
+        "Gene": "katG",
+        "Position": 1,
+        "remote_sample_name": "R1",
+        "sample_name": "guid1",
+    }
+    assert rows[1]["sample_name"] == "guid2"
+    assert rows[2]["sample_name"] is None and rows[2]["remote_sample_name"] is None
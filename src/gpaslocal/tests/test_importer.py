@@ -1,10 +1,32 @@
 import pytest
 import os
+import pandas as pd
+from contextlib import closing
 from datetime import date
 from sqlalchemy import text
-from gpaslocal.upload_models import SpecimensImport
+from sqlalchemy_continuum import version_class  # type: ignore
+from gpaslocal.upload_models import SamplesImport, SpecimensImport
 from gpaslocal import models
-from gpaslocal.importer import owner, find_run, find_specimen, runs
+from gpaslocal.logs import error_check_handler, logger
+from gpaslocal.lookups import ImportLookups
+from gpaslocal.outcomes import Outcomes
+from gpaslocal.importer import (
+    owner,
+    find_run,
+    find_specimen,
+    import_many,
+    runs,
+    samples,
+    specimens,
+    spike_layout,
+    spike_values,
+    sync_spikes,
+    upsert_samples,
+    validate_data,
+    write_chunk,
+)
+from gpaslocal.validation import validate_batch
+from gpaslocal.workbook import open_workbook, read_sheet
 
 
 def test_some_database_interaction(db_session):
@@ -128,7 +150,394 @@ def test_runs_upload_ok_new(db_session, caplog):
     dir_path = os.path.dirname(os.path.realpath(__file__))
     xl_ok = os.path.join(dir_path, "data", "test_no_errors.xlsm")
 
-    runs(db_session, xl_ok, dryrun=True)
+    with closing(open_workbook(xl_ok)) as wb:
+        runs(db_session, read_sheet(wb, "Runs"), dryrun=True)
 
     assert "Sheet Row 2: Run test1 already exists" in caplog.text
     assert "Runs Sheet Row 3: Run test2 does not exist" in caplog.text
+
+
+def test_runs_unchanged(db_session, caplog):
+    test1 = {
+        "code": "test1",
+        "run_date": date.fromisoformat("2024-01-01"),
+        "site": "Oxford",
+        "sequencing_method": "illumina",
+        "machine": "test_m1",
+        "user": "blah",
+        "number_samples": 2,
+        "flowcell": "fc2",
+        "passed_qc": True,
+        "comment": "test_comment",
+    }
+    db_session.get(models.Run, 2).sequencing_method = "illumina"
+    db_session.commit()
+    RunVersion = version_class(models.Run)
+    versions = db_session.query(RunVersion).count()
+    outcomes = Outcomes()
+
+    runs(
+        db_session,
+        [[(0, test1), (1, test1 | {"code": "Run1", "machine": "Machine1"})]],
+        dryrun=False,
+        outcomes=outcomes,
+    )
+    db_session.flush()
+
+    assert "Runs Sheet Row 2: Run test1 already exists, unchanged" in caplog.text
+    assert "Runs Sheet Row 3: Run Run1 already exists, updating" in caplog.text
+    assert outcomes.counts("Runs") == {"unchanged": 1, "updated": 1}
+    # only the changed run has a version row for the update
+    assert db_session.query(RunVersion).count() == versions + 1
+
+
+def test_runs_key_repeated_in_later_chunk(db_session):
+    run = {
+        "code": "BENCH0",
+        "run_date": date.fromisoformat("2024-01-01"),
+        "site": "Oxford",
+        "sequencing_method": "illumina",
+        "machine": "M1",
+    }
+    # the rows of BENCH0 are further apart than the chunk size
+    sheet = [
+        [(0, run), (1, run | {"code": "BENCH1"})],
+        [(2, run | {"machine": "M2"}), (3, run | {"code": "BENCH2"})],
+    ]
+
+    counts = []
+    for _ in range(3):
+        outcomes = Outcomes()
+        runs(db_session, sheet, dryrun=False, outcomes=outcomes)
+        # each upload is a transaction of its own
+        db_session.commit()
+        counts.append(outcomes.counts("Runs"))
+        # the last row wins, however often the file is uploaded
+        bench0 = db_session.query(models.Run).filter_by(code="BENCH0").one()
+        assert bench0.machine == "M2"
+
+    # both rows of BENCH0 are imported every time, the other runs are skipped
+    assert counts[0] == {"added": 3, "updated": 1}
+    assert counts[1] == counts[2] == {"skipped": 2, "updated": 2}
+
+
+def test_specimen_detail_errors_logged_per_row(db_session, caplog):
+    specimen = {
+        "owner_site": "SiteC",
+        "owner_user": "User3",
+        "accession": "A1",
+        "collection_date": date.fromisoformat("2024-01-01"),
+        "country_sample_taken_code": "GBR",
+        # an int detail type
+        "isolation_source": "5",
+    }
+    outcomes = Outcomes()
+
+    specimens(
+        db_session,
+        [[(0, specimen), (1, specimen | {"accession": "A2", "isolation_source": "x"})]],
+        dryrun=False,
+        outcomes=outcomes,
+    )
+
+    # only the row with the detail the database rejects fails
+    assert "Specimens Sheet Row 3 :" in caplog.text
+    assert "Specimens Sheet Row 2 :" not in caplog.text
+    assert outcomes.counts("Specimens") == {"added": 1, "failed": 1}
+    detail = (
+        db_session.query(models.SpecimenDetail)
+        .filter_by(specimen_detail_type_code="isolation_source")
+        .one()
+    )
+    assert detail.value_int == 5
+
+
+def test_sample_detail_errors_logged_per_row(db_session, caplog):
+    sample = {
+        "run_code": "Run1",
+        "accession": "123test",
+        "collection_date": date.fromisoformat("2021-01-01"),
+        "guid": "guid1",
+        "extraction_method": None,
+        # a float detail type
+        "extraction_protocol": "1.5",
+        "extraction_user": None,
+    }
+    outcomes = Outcomes()
+
+    samples(
+        db_session,
+        [[(0, sample), (1, sample | {"guid": "guid2", "extraction_protocol": "x"})]],
+        dryrun=False,
+        outcomes=outcomes,
+    )
+
+    # only the row with the detail the database rejects fails
+    assert "Samples Sheet Row 3 :" in caplog.text
+    assert "Samples Sheet Row 2 :" not in caplog.text
+    assert outcomes.counts("Samples") == {"added": 1, "failed": 1}
+    detail = (
+        db_session.query(models.SampleDetail)
+        .filter_by(sample_detail_type_code="extraction_protocol")
+        .one()
+    )
+    assert detail.value_float == 1.5
+
+
+def test_spike_layout():
+    columns = ["guid", "spike_name_2", "spike_quantity_2", "spike_name_1", "spikes"]
+
+    assert spike_layout(columns) == [1, 2]
+
+
+def test_spike_values(caplog):
+    sample_import = SamplesImport(
+        run_code="Run1",
+        accession="123test",
+        collection_date=date.fromisoformat("2021-01-01"),
+        guid="guid1",
+        extraction_method=None,
+        extraction_protocol=None,
+        extraction_user=None,
+        spike_name_1="spike1",
+        spike_quantity_1=10,
+        spike_name_2=None,
+        spike_quantity_2=None,
+        spike_name_3=None,
+        spike_quantity_3="5",
+    )
+
+    assert spike_values(sample_import, [1, 2, 3], 0) == {"spike1": "10"}
+    assert "Samples Sheet Row 2 : spike_name_3 is missing name" in caplog.text
+
+
+def test_sync_spikes(db_session):
+    sample = models.Sample(guid="guid1", run_id=1, specimen_id=1)
+    db_session.add(sample)
+    db_session.flush()
+
+    sync_spikes(db_session, {sample.id: {"spike1": "10", "spike2": "5"}})
+    sync_spikes(db_session, {sample.id: {"spike1": "20", "spike3": "1"}})
+
+    spikes = db_session.query(models.Spike).filter_by(sample_id=sample.id)
+    assert {spike.name: spike.quantity for spike in spikes} == {
+        "spike1": "20",
+        "spike3": "1",
+    }
+
+
+def test_upsert_samples(db_session, caplog):
+    def sample(guid, run_code="Run1", **fields):
+        return {
+            "run_code": run_code,
+            "accession": "123test",
+            "collection_date": date.fromisoformat("2021-01-01"),
+            "guid": guid,
+            "extraction_method": None,
+            "extraction_protocol": None,
+            "extraction_user": None,
+        } | fields
+
+    sample_imports = validate_batch(
+        [
+            (0, sample("guid1", nucleic_acid_type="DNA, RNA")),
+            (1, sample("guid2", run_code="R9")),
+            (2, sample("guid1", sample_category="culture", nucleic_acid_type="RNA")),
+        ],
+        SamplesImport,
+        "Samples Sheet",
+    )
+
+    written = upsert_samples(db_session, sample_imports, dryrun=False)
+
+    assert [(index, s.guid) for index, s, _ in written] == [(0, "guid1"), (2, "guid1")]
+    sample = db_session.get(models.Sample, written[0][2])
+    assert (sample.run.code, sample.specimen.accession) == ("Run1", "123test")
+    # the last row of a repeated guid is the one written
+    assert (sample.sample_category, sample.nucleic_acid_type) == ("culture", ["RNA"])
+    assert "Samples Sheet Row 2: Sample guid1 does not exist, adding" in caplog.text
+    assert "Samples Sheet Row 3 : Run R9 does not exist" in caplog.text
+    assert "Samples Sheet Row 4: Sample guid1 already exists, updating" in caplog.text
+
+
+def test_sample_without_nucleic_acid_type_unchanged(db_session):
+    sample_import = SamplesImport.model_validate(
+        {
+            "run_code": "Run1",
+            "accession": "123test",
+            "collection_date": date.fromisoformat("2021-01-01"),
+            "guid": "guid1",
+            "extraction_method": None,
+            "extraction_protocol": None,
+            "extraction_user": None,
+        }
+    )
+    sample = models.Sample(
+        run=db_session.query(models.Run).first(),
+        specimen=db_session.query(models.Specimen).first(),
+    )
+    db_session.add(sample)
+    sample.update_from_importmodel(sample_import)
+    db_session.commit()
+    # the missing type is stored as an empty list
+    assert sample.nucleic_acid_type == []
+
+    assert not sample.update_from_importmodel(sample_import)
+    assert sample not in db_session.dirty
+
+
+def test_sample_nucleic_acid_type_order_unchanged(db_session, caplog):
+    def sample(nucleic_acid_type):
+        return {
+            "run_code": "Run1",
+            "accession": "123test",
+            "collection_date": date.fromisoformat("2021-01-01"),
+            "guid": "guid1",
+            "extraction_method": None,
+            "extraction_protocol": None,
+            "extraction_user": None,
+            "nucleic_acid_type": nucleic_acid_type,
+        }
+
+    (_, first), (_, second) = validate_batch(
+        [(0, sample("DNA, RNA")), (1, sample("RNA, DNA"))],
+        SamplesImport,
+        "Samples Sheet",
+    )
+    record = models.Sample(
+        run=db_session.query(models.Run).first(),
+        specimen=db_session.query(models.Specimen).first(),
+    )
+    db_session.add(record)
+    record.update_from_importmodel(first)
+    db_session.commit()
+
+    # the same types in another order leave the record unchanged
+    assert not record.update_from_importmodel(second)
+    assert record not in db_session.dirty
+
+    # and the bulk upsert leaves it untouched
+    for types in ("DNA, RNA", "RNA, DNA"):
+        upsert_samples(
+            db_session,
+            validate_batch([(0, sample(types))], SamplesImport, "Samples Sheet"),
+            dryrun=False,
+        )
+    assert "Sample guid1 already exists, unchanged" in caplog.text
+
+
+def test_write_chunk_isolates_failing_rows(db_session, caplog):
+    lookups = ImportLookups()
+
+    def write_row(index, code):
+        if code == "Run1":
+            run_record = db_session.get(models.Run, 1)
+            run_record.comment = "updated"
+            # as an autoflush would, so the update is versioned before the error
+            db_session.flush()
+        else:
+            run_record = models.Run(
+                code=code, site="SiteA", sequencing_method="ont", machine="M1"
+            )
+            db_session.add(run_record)
+            lookups.runs.add(code, run_record)
+        return run_record
+
+    # test1 already exists so adding it again breaks the unique constraint
+    rows = [(0, "Run1"), (1, "R2"), (2, "test1"), (3, "R4")]
+    written = write_chunk(db_session, rows, write_row, "Runs", lookups)
+
+    assert [code for _, code, _ in written] == ["Run1", "R2", "R4"]
+    assert "Runs Sheet Row 4 :" in caplog.text
+    assert "Runs Sheet Row 2 :" not in caplog.text
+    assert "test1" not in lookups.runs.records
+    assert lookups.runs.get_id("R2") is not None
+
+    # the update rolled back with the failing rows is versioned once
+    RunVersion = version_class(models.Run)
+    db_session.flush()
+    versions = db_session.query(RunVersion).filter_by(id=1).all()
+    assert [(v.comment, v.operation_type) for v in versions][-1] == ("updated", 1)
+    assert len({v.transaction_id for v in versions}) == len(versions)
+
+
+def test_validate_data(tmp_path, monkeypatch, caplog):
+    def no_database():
+        raise AssertionError("validate_data connected to the database")
+
+    monkeypatch.setattr("gpaslocal.importer.get_session", no_database)
+    monkeypatch.setattr(error_check_handler, "error_occurred", False)
+
+    specimen = {"accession": "A1", "collection_date": date(2024, 1, 1)}
+    sample = {
+        "guid": "G1",
+        "extraction_method": None,
+        "extraction_protocol": None,
+        "extraction_user": None,
+    }
+    xl = tmp_path / "import.xlsx"
+    with pd.ExcelWriter(xl) as writer:
+        for sheet_name, rows in {
+            "Runs": [
+                {
+                    "code": "R1",
+                    "run_date": date(2024, 1, 1),
+                    "site": "Oxford",
+                    "sequencing_method": "illumina",
+                    "machine": "M1",
+                }
+            ],
+            "Specimens": [
+                specimen
+                | {
+                    "owner_site": "S",
+                    "owner_user": "U",
+                    "country_sample_taken_code": "GBR",
+                }
+            ],
+            "Samples": [
+                sample | specimen | {"run_code": "R1"},
+                sample | specimen | {"run_code": "R2", "guid": "G2"},
+            ],
+            "Storage": [
+                {"accession": "A2", "collection_date": date(2024, 1, 1)}
+                | {"storage_qr_code": "QR1", "date_into_storage": date(2024, 2, 1)}
+                | dict.fromkeys(["freezer", "shelf", "rack", "tray", "box"], "1")
+                | {"box_location": "A1"}
+            ],
+        }.items():
+            pd.DataFrame(rows).to_excel(writer, sheet_name=sheet_name, index=False)
+
+    assert validate_data(str(xl))
+    # references to records outside the workbook are warnings, not errors
+    assert (
+        "Samples Sheet Row 3: Run R2 is not in the Runs sheet, it must already be in the database"
+        in caplog.text
+    )
+    assert "Storage Sheet Row 2: Specimen A2, 2024-01-01 is not in" in caplog.text
+    assert "Samples Sheet Row 2:" not in caplog.text
+
+
+def test_import_many(monkeypatch, caplog):
+    def import_data(excel_wb, dryrun):
+        # each file only sees the errors logged while importing it
+        assert not error_check_handler.error_occurred
+        if excel_wb == "bad.xlsx":
+            logger.error("Runs Sheet Row 2 : bad run")
+        logger.info("imported")
+        return not error_check_handler.error_occurred
+
+    monkeypatch.setattr("gpaslocal.importer.import_data", import_data)
+
+    assert not import_many(
+        ["good.xlsx", "bad.xlsx", "other.xlsx"], jobs=2, dryrun=False
+    )
+    assert "bad.xlsx: Runs Sheet Row 2 : bad run" in caplog.text
+    assert "other.xlsx: imported" in caplog.text
+    assert "good.xlsx: succeeded" in caplog.text
+    assert "bad.xlsx: failed" in caplog.text
+    assert "1 of 3 workbooks failed: bad.xlsx" in caplog.text
+
+    caplog.clear()
+    assert import_many(["good.xlsx"], dryrun=True)
+    assert "All 1 workbooks succeeded" in caplog.text
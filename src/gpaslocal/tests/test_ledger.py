@@ -0,0 +1,104 @@
+from gpaslocal.ledger import (
+    LEDGER_FORMAT,
+    changed_rows,
+    record_hashes,
+    upload_started,
+)
+
+rows = [
+    (0, {"code": "R1", "machine": "M1"}),
+    (1, {"code": "R2", "machine": "M1"}),
+    (2, {"code": "R3", "machine": "M1"}),
+]
+
+
+def test_changed_rows_new(db_session):
+    changed, hashes = changed_rows(db_session, "Runs", rows)
+
+    assert changed == rows
+    assert len(hashes) == 3
+
+
+def test_changed_rows_unchanged(db_session):
+    _, hashes = changed_rows(db_session, "Runs", rows)
+    record_hashes(db_session, "Runs", hashes)
+
+    edited = rows[:2] + [(2, {"code": "R3", "machine": "M2"})]
+    changed, hashes = changed_rows(db_session, "Runs", edited)
+
+    assert changed == [(2, {"code": "R3", "machine": "M2"})]
+    assert list(hashes) == ['["R3"]']
+    # the hashes are per sheet
+    assert changed_rows(db_session, "Storage", rows)[0] == rows
+
+
+def test_changed_rows_force(db_session):
+    _, hashes = changed_rows(db_session, "Runs", rows)
+    record_hashes(db_session, "Runs", hashes)
+
+    changed, forced = changed_rows(db_session, "Runs", rows, force=True)
+
+    assert changed == rows
+    assert forced == hashes
+
+
+def test_changed_rows_ledger_format(db_session, monkeypatch):
+    _, hashes = changed_rows(db_session, "Runs", rows)
+    record_hashes(db_session, "Runs", hashes)
+
+    # a release that changes how rows are imported bumps the format
+    monkeypatch.setattr("gpaslocal.ledger.LEDGER_FORMAT", LEDGER_FORMAT + 1)
+
+    assert changed_rows(db_session, "Runs", rows)[0] == rows
+
+
+def test_changed_rows_repeated_key(db_session):
+    repeated = rows + [(3, {"code": "R1", "machine": "M2"})]
+    _, hashes = changed_rows(db_session, "Runs", repeated)
+    record_hashes(db_session, "Runs", hashes)
+
+    # a key is only skipped when all of its rows are unchanged
+    edited = repeated[:3] + [(3, {"code": "R1", "machine": "M3"})]
+    changed, _ = changed_rows(db_session, "Runs", edited)
+
+    assert [index for index, _ in changed] == [0, 3]
+
+
+def test_changed_rows_key_in_earlier_chunk(db_session):
+    started = upload_started(db_session)
+    for chunk in (rows[:2], rows[2:]):
+        _, hashes = changed_rows(db_session, "Runs", chunk, started=started)
+        record_hashes(db_session, "Runs", hashes)
+    later = [(3, {"code": "R1", "machine": "M2"})]
+
+    changed, hashes = changed_rows(db_session, "Runs", later, started=started)
+    record_hashes(db_session, "Runs", hashes)
+
+    # the key of an earlier chunk is imported and dropped from the ledger
+    assert changed == later
+    assert hashes == {'["R1"]': None}
+    assert changed_rows(db_session, "Runs", rows[:1])[0] == rows[:1]
+    assert changed_rows(db_session, "Runs", rows[1:2])[0] == []
+
+
+def test_changed_rows_key_in_pending_chunk(db_session):
+    started = upload_started(db_session)
+    _, pending = changed_rows(db_session, "Runs", rows[:1], started=started)
+
+    # a chunk read before the earlier one has been recorded
+    changed, hashes = changed_rows(
+        db_session, "Runs", rows, started=started, pending=[pending]
+    )
+
+    assert changed == rows
+    assert hashes['["R1"]'] is None
+    assert hashes['["R2"]'] is not None
+
+
+def test_changed_rows_whole_number_floats(db_session):
+    _, hashes = changed_rows(db_session, "Runs", [(0, {"code": "R1", "count": 2})])
+    record_hashes(db_session, "Runs", hashes)
+
+    changed, _ = changed_rows(db_session, "Runs", [(0, {"code": "R1", "count": 2.0})])
+
+    assert changed == []
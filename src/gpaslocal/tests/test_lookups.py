@@ -0,0 +1,66 @@
+from datetime import date
+from sqlalchemy import event
+from gpaslocal import models
+from gpaslocal.lookups import ImportLookups
+
+
+def record_statements(session):
+    statements = []
+
+    @event.listens_for(session.get_bind(), "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    return statements
+
+
+def test_preload_runs(db_session):
+    lookups = ImportLookups()
+
+    lookups.runs.preload(db_session, ["Run1", "test1", "Run2"])
+
+    assert lookups.runs.get_id("Run1") == 1
+    assert lookups.runs.get(db_session, "test1").site == "Oxford"
+    assert lookups.runs.get_id("Run2") is None
+    assert lookups.runs.get(db_session, "Run2") is None
+    assert lookups.runs.searched == {"Run1", "test1", "Run2"}
+
+
+def test_preload_only_queries_unsearched_keys(db_session):
+    lookups = ImportLookups()
+    lookups.runs.preload(db_session, ["Run1", "Run2"])
+    statements = record_statements(db_session)
+
+    lookups.runs.preload(db_session, ["Run1", "Run2"])
+    assert statements == []
+
+    lookups.runs.preload(db_session, ["Run1", "test1"])
+    assert len(statements) == 1
+
+
+def test_preload_specimens_composite_key(db_session):
+    lookups = ImportLookups()
+    existing = ("123test", date.fromisoformat("2021-01-01"))
+    missing = ("123test", date.fromisoformat("2022-01-01"))
+
+    lookups.specimens.preload(db_session, [existing, missing])
+
+    assert isinstance(lookups.specimens.get(db_session, existing), models.Specimen)
+    assert lookups.specimens.get_id(missing) is None
+
+
+def test_added_records_resolve_without_query(db_session):
+    lookups = ImportLookups()
+    lookups.runs.preload(db_session, ["Run2"])
+    run = models.Run(code="Run2", site="SiteA", sequencing_method="ont", machine="M")
+    db_session.add(run)
+    lookups.runs.add("Run2", run)
+    db_session.flush()
+    lookups.release()
+    statements = record_statements(db_session)
+
+    lookups.runs.preload(db_session, ["Run2"])
+
+    assert lookups.runs.get_id("Run2") == run.id
+    assert lookups.runs.records == {}
+    assert statements == []
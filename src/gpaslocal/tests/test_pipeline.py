@@ -0,0 +1,50 @@
+import threading
+import pytest
+from gpaslocal.logs import error_check_handler, file_logging, logger
+from gpaslocal.pipeline import prefetch
+
+
+def test_prefetch_order():
+    assert list(prefetch(range(10))) == list(range(10))
+
+
+def test_prefetch_error():
+    def items():
+        yield 1
+        raise ValueError("bad chunk")
+
+    chunks = prefetch(items())
+    assert next(chunks) == 1
+    with pytest.raises(ValueError, match="bad chunk"):
+        next(chunks)
+
+
+def test_prefetch_stops_early():
+    produced = []
+
+    def items():
+        for item in range(100):
+            produced.append(item)
+            yield item
+
+    chunks = prefetch(items(), size=2)
+    assert next(chunks) == 0
+    chunks.close()
+
+    # the producer was held back by the queue and has stopped
+    assert len(produced) <= 4
+    assert not any(t.name.startswith("prefetch") for t in threading.enumerate())
+
+
+def test_prefetch_logging(caplog, monkeypatch):
+    monkeypatch.setattr(error_check_handler, "error_occurred", False)
+
+    def items():
+        logger.error("bad row")
+        yield 1
+
+    with file_logging("upload.xlsx"):
+        assert list(prefetch(items())) == [1]
+        # the error was logged for the file of this thread
+        assert logger.error_occurred  # type: ignore
+    assert caplog.messages == ["upload.xlsx: bad row"]
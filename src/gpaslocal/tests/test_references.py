@@ -0,0 +1,88 @@
+from contextlib import closing
+from datetime import date, datetime
+import pandas as pd
+from gpaslocal.references import (
+    check_references,
+    missing_references,
+    workbook_references,
+)
+from gpaslocal.workbook import open_workbook
+
+
+def reference(sheet, row, run_code=None, accession=None, collection_date=None):
+    return {
+        "sheet": sheet,
+        "row": row,
+        "run_code": run_code,
+        "accession": accession,
+        "collection_date": collection_date,
+    }
+
+
+def test_workbook_references(tmp_path):
+    xl = tmp_path / "import.xlsx"
+    with pd.ExcelWriter(xl) as writer:
+        for sheet_name, rows in {
+            "Runs": [{"code": "R1"}],
+            "Specimens": [{"accession": "A1", "collection_date": datetime(2024, 1, 1)}],
+            "Samples": [
+                {"run_code": "R1", "accession": "A1", "collection_date": "2024-01-01"},
+                {"run_code": "R2", "accession": "A1", "collection_date": "2024-01-01"},
+                {"run_code": "R1", "accession": "A2", "collection_date": "not a date"},
+            ],
+            "Storage": [{"accession": 3, "collection_date": datetime(2024, 1, 2)}],
+        }.items():
+            pd.DataFrame(rows).to_excel(writer, sheet_name=sheet_name, index=False)
+
+    with closing(open_workbook(str(xl))) as wb:
+        references = workbook_references(wb)
+
+    # keys in the workbook, and keys that will not validate, are left out
+    assert references == [
+        reference("Samples", 3, run_code="R2"),
+        reference("Storage", 2, accession="3", collection_date=date(2024, 1, 2)),
+    ]
+
+
+def test_missing_references(db_session):
+    references = [
+        reference("Samples", 2, "Run1", "123test", date(2021, 1, 1)),
+        reference("Samples", 3, "R9", "123test", date(2021, 1, 1)),
+        reference("Samples", 4, "Run1", "A9", date(2021, 1, 1)),
+        reference("Samples", 5, "R9"),
+        reference("Storage", 2, None, "A9", date(2021, 1, 1)),
+    ]
+
+    assert missing_references(db_session, references) == {
+        ("Samples", "Run", "R9"): [3, 5],
+        ("Samples", "Specimen", "A9, 2021-01-01"): [4],
+        ("Storage", "Specimen", "A9, 2021-01-01"): [2],
+    }
+
+
+def test_check_references(db_session, tmp_path, caplog):
+    xl = tmp_path / "import.xlsx"
+    with pd.ExcelWriter(xl) as writer:
+        pd.DataFrame(
+            [
+                {
+                    "run_code": "R9",
+                    "accession": "123test",
+                    "collection_date": "2021-01-01",
+                }
+            ]
+            * 12
+        ).to_excel(writer, sheet_name="Samples", index=False)
+        for sheet_name in ("Runs", "Specimens", "Storage"):
+            pd.DataFrame([{"code": None}]).to_excel(
+                writer, sheet_name=sheet_name, index=False
+            )
+
+    with closing(open_workbook(str(xl))) as wb:
+        assert not check_references(db_session, wb)
+
+    assert (
+        "Samples Sheet Rows 2, 3, 4, 5, 6, 7, 8, 9, 10, 11 and 2 more : Run R9 does not exist"
+        in caplog.text
+    )
+    assert "Specimen" not in caplog.text
@@ -0,0 +1,49 @@
+import csv
+import pandas as pd
+from openpyxl import load_workbook  # type: ignore
+from gpaslocal.outcomes import Outcomes
+from gpaslocal.report import write_report
+
+
+def outcomes() -> Outcomes:
+    outcomes = Outcomes()
+    outcomes.added("Runs", 0, "Run R1", dryrun=False)
+    outcomes.existing("Runs", 1, "Run R2", changed=False, dryrun=False)
+    outcomes.failed("Runs", 1, "machine: String should have at most 20", "machine")
+    outcomes.error("Runs", 2, "Run R3 is broken")
+    return outcomes
+
+
+def test_outcome_counts():
+    assert outcomes().counts("Runs") == {"added": 1, "failed": 2}
+
+
+def test_csv_report(tmp_path):
+    path = tmp_path / "report.csv"
+    write_report(outcomes(), "import.xlsx", str(path))
+
+    with open(path, newline="") as file:
+        rows = list(csv.reader(file))
+    assert rows == [
+        ["sheet", "row", "key", "action", "error"],
+        ["Runs", "2", "Run R1", "added", ""],
+        ["Runs", "3", "Run R2", "failed", "machine: String should have at most 20"],
+        ["Runs", "4", "", "failed", "Run R3 is broken"],
+    ]
+
+
+def test_annotated_report(tmp_path):
+    xl = tmp_path / "import.xlsx"
+    pd.DataFrame(
+        {"code": ["R1", "R2", "R3"], "machine": ["M1", "M" * 21, "M1"]}
+    ).to_excel(xl, sheet_name="Runs", index=False)
+    path = tmp_path / "annotated.xlsx"
+
+    write_report(outcomes(), str(xl), str(path))
+
+    ws = load_workbook(path)["Runs"]
+    assert ws["B3"].comment.text == "machine: String should have at most 20"
+    assert ws["B3"].fill.start_color.rgb.endswith("FFC7CE")
+    # an error that is not about a column is on the first cell of the row
+    assert ws["A4"].comment.text == "Run R3 is broken"
+    assert ws["A2"].comment is None and ws["B2"].comment is None
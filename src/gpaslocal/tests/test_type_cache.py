@@ -0,0 +1,55 @@
+from sqlalchemy import event, text
+from gpaslocal import models
+from gpaslocal.type_cache import type_cache
+
+
+def record_statements(session):
+    statements = []
+
+    @event.listens_for(session.get_bind(), "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    return statements
+
+
+def test_types_loaded(db_session):
+    type_cache.invalidate()
+
+    assert type_cache.specimen_detail_types(db_session)["lat"] == "float"
+    assert type_cache.sample_detail_types(db_session)["extraction_date"] == "date"
+    assert type_cache.other_types(db_session) == {}
+
+
+def test_refresh_unchanged(db_session):
+    type_cache.refresh(db_session)
+    statements = record_statements(db_session)
+
+    type_cache.refresh(db_session)
+    type_cache.sample_detail_types(db_session)
+
+    # only the checksum query is run
+    assert len(statements) == 1
+
+
+def test_refresh_changed(db_session):
+    type_cache.refresh(db_session)
+
+    db_session.execute(
+        text(
+            "update sample_detail_types set value_type = 'int' "
+            "where code = 'input_volume'"
+        )
+    )
+    type_cache.refresh(db_session)
+
+    assert type_cache.sample_detail_types(db_session)["input_volume"] == "int"
+
+
+def test_invalidated_by_orm_changes(db_session):
+    type_cache.refresh(db_session)
+
+    db_session.add(models.OtherType(code="coverage", value_type="float"))
+    db_session.flush()
+
+    assert type_cache.other_types(db_session) == {"coverage": "float"}
@@ -0,0 +1,110 @@
+from datetime import date
+import numpy as np
+import pandas as pd
+from pydantic import ValidationError
+from gpaslocal.upload_models import RunImport, SamplesImport
+from gpaslocal.validation import frame_rows, validate_batch, validate_chunks
+
+run = {
+    "code": "R1",
+    "run_date": date(2024, 1, 1),
+    "site": "Oxford",
+    "sequencing_method": "illumina",
+    "machine": "M1",
+}
+
+
+def test_frame_rows():
+    df = pd.DataFrame({"code": ["R1", np.nan], "number_samples": [1.0, np.nan]})
+
+    assert frame_rows(df) == [
+        (0, {"code": "R1", "number_samples": 1.0}),
+        (1, {"code": None, "number_samples": None}),
+    ]
+
+
+def test_validate_batch():
+    rows = [(0, run), (1, run | {"code": "R2", "number_samples": 3})]
+
+    validated = validate_batch(rows, RunImport, "Runs Sheet")
+
+    assert [(index, model.code) for index, model in validated] == [
+        (0, "R1"),
+        (1, "R2"),
+    ]
+    assert validated[1][1].number_samples == 3
+
+
+def test_validate_batch_errors(caplog):
+    rows = [
+        (0, run),
+        (1, run | {"machine": "M" * 21}),
+        (4, run | {"code": "R5"}),
+        (5, run | {"sequencing_method": "morse"}),
+    ]
+
+    validated = validate_batch(rows, RunImport, "Runs Sheet")
+
+    assert [model.code for _, model in validated] == ["R1", "R5"]
+    # the messages are the same as validating each row on its own
+    for index, row in rows[1::2]:
+        try:
+            RunImport(**row)
+        except ValidationError as err:
+            error = err.errors()[0]
+            assert (
+                f"Runs Sheet Row {index+2} {error['loc']} : {error['msg']}"
+                in caplog.text
+            )
+
+
+def test_validate_batch_model_validator(caplog):
+    sample = {
+        "run_code": "R1",
+        "accession": "A1",
+        "collection_date": date(2024, 1, 1),
+        "guid": "G1",
+        "extraction_method": None,
+        "extraction_protocol": None,
+        "extraction_user": None,
+    }
+    rows = [
+        (0, sample | {"nucleic_acid_type": "DNA, RNA"}),
+        (1, sample),
+        (2, sample | {"nucleic_acid_type": "RNA, DNA, RNA"}),
+    ]
+
+    validated = validate_batch(rows, SamplesImport, "Samples Sheet")
+
+    # the types are sorted, whatever order they were entered in
+    assert validated[0][1].nucleic_acid_type == ["DNA", "RNA"]
+    assert validated[2][1].nucleic_acid_type == ["DNA", "RNA"]
+    assert validated[1][1].nucleic_acid_type is None
+    # rows are not changed by validation
+    assert rows[0][1]["nucleic_acid_type"] == "DNA, RNA"
+
+
+def test_validate_chunks_workers(caplog):
+    chunks = [
+        [(0, run), (1, run | {"machine": "M" * 21})],
+        [(2, run | {"code": "R3"}), (3, run | {"sequencing_method": "morse"})],
+        [(4, run | {"code": "R5"})],
+    ]
+
+    serial = list(validate_chunks(chunks, RunImport, "Runs Sheet"))
+    serial_log = caplog.messages
+    caplog.clear()
+    parallel = list(validate_chunks(chunks, RunImport, "Runs Sheet", workers=2))
+
+    assert [[(i, m.code) for i, m in chunk] for chunk in parallel] == [
+        [(0, "R1")],
+        [(2, "R3")],
+        [(4, "R5")],
+    ]
+    assert parallel == serial
+    # the errors are logged in row order by this process
+    assert caplog.messages == serial_log
+    assert [message[:16] for message in caplog.messages] == [
+        "Runs Sheet Row 3",
+        "Runs Sheet Row 5",
+    ]
@@ -0,0 +1,148 @@
+from contextlib import closing
+from datetime import datetime
+from typing import Optional
+import pandas as pd
+from gpaslocal.upload_models import RunImport
+from gpaslocal.workbook import (
+    SHEETS,
+    CachedWorkbook,
+    CachingWorkbook,
+    cached_workbook,
+    open_workbook,
+    read_sheet,
+)
+
+
+def write_workbook(path, sheets):
+    with pd.ExcelWriter(path) as writer:
+        for sheet_name, rows in sheets.items():
+            pd.DataFrame(rows).to_excel(writer, sheet_name=sheet_name, index=False)
+
+
+def test_read_sheet(tmp_path):
+    xl = tmp_path / "import.xlsx"
+    write_workbook(
+        xl,
+        {
+            "Runs": [
+                {"code": 101, "run_date": datetime(2024, 1, 2), "notes": "not a field"},
+                {"code": None, "run_date": None, "notes": None},
+                {"code": "NA", "run_date": None, "notes": "x"},
+                {"code": " R3 ", "run_date": None, "notes": None},
+            ],
+            "Samples": [
+                {"guid": "G1", "spike_name_1": "s1", "spike_quantity_1": 2, "x": 1}
+            ],
+        },
+    )
+
+    with closing(open_workbook(str(xl))) as wb:
+        runs = [row for chunk in read_sheet(wb, "Runs") for row in chunk]
+        samples = [row for chunk in read_sheet(wb, "Samples") for row in chunk]
+
+    # the empty row is skipped, the row index is kept for error messages
+    assert runs == [
+        # a number in a text column is read as it was entered
+        (0, {"code": "101", "run_date": datetime(2024, 1, 2)}),
+        (3, {"code": " R3 ", "run_date": None}),
+    ]
+    assert samples == [
+        (0, {"guid": "G1", "spike_name_1": "s1", "spike_quantity_1": 2}),
+    ]
+
+
+def test_read_sheet_chunks(tmp_path):
+    xl = tmp_path / "import.xlsx"
+    write_workbook(xl, {"Runs": [{"code": f"R{i}"} for i in range(5)]})
+
+    with closing(open_workbook(str(xl))) as wb:
+        chunks = list(read_sheet(wb, "Runs", chunk_size=2))
+
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert chunks[2] == [(4, {"code": "R4"})]
+
+
+def test_cached_workbook(tmp_path, monkeypatch):
+    xl = tmp_path / "import.xlsx"
+    sheets = {
+        "Runs": [
+            {"code": "R1", "run_date": datetime(2024, 1, 2), "number_samples": 3},
+            {"code": None, "run_date": None, "number_samples": None},
+            {"code": 7, "run_date": "not a date", "number_samples": 2.5},
+        ],
+        "Specimens": [{"accession": "A1"}],
+        "Samples": [{"guid": "G1", "spike_name_1": "s1", "spike_quantity_1": 2}],
+        "Storage": [{"accession": "A1"}],
+    }
+    write_workbook(xl, sheets)
+
+    with closing(open_workbook(str(xl))) as wb:
+        parsed = {name: list(read_sheet(wb, name, 2)) for name in sheets}
+
+    # the first open parses the workbook, storing it as it is read
+    with closing(cached_workbook(str(xl))) as wb:
+        assert isinstance(wb, CachingWorkbook)
+        assert {name: list(read_sheet(wb, name, 2)) for name in sheets} == parsed
+
+    def no_openpyxl(excel_wb):
+        raise AssertionError("the workbook was parsed again")
+
+    monkeypatch.setattr("gpaslocal.workbook.open_workbook", no_openpyxl)
+    with closing(cached_workbook(str(xl))) as wb:
+        assert type(wb) is CachedWorkbook
+        assert {name: list(read_sheet(wb, name, 2)) for name in sheets} == parsed
+
+
+def test_cached_workbook_read_twice(tmp_path, monkeypatch):
+    xl = tmp_path / "import.xlsx"
+    write_workbook(xl, {name: [{"code": "R1"}] for name in SHEETS})
+
+    with closing(cached_workbook(str(xl))) as wb:
+        runs = list(read_sheet(wb, "Runs"))
+        # a sheet read again is read from the Parquet written the first time
+        monkeypatch.setattr("gpaslocal.workbook.iter_rows", None)
+        assert list(read_sheet(wb, "Runs")) == runs
+
+
+def test_cached_workbook_not_read(tmp_path):
+    xl = tmp_path / "import.xlsx"
+    write_workbook(xl, {name: [{"code": "R1"}] for name in SHEETS})
+
+    with closing(cached_workbook(str(xl))) as wb:
+        list(read_sheet(wb, "Runs"))
+
+    # a workbook closed before every sheet was read is not stored
+    with closing(cached_workbook(str(xl))) as wb:
+        assert isinstance(wb, CachingWorkbook)
+    assert not any((tmp_path / "cache").iterdir())
+
+
+def test_cached_workbook_fields_changed(tmp_path, monkeypatch):
+    xl = tmp_path / "import.xlsx"
+    write_workbook(
+        xl,
+        {
+            name: [{"code": "R1"}]
+            for name in ("Runs", "Specimens", "Samples", "Storage")
+        },
+    )
+    with closing(cached_workbook(str(xl))) as wb:
+        for name in SHEETS:
+            list(read_sheet(wb, name))
+
+    class NewRunImport(RunImport):
+        new_field: Optional[str] = None
+
+    # a release adding an import field reads the workbook again
+    monkeypatch.setitem(SHEETS, "Runs", NewRunImport)
+    parsed = []
+
+    def counting_open(excel_wb):
+        parsed.append(excel_wb)
+        return open_workbook(excel_wb)
+
+    monkeypatch.setattr("gpaslocal.workbook.open_workbook", counting_open)
+    with closing(cached_workbook(str(xl))):
+        pass
+
+    assert parsed == [str(xl)]
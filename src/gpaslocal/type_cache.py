@@ -0,0 +1,84 @@
+from typing import Any
+from sqlalchemy import String, cast, event, func, literal_column, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.orm import Session
+from gpaslocal import __dbrevision__
+from gpaslocal import models
+from gpaslocal.constants import ValueType
+
+TYPE_MODELS: dict[str, type[Any]] = {
+    "specimen_detail": models.SpecimenDetailType,
+    "sample_detail": models.SampleDetailType,
+    "other": models.OtherType,
+}
+
+
+class TypeCache:
+    """Value types of the detail and other type tables, keyed by type code.
+
+    The types are loaded once and shared by everything in the process. They
+    are keyed by the database revision and a checksum of the type tables,
+    `refresh` reloads them when either has changed.
+    """
+
+    def __init__(self) -> None:
+        self.key: tuple | None = None
+        self.types: dict[str, dict[str, ValueType]] = {}
+
+    def checksum(self, session: Session) -> tuple:
+        """Checksum of each type table, calculated by the database in one query"""
+        checksums = [
+            select(
+                func.md5(
+                    func.string_agg(
+                        model.code + ":" + cast(model.value_type, String),
+                        aggregate_order_by(literal_column("','"), model.code),
+                    )
+                )
+            ).scalar_subquery()
+            for model in TYPE_MODELS.values()
+        ]
+        return tuple(session.execute(select(*checksums)).one())
+
+    def refresh(self, session: Session) -> None:
+        """Reload the types if they have changed, call once per import"""
+        key = (__dbrevision__, self.checksum(session))
+        if key == self.key:
+            return
+
+        self.types = {
+            name: dict(session.execute(select(model.code, model.value_type)).all())  # type: ignore
+            for name, model in TYPE_MODELS.items()
+        }
+        self.key = key
+
+    def invalidate(self) -> None:
+        self.key = None
+        self.types = {}
+
+    def get(self, session: Session, name: str) -> dict[str, ValueType]:
+        if self.key is None:
+            self.refresh(session)
+        return self.types[name]
+
+    def specimen_detail_types(self, session: Session) -> dict[str, ValueType]:
+        return self.get(session, "specimen_detail")
+
+    def sample_detail_types(self, session: Session) -> dict[str, ValueType]:
+        return self.get(session, "sample_detail")
+
+    def other_types(self, session: Session) -> dict[str, ValueType]:
+        return self.get(session, "other")
+
+
+type_cache = TypeCache()
+
+
+def _invalidate(mapper, connection, target) -> None:
+    type_cache.invalidate()
+
+
+# types changed through the ORM are picked up without waiting for a refresh
+for model in TYPE_MODELS.values():
+    for event_name in ("after_insert", "after_update", "after_delete"):
+        event.listen(model, event_name, _invalidate)
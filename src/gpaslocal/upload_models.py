@@ -6,6 +6,7 @@ from pydantic import (
     model_validator,
     PositiveInt,
     Field,
+    ValidationInfo,
 )
 from datetime import date
 from iso3166 import countries
@@ -30,7 +31,10 @@ class ImportModel(BaseModel):
 
     @model_validator(mode="before")
     @classmethod
-    def convert_nan_to_none(cls, data: Any) -> Any:
+    def convert_nan_to_none(cls, data: Any, info: ValidationInfo) -> Any:
+        # batches validated with gpaslocal.validation are converted up front
+        if info.context and info.context.get("nulls_converted"):
+            return data
         for key, value in data.items():
             data[key] = None if pd.isnull(value) else value
         return data
@@ -102,8 +106,9 @@ class SamplesImport(ImportModel):
     def split_nucleic_acid_type(cls, values):
         v = values.get("nucleic_acid_type")
         if pd.notna(v):
-            # Convert to set and back to list to remove duplicates
-            unique_values = list({value.strip() for value in v.split(",")})
+            # Convert to a sorted list to remove duplicates, in the same
+            # order however the values were entered
+            unique_values = sorted({value.strip() for value in v.split(",")})
             # Validate that each value is a valid NucleicAcidType
             for value in unique_values:
                 if value not in NucleicAcidType.__args__:
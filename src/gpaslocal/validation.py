@@ -0,0 +1,141 @@
+import multiprocessing
+from collections import deque
+from concurrent.futures import (
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from functools import cache
+from typing import Any, Callable, Iterable, Iterator, TypeVar
+import pandas as pd  # type: ignore
+from pydantic import TypeAdapter, ValidationError
+from gpaslocal.logs import logger
+from gpaslocal.upload_models import ImportModel
+
+ImportModelT = TypeVar("ImportModelT", bound=ImportModel)
+
+Row = tuple[int, dict[str, Any]]
+
+# the row index, location and message of a validation error
+RowError = tuple[int, tuple, str]
+
+# called with the row index, message and column of each invalid value
+ErrorCallback = Callable[[int, str, str | None], None]
+
+# tells ImportModel that missing values are already None
+NULLS_CONVERTED = {"nulls_converted": True}
+
+
+@cache
+def list_adapter(import_model: type[ImportModel]) -> TypeAdapter:
+    return TypeAdapter(list[import_model])  # type: ignore
+
+
+def frame_rows(df: pd.DataFrame) -> list[Row]:
+    """Rows of a DataFrame with NaN replaced by None a column at a time"""
+    df = df.astype(object).where(df.notna(), None)
+    return list(zip(df.index, df.to_dict("records")))  # type: ignore
+
+
+def validate_batch(
+    rows: Iterable[Row], import_model: type[ImportModelT], label: str
+) -> list[tuple[int, ImportModelT]]:
+    """Validate a batch of rows, logging the errors of each invalid row.
+
+    Missing values in the rows must already be None. Returns the valid rows
+    paired with their row index.
+    """
+    validated, errors = check_batch(rows, import_model)
+    for error in errors:
+        logger.error(error_message(label, error))
+    return validated
+
+
+def check_batch(
+    rows: Iterable[Row], import_model: type[ImportModelT]
+) -> tuple[list[tuple[int, ImportModelT]], list[RowError]]:
+    """Validate a batch of rows, returning the valid rows and the errors"""
+    rows = list(rows)
+    errors: list[RowError] = []
+    adapter = list_adapter(import_model)
+    try:
+        # validators may change the rows, keep the originals for a second pass
+        validated = adapter.validate_python(
+            [dict(row) for _, row in rows], context=NULLS_CONVERTED
+        )
+        return [(index, model) for (index, _), model in zip(rows, validated)], errors
+    except ValidationError as err:
+        invalid = set()
+        for error in err.errors():
+            position, *loc = error["loc"]
+            invalid.add(position)
+            errors.append((rows[int(position)][0], tuple(loc), error["msg"]))
+
+    valid = [row for position, row in enumerate(rows) if position not in invalid]
+    validated = adapter.validate_python(
+        [row for _, row in valid], context=NULLS_CONVERTED
+    )
+    return [(index, model) for (index, _), model in zip(valid, validated)], errors
+
+
+def validate_chunks(
+    chunks: Iterable[list[Row]],
+    import_model: type[ImportModelT],
+    label: str,
+    workers: int = 1,
+    on_error: ErrorCallback | None = None,
+) -> Iterator[list[tuple[int, ImportModelT]]]:
+    """Validate chunks of rows in order, while the caller uses earlier chunks.
+
+    Up to two chunks per worker are validated ahead of the one being used,
+    after which reading more chunks waits for the caller. The errors are
+    logged by this process as each chunk is returned, so they stay in row
+    order, and passed to `on_error` if it is given. Chunks still being
+    validated are cancelled if the caller stops.
+    """
+    executor = validation_pool(workers)
+    pending: deque[Future] = deque()
+    try:
+        for chunk in chunks:
+            pending.append(executor.submit(check_batch, chunk, import_model))
+            if len(pending) > 2 * workers:
+                yield log_errors(pending.popleft(), label, on_error)
+        while pending:
+            yield log_errors(pending.popleft(), label, on_error)
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+@cache
+def validation_pool(workers: int) -> Executor:
+    """Workers shared by every sheet and file the process validates.
+
+    A single worker is a thread, so validation overlaps with the database
+    writes without the cost of starting a process.
+    """
+    if workers <= 1:
+        return ThreadPoolExecutor(1)
+    # spawn, as forking would copy the open database connections
+    return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def log_errors(
+    future: "Future[tuple[list[tuple[int, ImportModelT]], list[RowError]]]",
+    label: str,
+    on_error: ErrorCallback | None = None,
+) -> list[tuple[int, ImportModelT]]:
+    validated, errors = future.result()
+    for error in errors:
+        logger.error(error_message(label, error))
+        if on_error:
+            index, loc, message = error
+            column = str(loc[0]) if loc else None
+            on_error(index, f"{column}: {message}" if column else message, column)
+    return validated
+
+
+def error_message(label: str, error: RowError) -> str:
+    index, loc, message = error
+    return f"{label} Row {index+2} {loc} : {message}"
@@ -0,0 +1,241 @@
+import re
+import shutil
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Iterator, get_args
+from openpyxl import load_workbook  # type: ignore
+from openpyxl.cell.cell import TYPE_ERROR  # type: ignore
+from openpyxl.workbook import Workbook  # type: ignore
+from gpaslocal import cache
+from gpaslocal.constants import ExcelStr
+from gpaslocal.logs import logger
+from gpaslocal.validation import Row
+from gpaslocal.upload_models import (
+    ImportModel,
+    RunImport,
+    SpecimensImport,
+    SamplesImport,
+    StoragesImport,
+)
+
+# the sheets of the workbook in the order they are imported
+SHEETS: dict[str, type[ImportModel]] = {
+    "Runs": RunImport,
+    "Specimens": SpecimensImport,
+    "Samples": SamplesImport,
+    "Storage": StoragesImport,
+}
+
+SPIKE_COLUMN = re.compile(r"^spike_(name|quantity)_(\d+)$")
+
+# columns read in addition to the model fields
+EXTRA_COLUMNS: dict[str, re.Pattern] = {
+    "Samples": SPIKE_COLUMN,
+}
+
+# text that is read as an empty cell, the same as pandas.read_excel
+NA_VALUES = {
+    "",
+    "#N/A",
+    "#N/A N/A",
+    "#NA",
+    "-1.#IND",
+    "-1.#QNAN",
+    "-NaN",
+    "-nan",
+    "1.#IND",
+    "1.#QNAN",
+    "<NA>",
+    "N/A",
+    "NA",
+    "NULL",
+    "NaN",
+    "None",
+    "n/a",
+    "nan",
+    "null",
+}
+
+CHUNK_SIZE = 1000
+
+
+def open_workbook(excel_wb: str) -> Workbook:
+    """Open the workbook in read only mode so sheets are streamed from the file"""
+    return load_workbook(excel_wb, read_only=True, data_only=True, keep_links=False)
+
+
+class CachedWorkbook:
+    """The sheets of a workbook read from the Parquet cache instead of the file"""
+
+    def __init__(self, entry: Path) -> None:
+        self.entry = entry
+
+    def read_sheet(self, sheet_name: str, chunk_size: int) -> Iterator[list[Row]]:
+        if sheet_name not in SHEETS:
+            raise KeyError(f"Worksheet {sheet_name} does not exist.")
+        return cache.read_sheet(self.entry / f"{sheet_name}.parquet", chunk_size)
+
+    def close(self) -> None:
+        pass
+
+
+class CachingWorkbook(CachedWorkbook):
+    """A workbook read from the file that fills its cache entry as it is read.
+
+    Each sheet is written to Parquet while it is streamed to the import, and
+    read from there if it is read again. The entry is stored when the
+    workbook is closed, once every sheet has been read to the end, so a
+    workbook closed early leaves nothing in the cache.
+    """
+
+    def __init__(self, excel_wb: str, entry: Path) -> None:
+        self.wb = open_workbook(excel_wb)
+        try:
+            super().__init__(cache.temporary_entry(entry))
+        except OSError:
+            self.wb.close()
+            raise
+        self.excel_wb = excel_wb
+        self.stored_entry = entry
+        self.complete: set[str] = set()
+        self.failed = False
+
+    def read_sheet(self, sheet_name: str, chunk_size: int) -> Iterator[list[Row]]:
+        if sheet_name in self.complete:
+            yield from super().read_sheet(sheet_name, chunk_size)
+            return
+
+        writer = None if self.failed else cache.SheetWriter(self.sheet_path(sheet_name))
+        try:
+            for chunk in read_sheet(self.wb, sheet_name, chunk_size):
+                if writer:
+                    try:
+                        writer.write(chunk)
+                    except OSError as err:
+                        writer.close()
+                        writer = None
+                        self.fail(err)
+                yield chunk
+            if writer:
+                writer.close()
+                self.complete.add(sheet_name)
+        finally:
+            if writer:
+                writer.close()
+
+    def sheet_path(self, sheet_name: str) -> Path:
+        return self.entry / f"{sheet_name}.parquet"
+
+    def fail(self, err: OSError) -> None:
+        logger.warning(f"Could not cache {self.excel_wb}, reading it directly: {err}")
+        self.failed = True
+
+    def close(self) -> None:
+        self.wb.close()
+        if self.failed or self.complete != set(SHEETS):
+            shutil.rmtree(self.entry, ignore_errors=True)
+            return
+        try:
+            cache.store(self.stored_entry, self.entry)
+        except OSError as err:
+            self.fail(err)
+
+
+def cached_workbook(excel_wb: str) -> Workbook | CachedWorkbook:
+    """Open a workbook through the cache of parsed workbooks.
+
+    The first time a workbook is opened its sheets are stored as Parquet
+    keyed by the digest of the file while they are read, after that they are
+    read from the cache without openpyxl. The workbook is opened as it is
+    when the cache is turned off.
+    """
+    if cache.cache_size() <= 0:
+        return open_workbook(excel_wb)
+
+    entry = cache.entry_path(excel_wb, SHEETS)
+    if entry.exists():
+        cache.touch(entry)
+        return CachedWorkbook(entry)
+    try:
+        return CachingWorkbook(excel_wb, entry)
+    except OSError as err:
+        logger.warning(f"Could not cache {excel_wb}, reading it directly: {err}")
+        return open_workbook(excel_wb)
+
+
+def text_columns(import_model: type[ImportModel]) -> set[str]:
+    return {
+        name
+        for name, field in import_model.model_fields.items()
+        if field.annotation is str or ExcelStr in get_args(field.annotation)
+    }
+
+
+def cell_value(value: Any, data_type: str, text: bool) -> Any:
+    if value is None or data_type == TYPE_ERROR:
+        return None
+    if isinstance(value, str):
+        return None if value in NA_VALUES else value
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    # text columns keep numbers and dates as they were entered
+    if text and not isinstance(value, datetime):
+        return str(value)
+    return value
+
+
+def iter_rows(wb: Workbook, sheet_name: str) -> Iterator[Row]:
+    """Rows of a sheet as dictionaries of the columns the import uses.
+
+    Each row is paired with its index, the sheet row number less two, to match
+    the row numbers the import reports. Empty rows are skipped.
+    """
+    import_model = SHEETS[sheet_name]
+    extra = EXTRA_COLUMNS.get(sheet_name)
+    text = text_columns(import_model)
+
+    ws = wb[sheet_name]
+    # the stored dimensions are not always correct, read until the last row
+    ws.reset_dimensions()
+    rows = ws.iter_rows()
+
+    header = next(rows, ())
+    columns = [
+        (position, str(cell.value))
+        for position, cell in enumerate(header)
+        if cell.value is not None
+        and (
+            str(cell.value) in import_model.model_fields
+            or (extra is not None and extra.match(str(cell.value)) is not None)
+        )
+    ]
+
+    for index, cells in enumerate(rows):
+        row = {
+            column: cell_value(
+                cells[position].value, cells[position].data_type, column in text
+            )
+            if position < len(cells)
+            else None
+            for position, column in columns
+        }
+        if any(value is not None for value in row.values()):
+            yield index, row
+
+
+def read_sheet(
+    wb: Workbook | CachedWorkbook, sheet_name: str, chunk_size: int = CHUNK_SIZE
+) -> Iterator[list[Row]]:
+    """Stream a sheet in chunks of at most chunk_size rows"""
+    if isinstance(wb, CachedWorkbook):
+        yield from wb.read_sheet(sheet_name, chunk_size)
+        return
+
+    chunk: list[Row] = []
+    for row in iter_rows(wb, sheet_name):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk